@@ -17,6 +17,8 @@ bl_info = {
 
 import os
 import bpy
+import time
+import traceback
 import bpy.utils.previews
 import bmesh
 
@@ -35,10 +37,102 @@ from bpy_extras.io_utils import(
         path_reference_mode,
 )
 
+#-------------------------------------------------------------------------------------------------------------------------------
+# Modal Export
+#-------------------------------------------------------------------------------------------------------------------------------
+# Seconds between timer ticks, and how long each tick gets to work before handing control back to Blender
+MODAL_TIMER_INTERVAL = 0.01
+MODAL_TICK_TIME = 0.1
+
+class ModalExport:
+    """Runs the save_steps() generator of an exporter from a timer, a slice of work at a time, so that Blender keeps
+    redrawing and shows the progress in the status bar. Esc stops the export: the scene goes back to the frame it was
+    on and the files being written are thrown away, keeping whatever was there before.
+
+    Only exports started from the file browser run like this; scripts calling the operator get the file written by
+    the time it returns, same as always."""
+
+    Run_Modal: BoolProperty(
+        default=False,
+        options={'HIDDEN', 'SKIP_SAVE'},
+    ) # type: ignore
+
+    steps = None
+    timer = None
+
+    def invoke(self, context, event):
+        self.Run_Modal = True
+        return super().invoke(context, event)
+
+    def start_export(self, context, steps):
+        # Nothing to keep responsive without a window, like when running from the command line
+        if not self.Run_Modal or bpy.app.background or context.window is None:
+            for _ in steps:
+                pass
+            return {'FINISHED'}
+
+        self.steps = steps
+        self.progress = 0.0
+        self.export_start = time.perf_counter()
+        self.previous_frame = context.scene.frame_current
+
+        window_manager = context.window_manager
+        self.timer = window_manager.event_timer_add(MODAL_TIMER_INTERVAL, window=context.window)
+        window_manager.progress_begin(0.0, 1.0)
+        window_manager.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC' and event.value == 'PRESS':
+            try:
+                self.steps.close()
+                context.scene.frame_set(self.previous_frame)
+            finally:
+                self.finish_export(context)
+            self.report({'WARNING'}, "%s cancelled" % self.bl_label)
+            return {'CANCELLED'}
+
+        # Any other input gets swallowed, the scene shouldn't change halfway through the export
+        if event.type != 'TIMER':
+            return {'RUNNING_MODAL'}
+
+        tick_end = time.perf_counter() + MODAL_TICK_TIME
+        try:
+            while time.perf_counter() < tick_end:
+                self.progress = next(self.steps)
+        except StopIteration:
+            self.finish_export(context)
+            return {'FINISHED'}
+        except Exception as error:
+            traceback.print_exc()
+            try:
+                context.scene.frame_set(self.previous_frame)
+            finally:
+                self.finish_export(context)
+            self.report({'ERROR'}, "%s failed: %s" % (self.bl_label, error))
+            return {'CANCELLED'}
+
+        context.window_manager.progress_update(self.progress)
+        context.workspace.status_text_set("%s: %d%%%s, Esc to cancel" % (self.bl_label, self.progress * 100, self.get_time_left_text()))
+        return {'RUNNING_MODAL'}
+
+    def get_time_left_text(self):
+        # Going by the pace so far; the first bit of progress is too little to tell
+        if self.progress < 0.01:
+            return ""
+        elapsed_time = time.perf_counter() - self.export_start
+        time_left = int(elapsed_time * (1.0 - self.progress) / self.progress)
+        return ", %d:%02d left" % (time_left // 60, time_left % 60)
+
+    def finish_export(self, context):
+        context.window_manager.event_timer_remove(self.timer)
+        context.window_manager.progress_end()
+        context.workspace.status_text_set(None)
+
 #-------------------------------------------------------------------------------------------------------------------------------
 # EIF Exporter
 #-------------------------------------------------------------------------------------------------------------------------------
-class ExportEIF(bpy.types.Operator, ExportHelper):
+class ExportEIF(bpy.types.Operator, ModalExport, ExportHelper):
     """Save a static 3ds Max Euroland file, for scenes and entities"""
 
     bl_idname = "export_scene.eif"
@@ -108,6 +202,38 @@ class ExportEIF(bpy.types.Operator, ExportHelper):
         default=1.0,
     ) # type: ignore
 
+    #-------------------------------------------------------------------------------------------------------------------------------
+    # Compression
+    #-------------------------------------------------------------------------------------------------------------------------------
+    Compression: EnumProperty(
+        name="Compression",
+        description="Compress the file while it gets written, adding the extension of the compressor to its name",
+        items=(('NONE', "None", "Plain text file"),
+               ('GZIP', "Gzip", "Fast, writes a .gz file"),
+               ('XZ', "XZ", "Slower but smaller, writes a .xz file")),
+        default='NONE',
+    ) # type: ignore
+
+    Compression_Level: IntProperty(
+        name="Compression level",
+        description="Higher levels give smaller files but take longer",
+        min=0,
+        max=9,
+        default=6,
+    ) # type: ignore
+
+    Stable_Header: BoolProperty(
+        name="Stable header",
+        description="Leave the export date out of the file, so exporting the same scene twice gives the same file and the old one is kept",
+        default=False,
+    ) # type: ignore
+
+    Dry_Run: BoolProperty(
+        name="Dry run",
+        description="Don't write anything; go through the objects and report their counts, how big the file would get and roughly how long the export would take",
+        default=False,
+    ) # type: ignore
+
     #-------------------------------------------------------------------------------------------------------------------------------
     path_mode: path_reference_mode
     check_extension = True
@@ -122,9 +248,15 @@ class ExportEIF(bpy.types.Operator, ExportHelper):
                                             "check_existing",
                                             "filter_glob",
                                             "path_mode",
+                                            "Dry_Run",
+                                            "Run_Modal",
                                         ))
 
-        return eif_export.save(context, **keywords)
+        if self.Dry_Run:
+            from . import eland_estimate
+            return eland_estimate.report_export_estimate(self, context, 'EIF', keywords)
+
+        return self.start_export(context, eif_export.save_steps(context, **keywords))
 
     def draw(self, context):
         pass
@@ -145,6 +277,14 @@ class EIF_EXPORT_PT_Output_Settings(bpy.types.Panel):
         self.layout.prop(context.space_data.active_operator, 'Output_GeomNode')
         self.layout.prop(context.space_data.active_operator, 'Output_PlaceNode')
 
+        compression = self.layout.column()
+        compression.prop(context.space_data.active_operator, 'Compression')
+        level = compression.column()
+        level.enabled = context.space_data.active_operator.Compression != 'NONE'
+        level.prop(context.space_data.active_operator, 'Compression_Level')
+        self.layout.prop(context.space_data.active_operator, 'Stable_Header')
+        self.layout.prop(context.space_data.active_operator, 'Dry_Run')
+
 #-------------------------------------------------------------------------------------------------------------------------------
 class EIF_EXPORT_PT_Mesh_Options(bpy.types.Panel):
     bl_space_type = 'FILE_BROWSER'
@@ -191,7 +331,7 @@ class EIF_EXPORT_PT_Scale_Output(bpy.types.Panel):
 #-------------------------------------------------------------------------------------------------------------------------------
 # ESE Exporter
 #-------------------------------------------------------------------------------------------------------------------------------
-class ExportESE(bpy.types.Operator, ExportHelper):
+class ExportESE(bpy.types.Operator, ModalExport, ExportHelper):
     """Save a dynamic 3ds Max Euroland file; for cutscenes and maps"""
 
     bl_idname = "export_scene.ese"
@@ -280,6 +420,21 @@ class ExportESE(bpy.types.Operator, ExportHelper):
         default=False,
     ) # type: ignore
 
+    Output_Vertex_Animation : BoolProperty(
+        name="Vertex Animation",
+        description="Export the evaluated vertex positions of cloth, soft body and cached meshes (or any with an \"eland_point_cache\" custom property) to a point cache file next to the output",
+        default=False,
+    ) # type: ignore
+
+    Vertex_Motion_Threshold: FloatProperty(
+        name="Vertex motion threshold",
+        description="Vertices that move less than this between frames are left out of the point cache, and the rest are stored in steps of this size",
+        min=0.0,
+        max=1.0,
+        default=0.0001,
+        precision=5,
+    ) # type: ignore
+
     #-------------------------------------------------------------------------------------------------------------------------------
     # Static Output
     #-------------------------------------------------------------------------------------------------------------------------------
@@ -300,6 +455,117 @@ class ExportESE(bpy.types.Operator, ExportHelper):
         default=6,
     ) # type: ignore
 
+    Precision_Mode: EnumProperty(
+        name="Mode",
+        description="How many decimals go into each kind of value",
+        items=(('SINGLE', "Single", "The same decimals for everything"),
+               ('CHANNELS', "Per Channel", "Pick the decimals for each kind of value"),
+               ('AUTO', "Error Bound", "Use the fewest decimals that keep each kind of value within its error bound")),
+        default='SINGLE',
+    ) # type: ignore
+
+    Position_Precision: IntProperty(
+        name="Positions",
+        min=1,
+        max=10,
+        default=4,
+    ) # type: ignore
+
+    UV_Precision: IntProperty(
+        name="UVs",
+        min=1,
+        max=10,
+        default=5,
+    ) # type: ignore
+
+    Normal_Precision: IntProperty(
+        name="Normals",
+        min=1,
+        max=10,
+        default=3,
+    ) # type: ignore
+
+    Color_Precision: IntProperty(
+        name="Colors",
+        min=1,
+        max=10,
+        default=3,
+    ) # type: ignore
+
+    Weight_Precision: IntProperty(
+        name="Weights",
+        min=1,
+        max=10,
+        default=3,
+    ) # type: ignore
+
+    Matrix_Precision: IntProperty(
+        name="Matrices",
+        min=1,
+        max=10,
+        default=5,
+    ) # type: ignore
+
+    Position_Error: FloatProperty(
+        name="Positions",
+        description="Largest difference allowed between a value and its printed version",
+        min=0.0000000001,
+        max=1.0,
+        default=0.0001,
+        precision=6,
+    ) # type: ignore
+
+    UV_Error: FloatProperty(
+        name="UVs",
+        description="Largest difference allowed between a value and its printed version",
+        min=0.0000000001,
+        max=1.0,
+        default=0.00001,
+        precision=6,
+    ) # type: ignore
+
+    Normal_Error: FloatProperty(
+        name="Normals",
+        description="Largest difference allowed between a value and its printed version",
+        min=0.0000000001,
+        max=1.0,
+        default=0.001,
+        precision=6,
+    ) # type: ignore
+
+    Color_Error: FloatProperty(
+        name="Colors",
+        description="Largest difference allowed between a value and its printed version",
+        min=0.0000000001,
+        max=1.0,
+        default=0.001,
+        precision=6,
+    ) # type: ignore
+
+    Weight_Error: FloatProperty(
+        name="Weights",
+        description="Largest difference allowed between a value and its printed version",
+        min=0.0000000001,
+        max=1.0,
+        default=0.001,
+        precision=6,
+    ) # type: ignore
+
+    Matrix_Error: FloatProperty(
+        name="Matrices",
+        description="Largest difference allowed between a value and its printed version",
+        min=0.0000000001,
+        max=1.0,
+        default=0.00001,
+        precision=6,
+    ) # type: ignore
+
+    Trim_Trailing_Zeros: BoolProperty(
+        name="Trim trailing zeros",
+        description="End the decimals at their last significant digit, always leaving one",
+        default=False,
+    ) # type: ignore
+
     #-------------------------------------------------------------------------------------------------------------------------------
     # Scale
     #-------------------------------------------------------------------------------------------------------------------------------
@@ -310,6 +576,47 @@ class ExportESE(bpy.types.Operator, ExportHelper):
         default=1.0,
     )# type: ignore
 
+    #-------------------------------------------------------------------------------------------------------------------------------
+    # Compression
+    #-------------------------------------------------------------------------------------------------------------------------------
+    Compression: EnumProperty(
+        name="Compression",
+        description="Compress the file while it gets written, adding the extension of the compressor to its name",
+        items=(('NONE', "None", "Plain text file"),
+               ('GZIP', "Gzip", "Fast, writes a .gz file"),
+               ('XZ', "XZ", "Slower but smaller, writes a .xz file")),
+        default='NONE',
+    ) # type: ignore
+
+    Compression_Level: IntProperty(
+        name="Compression level",
+        description="Higher levels give smaller files but take longer",
+        min=0,
+        max=9,
+        default=6,
+    ) # type: ignore
+
+    Stable_Header: BoolProperty(
+        name="Stable header",
+        description="Leave the export date out of the file, so exporting the same scene twice gives the same file and the old one is kept",
+        default=False,
+    ) # type: ignore
+
+    Shard_Output: EnumProperty(
+        name="Shards",
+        description="Split the scene into a folder of files, listed in order with their hashes by an index file next to it",
+        items=(('NONE', "Single File", "Everything in one file"),
+               ('OBJECT', "Per Object", "A file for every object"),
+               ('COLLECTION', "Per Collection", "A file for every collection")),
+        default='NONE',
+    ) # type: ignore
+
+    Dry_Run: BoolProperty(
+        name="Dry run",
+        description="Don't write anything; go through the objects and report their counts, how big the file would get and roughly how long the export would take",
+        default=False,
+    ) # type: ignore
+
     #-------------------------------------------------------------------------------------------------------------------------------
     # Controller Output
     #-------------------------------------------------------------------------------------------------------------------------------
@@ -345,6 +652,112 @@ class ExportESE(bpy.types.Operator, ExportHelper):
         default=False,
     ) # type: ignore
 
+    Controller_Type: EnumProperty(
+        name="Controllers",
+        items=(('BAKED', "Baked frames", "Output the full transform matrix of every frame"),
+               ('KEYFRAMES', "Keyframe tracks", "Output position, rotation and scale tracks holding only the source keyframes. Objects moved by parents, constraints or drivers are still baked")
+            ),
+        description="How to output the transform animation of objects",
+        default='BAKED'
+    ) # type: ignore
+
+    Clip_Source: EnumProperty(
+        name="Clips",
+        items=(('NONE', "Single file", "Output the scene animation as it is, in a single file"),
+               ('ACTIONS', "Actions", "Output one file per action made for the active object, assigned to it in turn"),
+               ('NLA', "NLA strips", "Output one file per NLA strip of the active object, using the range of its action"),
+               ('MARKERS', "Marker ranges", "Output one file per timeline marker, until the next one")
+            ),
+        description="Split the animation into clips; the main file only holds the static data and each clip gets its own file next to it",
+        default='NONE'
+    ) # type: ignore
+
+    Frame_Step: IntProperty(
+        name="Sample every n frames",
+        description="Only output every n-th frame of the sampled animation, plus the last one. Objects can override it with an integer \"eland_frame_step\" custom property",
+        min=1,
+        max=100,
+        default=1,
+    ) # type: ignore
+
+    Fast_Animation_Sampling : BoolProperty(
+        name="Evaluate F-Curves directly",
+        description="Sample objects, shape keys, lights and cameras animated only by plain F-Curves without stepping through the timeline. Anything with parents, constraints or drivers still gets evaluated frame by frame",
+        default=True,
+    ) # type: ignore
+
+    Prune_Evaluation : BoolProperty(
+        name="Skip unrelated modifiers",
+        description="While stepping through the timeline, turn off the viewport modifiers of objects that nothing exported depends on. Faster on heavy scenes, but anything reaching the exported objects in ways that can't be followed gets left out",
+        default=False,
+    ) # type: ignore
+
+    Use_Sample_Cache : BoolProperty(
+        name="Cache sampled animation",
+        description="Keep the sampled animation in a \".eland_cache\" folder next to the output, and reuse the tracks of objects whose animation didn't change on the next export",
+        default=False,
+    ) # type: ignore
+
+    Sample_Cache_Size: IntProperty(
+        name="Cache size (MB)",
+        description="Once the cache folder grows past this size, the least recently used tracks are removed",
+        min=1,
+        max=65536,
+        default=512,
+    ) # type: ignore
+
+    Reduce_Keyframes : BoolProperty(
+        name="Reduce keyframes",
+        description="Only output the frames needed to reproduce the sampled animation within the tolerances below",
+        default=False,
+    ) # type: ignore
+
+    Position_Tolerance: FloatProperty(
+        name="Position tolerance",
+        description="Largest distance a reduced position track may stray from the sampled one",
+        min=0.0,
+        max=1000.0,
+        default=0.001,
+        precision=4,
+    ) # type: ignore
+
+    Rotation_Tolerance: FloatProperty(
+        name="Rotation tolerance",
+        description="Largest angle a reduced rotation track may stray from the sampled one",
+        subtype='ANGLE',
+        min=0.0,
+        max=3.14159,
+        default=0.001,
+        precision=4,
+    ) # type: ignore
+
+    Scale_Tolerance: FloatProperty(
+        name="Scale tolerance",
+        description="Largest difference a reduced scale track may have from the sampled one",
+        min=0.0,
+        max=1000.0,
+        default=0.001,
+        precision=4,
+    ) # type: ignore
+
+    Weight_Tolerance: FloatProperty(
+        name="Morph weight tolerance",
+        description="Largest difference a reduced shape key weight track may have from the sampled one",
+        min=0.0,
+        max=1.0,
+        default=0.001,
+        precision=4,
+    ) # type: ignore
+
+    Focal_Length_Tolerance: FloatProperty(
+        name="Focal length tolerance",
+        description="Largest difference in millimetres a reduced focal length track may have from the sampled one",
+        min=0.0,
+        max=1000.0,
+        default=0.01,
+        precision=4,
+    ) # type: ignore
+
     #-------------------------------------------------------------------------------------------------------------------------------
     path_mode: path_reference_mode
     check_extension = True
@@ -374,9 +787,15 @@ class ExportESE(bpy.types.Operator, ExportHelper):
                                             "check_existing",
                                             "filter_glob",
                                             "path_mode",
+                                            "Dry_Run",
+                                            "Run_Modal",
                                             ))
 
-        return ese_export.save(context, **keywords)
+        if self.Dry_Run:
+            from . import eland_estimate
+            return eland_estimate.report_export_estimate(self, context, 'ESE', keywords)
+
+        return self.start_export(context, ese_export.save_steps(context, **keywords))
 
     def draw(self, context):
         pass
@@ -399,6 +818,15 @@ class ESE_EXPORT_PT_Output_Options(bpy.types.Panel):
         self.layout.prop(context.space_data.active_operator, 'Output_CameraLightAnims')
         self.layout.prop(context.space_data.active_operator, 'Transform_Center')
 
+        compression = self.layout.column()
+        compression.prop(context.space_data.active_operator, 'Compression')
+        level = compression.column()
+        level.enabled = context.space_data.active_operator.Compression != 'NONE'
+        level.prop(context.space_data.active_operator, 'Compression_Level')
+        self.layout.prop(context.space_data.active_operator, 'Stable_Header')
+        self.layout.prop(context.space_data.active_operator, 'Shard_Output')
+        self.layout.prop(context.space_data.active_operator, 'Dry_Run')
+
 #-------------------------------------------------------------------------------------------------------------------------------
 class ESE_EXPORT_PT_Object_Types(bpy.types.Panel):
     bl_space_type = 'FILE_BROWSER'
@@ -429,6 +857,11 @@ class ESE_EXPORT_PT_Mesh_Options(bpy.types.Panel):
         self.layout.prop(context.space_data.active_operator, 'Output_Mesh_UV')
         self.layout.prop(context.space_data.active_operator, 'Output_Mesh_Vertex_Colors')
         self.layout.prop(context.space_data.active_operator, 'Output_Mesh_Morph')
+        self.layout.prop(context.space_data.active_operator, 'Output_Vertex_Animation')
+
+        threshold = self.layout.column()
+        threshold.enabled = context.space_data.active_operator.Output_Vertex_Animation
+        threshold.prop(context.space_data.active_operator, 'Vertex_Motion_Threshold')
 
 #-------------------------------------------------------------------------------------------------------------------------------
 class ESE_EXPORT_PT_Static_Output(bpy.types.Panel):
@@ -456,7 +889,18 @@ class ESE_EXPORT_PT_Decimals_Precision(bpy.types.Panel):
         return context.space_data.active_operator.bl_idname == "EXPORT_SCENE_OT_ese"
 
     def draw(self, context):
-        self.layout.prop(context.space_data.active_operator, 'Decimal_Precision')
+        operator = context.space_data.active_operator
+        self.layout.prop(operator, 'Decimal_Precision')
+        self.layout.prop(operator, 'Precision_Mode')
+
+        # Positions, UVs, normals, colors, weights and transform matrices can each have their own
+        channels = self.layout.column()
+        channels.enabled = operator.Precision_Mode != 'SINGLE'
+        setting = 'Error' if operator.Precision_Mode == 'AUTO' else 'Precision'
+        for channel in ('Position', 'UV', 'Normal', 'Color', 'Weight', 'Matrix'):
+            channels.prop(operator, '%s_%s' % (channel, setting))
+
+        self.layout.prop(operator, 'Trim_Trailing_Zeros')
 
 #-------------------------------------------------------------------------------------------------------------------------------
 class ESE_EXPORT_PT_Scale_Output(bpy.types.Panel):
@@ -489,11 +933,31 @@ class ESE_EXPORT_PT_Controller_Output(bpy.types.Panel):
         self.layout.prop(context.space_data.active_operator, 'Enable_End_With_Frame')
         self.layout.prop(context.space_data.active_operator, 'End_With_Frame')
         self.layout.prop(context.space_data.active_operator, 'Output_First_Only')
+        self.layout.prop(context.space_data.active_operator, 'Controller_Type')
+        self.layout.prop(context.space_data.active_operator, 'Clip_Source')
+        self.layout.prop(context.space_data.active_operator, 'Frame_Step')
+        self.layout.prop(context.space_data.active_operator, 'Fast_Animation_Sampling')
+        self.layout.prop(context.space_data.active_operator, 'Prune_Evaluation')
+        self.layout.prop(context.space_data.active_operator, 'Use_Sample_Cache')
+
+        cache_size = self.layout.column()
+        cache_size.enabled = context.space_data.active_operator.Use_Sample_Cache
+        cache_size.prop(context.space_data.active_operator, 'Sample_Cache_Size')
+
+        self.layout.prop(context.space_data.active_operator, 'Reduce_Keyframes')
+
+        tolerances = self.layout.column()
+        tolerances.enabled = context.space_data.active_operator.Reduce_Keyframes
+        tolerances.prop(context.space_data.active_operator, 'Position_Tolerance')
+        tolerances.prop(context.space_data.active_operator, 'Rotation_Tolerance')
+        tolerances.prop(context.space_data.active_operator, 'Scale_Tolerance')
+        tolerances.prop(context.space_data.active_operator, 'Weight_Tolerance')
+        tolerances.prop(context.space_data.active_operator, 'Focal_Length_Tolerance')
 
 #-------------------------------------------------------------------------------------------------------------------------------
 # RTG Exporter
 #-------------------------------------------------------------------------------------------------------------------------------
-class ExportRTG(bpy.types.Operator, ExportHelper):
+class ExportRTG(bpy.types.Operator, ModalExport, ExportHelper):
     """Save a dynamic Maya Euroland file; for animations, scripts and maps"""
 
     bl_idname = "export_scene.rtg"
@@ -612,6 +1076,32 @@ class ExportRTG(bpy.types.Operator, ExportHelper):
         default=1.0,
     )# type: ignore
 
+    #-------------------------------------------------------------------------------------------------------------------------------
+    # Compression
+    #-------------------------------------------------------------------------------------------------------------------------------
+    Compression: EnumProperty(
+        name="Compression",
+        description="Compress the file while it gets written, adding the extension of the compressor to its name",
+        items=(('NONE', "None", "Plain text file"),
+               ('GZIP', "Gzip", "Fast, writes a .gz file"),
+               ('XZ', "XZ", "Slower but smaller, writes a .xz file")),
+        default='NONE',
+    ) # type: ignore
+
+    Compression_Level: IntProperty(
+        name="Compression level",
+        description="Higher levels give smaller files but take longer",
+        min=0,
+        max=9,
+        default=6,
+    ) # type: ignore
+
+    Dry_Run: BoolProperty(
+        name="Dry run",
+        description="Don't write anything; go through the objects and report their counts, how big the file would get and roughly how long the export would take",
+        default=False,
+    ) # type: ignore
+
     #-------------------------------------------------------------------------------------------------------------------------------
     # Controller Output
     #-------------------------------------------------------------------------------------------------------------------------------
@@ -647,6 +1137,83 @@ class ExportRTG(bpy.types.Operator, ExportHelper):
         default=False,
     ) # type: ignore
 
+    Frame_Step: IntProperty(
+        name="Sample every n frames",
+        description="Only output every n-th frame of the sampled animation, plus the last one. Objects can override it with an integer \"eland_frame_step\" custom property",
+        min=1,
+        max=100,
+        default=1,
+    ) # type: ignore
+
+    Fast_Animation_Sampling : BoolProperty(
+        name="Evaluate F-Curves directly",
+        description="Sample objects, shape keys, lights and cameras animated only by plain F-Curves without stepping through the timeline. Anything with parents, constraints or drivers still gets evaluated frame by frame",
+        default=True,
+    ) # type: ignore
+
+    Prune_Evaluation : BoolProperty(
+        name="Skip unrelated modifiers",
+        description="While stepping through the timeline, turn off the viewport modifiers of objects that nothing exported depends on. Faster on heavy scenes, but anything reaching the exported objects in ways that can't be followed gets left out",
+        default=False,
+    ) # type: ignore
+
+    Use_Sample_Cache : BoolProperty(
+        name="Cache sampled animation",
+        description="Keep the sampled animation in a \".eland_cache\" folder next to the output, and reuse the tracks of objects whose animation didn't change on the next export",
+        default=False,
+    ) # type: ignore
+
+    Sample_Cache_Size: IntProperty(
+        name="Cache size (MB)",
+        description="Once the cache folder grows past this size, the least recently used tracks are removed",
+        min=1,
+        max=65536,
+        default=512,
+    ) # type: ignore
+
+    Reduce_Keyframes : BoolProperty(
+        name="Reduce keyframes",
+        description="Only output the frames needed to reproduce the sampled animation within the tolerances below",
+        default=False,
+    ) # type: ignore
+
+    Position_Tolerance: FloatProperty(
+        name="Position tolerance",
+        description="Largest distance a reduced position track may stray from the sampled one",
+        min=0.0,
+        max=1000.0,
+        default=0.001,
+        precision=4,
+    ) # type: ignore
+
+    Rotation_Tolerance: FloatProperty(
+        name="Rotation tolerance",
+        description="Largest angle a reduced rotation track may stray from the sampled one",
+        subtype='ANGLE',
+        min=0.0,
+        max=3.14159,
+        default=0.001,
+        precision=4,
+    ) # type: ignore
+
+    Scale_Tolerance: FloatProperty(
+        name="Scale tolerance",
+        description="Largest difference a reduced scale track may have from the sampled one",
+        min=0.0,
+        max=1000.0,
+        default=0.001,
+        precision=4,
+    ) # type: ignore
+
+    Focal_Length_Tolerance: FloatProperty(
+        name="Focal length tolerance",
+        description="Largest difference in millimetres a reduced focal length track may have from the sampled one",
+        min=0.0,
+        max=1000.0,
+        default=0.01,
+        precision=4,
+    ) # type: ignore
+
     #-------------------------------------------------------------------------------------------------------------------------------
     path_mode: path_reference_mode
     check_extension = True
@@ -676,9 +1243,15 @@ class ExportRTG(bpy.types.Operator, ExportHelper):
                                             "check_existing",
                                             "filter_glob",
                                             "path_mode",
+                                            "Dry_Run",
+                                            "Run_Modal",
                                             ))
 
-        return rtg_export.save(context, **keywords)
+        if self.Dry_Run:
+            from . import eland_estimate
+            return eland_estimate.report_export_estimate(self, context, 'RTG', keywords)
+
+        return self.start_export(context, rtg_export.save_steps(context, **keywords))
 
     #-------------------------------------------------------------------------------------------------------------------------------
     def draw(self, context):
@@ -702,6 +1275,13 @@ class RTG_EXPORT_PT_Output_Options(bpy.types.Panel):
         self.layout.prop(context.space_data.active_operator, 'Output_CameraLightAnims')
         self.layout.prop(context.space_data.active_operator, 'Transform_Center')
 
+        compression = self.layout.column()
+        compression.prop(context.space_data.active_operator, 'Compression')
+        level = compression.column()
+        level.enabled = context.space_data.active_operator.Compression != 'NONE'
+        level.prop(context.space_data.active_operator, 'Compression_Level')
+        self.layout.prop(context.space_data.active_operator, 'Dry_Run')
+
 #-------------------------------------------------------------------------------------------------------------------------------
 class RTG_EXPORT_PT_Object_Types(bpy.types.Panel):
     bl_space_type = 'FILE_BROWSER'
@@ -792,6 +1372,23 @@ class RTG_EXPORT_PT_Controller_Output(bpy.types.Panel):
         self.layout.prop(context.space_data.active_operator, 'Enable_End_With_Frame')
         self.layout.prop(context.space_data.active_operator, 'End_With_Frame')
         self.layout.prop(context.space_data.active_operator, 'Output_First_Only')
+        self.layout.prop(context.space_data.active_operator, 'Frame_Step')
+        self.layout.prop(context.space_data.active_operator, 'Fast_Animation_Sampling')
+        self.layout.prop(context.space_data.active_operator, 'Prune_Evaluation')
+        self.layout.prop(context.space_data.active_operator, 'Use_Sample_Cache')
+
+        cache_size = self.layout.column()
+        cache_size.enabled = context.space_data.active_operator.Use_Sample_Cache
+        cache_size.prop(context.space_data.active_operator, 'Sample_Cache_Size')
+
+        self.layout.prop(context.space_data.active_operator, 'Reduce_Keyframes')
+
+        tolerances = self.layout.column()
+        tolerances.enabled = context.space_data.active_operator.Reduce_Keyframes
+        tolerances.prop(context.space_data.active_operator, 'Position_Tolerance')
+        tolerances.prop(context.space_data.active_operator, 'Rotation_Tolerance')
+        tolerances.prop(context.space_data.active_operator, 'Scale_Tolerance')
+        tolerances.prop(context.space_data.active_operator, 'Focal_Length_Tolerance')
 
 #-------------------------------------------------------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------------------------------------------------------
@@ -1162,6 +1759,43 @@ class TOOLS_PANEL_PT_eurocom(bpy.types.Panel):
             for line in text_list:
                 text_row.label(text=(' ' * 6) + line)
         
+#-------------------------------------------------------------------------------------------------------------------------------
+# Add-on preferences, shared by every exporter
+#-------------------------------------------------------------------------------------------------------------------------------
+class EurolandPreferences(bpy.types.AddonPreferences):
+    bl_idname = __name__
+
+    Write_Buffer_Size: IntProperty(
+        name="Write Buffer Size (KB)",
+        description="Amount of text gathered in memory before it gets written to the file. Bigger buffers mean fewer and larger writes",
+        default=1024,
+        min=4,
+        max=262144,
+    ) # type: ignore
+
+    Format_Workers: IntProperty(
+        name="Format Workers",
+        description="Processes that turn big mesh tables into text in parallel. With 0 everything gets formatted inside Blender",
+        default=0,
+        min=0,
+        max=64,
+    ) # type: ignore
+
+    Format_Pool_Rows: IntProperty(
+        name="Format Pool Rows",
+        description="Tables with fewer rows than this get formatted inside Blender, where sending them to the workers costs more than it saves",
+        default=100000,
+        min=1000,
+        max=10000000,
+    ) # type: ignore
+
+    def draw(self, context):
+        self.layout.prop(self, "Write_Buffer_Size")
+        self.layout.prop(self, "Format_Workers")
+        row = self.layout.row()
+        row.enabled = self.Format_Workers > 0
+        row.prop(self, "Format_Pool_Rows")
+
 #-------------------------------------------------------------------------------------------------------------------------------
 # swy: global variable to store icons in
 #-------------------------------------------------------------------------------------------------------------------------------
@@ -1223,7 +1857,8 @@ classes = (
     ESelectChFlags,
     ESelectNoFlags,
 
-    EuroProperties
+    EuroProperties,
+    EurolandPreferences
 )
 
 menu_export = (menu_func_eif_export, menu_func_ese_export, menu_func_rtg_export)
@@ -1267,5 +1902,8 @@ def unregister():
     for cls in reversed(classes):
         bpy.utils.unregister_class(cls)
 
+    from .eland_utils import shutdown_format_pool
+    shutdown_format_pool()
+
 if __name__ == '__main__':
     register()
@@ -11,12 +11,15 @@ Authors: Swyter and Jmarti856
 
 import os
 import bpy
+import time
+import numpy as np
 from math import degrees
 from pathlib import Path
 from mathutils import Matrix
 from datetime import datetime
 from bpy_extras.node_shader_utils import PrincipledBSDFWrapper
 from .eland_utils import *
+from .eland_estimate import record_export_throughput
 
 #-------------------------------------------------------------------------------------------------------------------------------
 EXPORT_TRI=False
@@ -30,7 +33,11 @@ def _write(context, filepath,
            EXPORT_UV,
            EXPORT_VERTEX_COLORS,
            DECIMAL_PRECISION,
-           GLOBAL_SCALE
+           GLOBAL_SCALE,
+           COMPRESSION,
+           COMPRESSION_LEVEL,
+           STABLE_HEADER,
+           STREAM=None
         ):
    
     df = f'%.{DECIMAL_PRECISION}f'
@@ -148,7 +155,9 @@ def _write(context, filepath,
     def write_mesh_data(out, scene, depsgraph, materials_list):
         matrix_data = {}
 
-        for ob_main in scene.objects:
+        for ob_index, ob_main in enumerate(scene.objects):
+            yield ob_index / len(scene.objects)
+
             # ignore dupli children
             if ob_main.parent and ob_main.parent.instance_type in {'VERTS', 'FACES'}:
                 continue
@@ -239,29 +248,22 @@ def _write(context, filepath,
 
                 # Vert
                 faceformat = "V"
-                out.write('\t*VERTEX_LIST {\n')
-                for v in unique_vertices:
-                    out.write(f'\t\t{df} {df} {df}\n' % (v[0], v[1], v[2]))
-                out.write('\t}\n')
+                with out.begin_block('*VERTEX_LIST', 1):
+                    out.table(f'\t\t{df} {df} {df}\n', unique_vertices)
 
                 # Textures
                 if EXPORT_UV:
-                    out.write('\t*UV_LIST {\n')
-                    if unique_uvs:
-                        faceformat = faceformat + "T"
-                        for uv in unique_uvs:
-                            out.write(f'\t\t{df} {df}\n' % (uv[0], -uv[1]))
-                    out.write('\t}\n')
+                    with out.begin_block('*UV_LIST', 1):
+                        if unique_uvs:
+                            faceformat = faceformat + "T"
+                            out.table(f'\t\t{df} {df}\n', np.multiply(np.reshape(unique_uvs, (-1, 2)), (1, -1)))
 
                 # Colors
                 if EXPORT_VERTEX_COLORS:
-                    out.write('\t*VERTCOL_LIST {\n')
-                    if unique_colors:
-                        faceformat = faceformat + "C"
-                        for col in unique_colors:
-                            color_corrected = adjust_rgb(col[0], col[1], col[2], col[3], 0.57)
-                            out.write(f'\t\t{df} {df} {df} {df}\n' % (color_corrected[0], color_corrected[1], color_corrected[2], color_corrected[3]))
-                    out.write('\t}\n')
+                    with out.begin_block('*VERTCOL_LIST', 1):
+                        if unique_colors:
+                            faceformat = faceformat + "C"
+                            out.rows(f'\t\t{df} {df} {df} {df}\n', (adjust_rgb(col[0], col[1], col[2], col[3], 0.57) for col in unique_colors))
 
                 # Materials
                 if EXPORT_UV and len(me.materials) > 0:
@@ -414,9 +416,13 @@ def _write(context, filepath,
         plugin_version = get_plugin_version()
 
         # Create text file
-        with open(filepath, 'w', encoding="utf8",) as out:
+        start = time.perf_counter()
+        with open_eland_file(filepath, get_write_buffer_size(context), COMPRESSION, COMPRESSION_LEVEL, STREAM, pipelined=True, format_pool=get_format_pool(context)) as out:
             out.write("*EUROCOM_INTERCHANGE_FILE 100\n")
-            out.write('*COMMENT Eurocom Interchange File Version 1.00 %s\n' % datetime.now().strftime("%A %B %d %Y %H:%M"))
+            if STABLE_HEADER:
+                out.write('*COMMENT Eurocom Interchange File Version 1.00\n')
+            else:
+                out.write('*COMMENT Eurocom Interchange File Version 1.00 %s\n' % datetime.now().strftime("%A %B %d %Y %H:%M"))
             out.write('*COMMENT Version of eif-plugin that wrote this file %d.%d\n' % (plugin_version[0], plugin_version[1]))
             out.write('*COMMENT Version of blender that wrote this file %s\n\n' % bpy.app.version_string)
             out.write("*OPTIONS {\n")
@@ -425,7 +431,7 @@ def _write(context, filepath,
 
             write_scene_data(out, scene)
             processed_materials = write_materials(out)
-            mesh_position_data = write_mesh_data(out, scene, depsgraph, processed_materials)
+            mesh_position_data = yield from write_mesh_data(out, scene, depsgraph, processed_materials)
 
             if EXPORT_GEOMNODE:
                 write_geom_and_place_node(out, mesh_position_data, True)
@@ -433,28 +439,46 @@ def _write(context, filepath,
             if EXPORT_PLACENODE:
                 write_geom_and_place_node(out, mesh_position_data)                
 
-    write_eif_file()
+        # What the dry run goes by next time
+        record_export_throughput('EIF', out.written_size, time.perf_counter() - start)
+
+    yield from write_eif_file()
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def save_steps(context, 
+               filepath, 
+               *, 
+               Output_GeomNode, 
+               Output_PlaceNode, 
+               Transform_Center,
+               Output_Mesh_UV,
+               Output_Mesh_Vertex_Colors,
+               Decimal_Precision,
+               Output_Scale,
+               Compression,
+               Compression_Level,
+               Stable_Header,
+               stream=None):
+    """Same as save(), as a generator that exports a bit at a time and yields the progress from 0 to 1 in between.
+    Closing it cancels the export, leaving any file it was going to replace as it was."""
+
+    return _write(context, filepath, 
+                  EXPORT_GEOMNODE=Output_GeomNode,
+                  EXPORT_PLACENODE=Output_PlaceNode, 
+                  TRANSFORM_TO_CENTER=Transform_Center, 
+                  EXPORT_UV=Output_Mesh_UV,
+                  EXPORT_VERTEX_COLORS=Output_Mesh_Vertex_Colors,
+                  DECIMAL_PRECISION=Decimal_Precision,
+                  GLOBAL_SCALE=Output_Scale,
+                  COMPRESSION=Compression,
+                  COMPRESSION_LEVEL=Compression_Level,
+                  STABLE_HEADER=Stable_Header,
+                  STREAM=stream)
 
 #-------------------------------------------------------------------------------------------------------------------------------
-def save(context, 
-         filepath, 
-         *, 
-         Output_GeomNode, 
-         Output_PlaceNode, 
-         Transform_Center,
-         Output_Mesh_UV,
-         Output_Mesh_Vertex_Colors,
-         Decimal_Precision,
-         Output_Scale):
-
-    _write(context, filepath, 
-           EXPORT_GEOMNODE=Output_GeomNode,
-           EXPORT_PLACENODE=Output_PlaceNode, 
-           TRANSFORM_TO_CENTER=Transform_Center, 
-           EXPORT_UV=Output_Mesh_UV,
-           EXPORT_VERTEX_COLORS=Output_Mesh_Vertex_Colors,
-           DECIMAL_PRECISION=Decimal_Precision,
-           GLOBAL_SCALE=Output_Scale)
+def save(context, filepath, **keywords):
+    for _ in save_steps(context, filepath, **keywords):
+        pass
 
     return {'FINISHED'}
 if __name__ == '__main__':
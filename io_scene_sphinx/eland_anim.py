@@ -0,0 +1,992 @@
+import bpy
+import struct
+import tempfile
+import numpy as np
+from math import gcd
+from contextlib import contextmanager, nullcontext
+
+#-------------------------------------------------------------------------------------------------------------------------------
+# The per-frame light and camera properties we care about, in the same order they are stored in the sampled arrays
+LIGHT_PROPERTIES = ('color_r', 'color_g', 'color_b', 'energy', 'shadow_soft_size', 'cutoff_distance', 'angle')
+CAMERA_PROPERTIES = ('clip_start', 'clip_end', 'angle', 'lens')
+
+# RNA paths (and array index) feeding each column above, for the channels we can evaluate straight from the F-curves
+LIGHT_CHANNELS = (('color', 0), ('color', 1), ('color', 2), ('energy', 0), ('shadow_soft_size', 0), ('cutoff_distance', 0), ('angle', 0))
+CAMERA_CHANNELS = (('clip_start', 0), ('clip_end', 0), ('lens', 0), ('sensor_width', 0), ('sensor_height', 0))
+
+# These are derived from other properties or change how they are combined; if someone animates them we can't
+# reproduce the result from the F-curves alone, so the whole datablock goes through frame_set instead
+CAMERA_DEPENDENT_PATHS = {'angle', 'angle_x', 'angle_y', 'sensor_fit'}
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_light_values(light_data):
+    # Only sun lights have an angle, the rest get a zero so that the columns line up
+    return (light_data.color.r, light_data.color.g, light_data.color.b, light_data.energy,
+            light_data.shadow_soft_size, light_data.cutoff_distance, getattr(light_data, 'angle', 0.0))
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_camera_values(camera_data):
+    return (camera_data.clip_start, camera_data.clip_end, camera_data.angle, camera_data.lens)
+
+# Largest difference between two sampled values that still counts as the track not moving at all
+CONSTANT_TRACK_TOLERANCE = 1e-6
+
+# Distance in frames used to measure the slope on each side of a keyframe
+TANGENT_FRAME_DELTA = 1e-3
+
+# Modifiers whose result can only be captured as raw vertex positions; objects can also ask for it with a custom property
+POINT_CACHE_MODIFIERS = {'CLOTH', 'SOFT_BODY', 'OCEAN', 'MESH_CACHE', 'MESH_SEQUENCE_CACHE', 'DYNAMIC_PAINT'}
+POINT_CACHE_PROPERTY = 'eland_point_cache'
+
+# Modifiers that feed or take part in a simulation; they are left alone when pruning the evaluation, wherever they are
+PHYSICS_MODIFIERS = POINT_CACHE_MODIFIERS | {'COLLISION', 'PARTICLE_SYSTEM', 'FLUID', 'FLUID_SIMULATION', 'SMOKE'}
+
+# Sidecar point cache layout: the header, then one record per frame; keyframes hold every position as floats,
+# delta frames only the vertices that moved, as indices and steps of the quantum against the previous frame
+POINT_CACHE_MAGIC = b'EPC1'
+POINT_CACHE_HEADER = struct.Struct('<4sIIf')
+POINT_CACHE_RECORD = struct.Struct('<iBI')
+POINT_CACHE_KEYFRAME = 0
+POINT_CACHE_DELTA = 1
+
+# Object custom property overriding the sample step of the exporter, so that background props can go at a lower rate
+FRAME_STEP_PROPERTY = 'eland_frame_step'
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_object_frame_step(ob, default_step):
+    try:
+        return max(1, int(ob.get(FRAME_STEP_PROPERTY, default_step)))
+    except (TypeError, ValueError):
+        return max(1, default_step)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_sampling_step(objects, default_step, step_simulations=False):
+    """Largest step that still lands on the frames of every object, whatever their own step is. With
+    step_simulations, an unbaked simulation that goes to a point cache brings it down to every frame."""
+
+    step = max(1, default_step)
+    for ob in objects:
+        if step_simulations and needs_point_cache(ob) and has_unbaked_simulation(ob):
+            return 1
+        step = gcd(step, get_object_frame_step(ob, default_step))
+    return step
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_step_frames(frame_start, frame_end, frame_step):
+    # The last frame always gets in, so that the animation covers the whole range
+    frames = np.arange(frame_start, frame_end + 1, max(1, frame_step), dtype=np.int64)
+    if len(frames) and frames[-1] != frame_end:
+        frames = np.append(frames, frame_end)
+    return frames
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_fcurve_channels(id_data, channel_paths, dependent_paths=()):
+    """Returns a {(data_path, array_index): fcurve} dictionary with the plain action F-curves animating channel_paths,
+    or None when the result also depends on drivers, NLA blending or any of the dependent_paths being animated."""
+
+    anim = id_data.animation_data
+    if anim is None:
+        return {}
+
+    # Blending several strips or tweaking one is the animation system's job, don't try to replicate it
+    if anim.use_tweak_mode or any(track.strips and not track.mute for track in anim.nla_tracks):
+        return None
+
+    for driver in anim.drivers:
+        if driver.data_path in channel_paths or driver.data_path in dependent_paths:
+            return None
+
+    action = anim.action
+    if action is None:
+        return {}
+
+    if anim.action_influence < 1.0 or anim.action_blend_type != 'REPLACE' or action.use_frame_range:
+        return None
+
+    channels = {}
+    for fcurve in action.fcurves:
+        if fcurve.mute:
+            continue
+        if fcurve.data_path in dependent_paths:
+            return None
+        if fcurve.data_path in channel_paths:
+            channels[(fcurve.data_path, fcurve.array_index)] = fcurve
+
+    return channels
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_object_transform_fcurves(ob):
+    """Same as get_fcurve_channels(), for the local transform of an object; None means that its world matrix
+    can only be known by evaluating the scene (parenting, constraints, physics and so on)."""
+
+    if ob.parent or ob.rigid_body or any(not constraint.mute for constraint in ob.constraints):
+        return None
+
+    if ob.rotation_mode == 'AXIS_ANGLE':
+        return None
+
+    # Delta transforms are rarely used, keep the composition below simple and let frame_set handle them
+    if any(ob.delta_location) or any(ob.delta_rotation_euler) or tuple(ob.delta_rotation_quaternion) != (1.0, 0.0, 0.0, 0.0) \
+       or tuple(ob.delta_scale) != (1.0, 1.0, 1.0):
+        return None
+
+    rotation_path = 'rotation_quaternion' if ob.rotation_mode == 'QUATERNION' else 'rotation_euler'
+    return get_fcurve_channels(ob, {'location', rotation_path, 'scale'})
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def evaluate_channels(channels, data_path, static_values, frames):
+    """Evaluates every array element of data_path over all the frames, (frames, len(static_values)) shaped; elements
+    without an F-curve keep their current static value."""
+
+    values = np.empty((len(frames), len(static_values)), dtype=np.float64)
+    values[:] = static_values
+
+    for index in range(len(static_values)):
+        fcurve = channels.get((data_path, index))
+        if fcurve is not None:
+            values[:, index] = [fcurve.evaluate(frame) for frame in frames]
+
+    return values
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def euler_to_matrices(angles, order):
+    """(N, 3) Euler angles in Blender's rotation order convention to (N, 3, 3) rotation matrices."""
+
+    sin, cos = np.sin(angles), np.cos(angles)
+    count = len(angles)
+
+    axis_matrices = {}
+    for axis, (i, j) in zip('XYZ', ((1, 2), (2, 0), (0, 1))):
+        index = 'XYZ'.index(axis)
+        axis_matrix = np.zeros((count, 3, 3), dtype=np.float64)
+        axis_matrix[:, index, index] = 1.0
+        axis_matrix[:, i, i] = cos[:, index]
+        axis_matrix[:, j, j] = cos[:, index]
+        axis_matrix[:, i, j] = -sin[:, index]
+        axis_matrix[:, j, i] = sin[:, index]
+        axis_matrices[axis] = axis_matrix
+
+    # 'XYZ' means that X gets applied first, so it ends up as the rightmost matrix
+    return axis_matrices[order[2]] @ axis_matrices[order[1]] @ axis_matrices[order[0]]
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def quaternions_to_matrices(quaternions):
+    """(N, 4) WXYZ quaternions to (N, 3, 3) rotation matrices; normalized first, like Blender does for objects."""
+
+    lengths = np.linalg.norm(quaternions, axis=1, keepdims=True)
+    lengths[lengths == 0.0] = 1.0
+    w, x, y, z = (quaternions / lengths).T
+
+    matrices = np.empty((len(quaternions), 3, 3), dtype=np.float64)
+    matrices[:, 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    matrices[:, 0, 1] = 2.0 * (x * y - w * z)
+    matrices[:, 0, 2] = 2.0 * (x * z + w * y)
+    matrices[:, 1, 0] = 2.0 * (x * y + w * z)
+    matrices[:, 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    matrices[:, 1, 2] = 2.0 * (y * z - w * x)
+    matrices[:, 2, 0] = 2.0 * (x * z - w * y)
+    matrices[:, 2, 1] = 2.0 * (y * z + w * x)
+    matrices[:, 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    return matrices
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def evaluate_transform_fcurves(ob, channels, frames):
+    """Composes the (frames, 4, 4) world matrices of an unparented object straight from its transform F-curves."""
+
+    location = evaluate_channels(channels, 'location', tuple(ob.location), frames)
+    scale = evaluate_channels(channels, 'scale', tuple(ob.scale), frames)
+
+    if ob.rotation_mode == 'QUATERNION':
+        rotation = quaternions_to_matrices(evaluate_channels(channels, 'rotation_quaternion', tuple(ob.rotation_quaternion), frames))
+    else:
+        rotation = euler_to_matrices(evaluate_channels(channels, 'rotation_euler', tuple(ob.rotation_euler), frames), ob.rotation_mode)
+
+    # Translation @ rotation @ scale, the scale multiplies each rotation column
+    matrices = np.zeros((len(frames), 4, 4), dtype=np.float64)
+    matrices[:, :3, :3] = rotation * scale[:, np.newaxis, :]
+    matrices[:, :3, 3] = location
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_fcurve_keyframes(channels, frame_start, frame_end):
+    """Sorted frames holding a keyframe in any of the channels, clipped to the frame range; both ends of the range
+    are always included so that the tracks cover all of it."""
+
+    key_frames = [frame_start, frame_end]
+    for fcurve in channels.values():
+        key_frames += [point.co[0] for point in fcurve.keyframe_points]
+
+    key_frames = np.unique(np.asarray(key_frames, dtype=np.float64))
+    return key_frames[(key_frames >= frame_start) & (key_frames <= frame_end)]
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_frame_ticks(frames, frame_start, ticks_per_frame):
+    """Tick of every (possibly fractional) frame, counted the same way the writers always have: each frame after
+    zero adds one more step, and the frames up to zero all land on tick 0."""
+
+    frame_steps = np.maximum(np.asarray(frames, dtype=np.float64) - max(frame_start, 1) + 1.0, 0.0)
+    return np.rint(frame_steps * ticks_per_frame).astype(np.int64)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def is_action_for_object(action, ob):
+    """Whether an action was made for ob: it is in its NLA tracks (stashed ones included), or every one of its
+    F-curves animates something ob has, like its own bones."""
+
+    if ob.animation_data and any(strip.action == action for track in ob.animation_data.nla_tracks for strip in track.strips):
+        return True
+
+    for fcurve in action.fcurves:
+        try:
+            ob.path_resolve(fcurve.data_path)
+        except ValueError:
+            return False
+    return True
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_animation_clips(scene, ob, clip_source, actions):
+    """Lists the clips to export one by one, as {"name", "action", "frame_start", "frame_end"} dictionaries. Clips
+    coming from actions or NLA strips are meant to be assigned to ob, and only the actions made for it count; marker
+    ranges keep the current animation."""
+
+    clips = []
+    if clip_source == 'ACTIONS' and ob is not None:
+        for action in actions:
+            if action.id_root not in {'OBJECT', 'NONE'} or not action.fcurves or not is_action_for_object(action, ob):
+                continue
+            frame_start, frame_end = action.frame_range
+            clips.append({"name": action.name, "action": action, "frame_start": round(frame_start), "frame_end": round(frame_end)})
+
+    elif clip_source == 'NLA' and ob is not None and ob.animation_data:
+        for track in ob.animation_data.nla_tracks:
+            for strip in track.strips:
+                if strip.action is None:
+                    continue
+                clips.append({"name": strip.name, "action": strip.action, "frame_start": round(strip.action_frame_start), "frame_end": round(strip.action_frame_end)})
+
+    elif clip_source == 'MARKERS':
+        # Every marker starts a clip that lasts until the next one, or until the end of the scene
+        markers = sorted(scene.timeline_markers, key=lambda marker: marker.frame)
+        for marker_index, marker in enumerate(markers):
+            frame_end = markers[marker_index + 1].frame - 1 if marker_index + 1 < len(markers) else scene.frame_end
+            if frame_end >= marker.frame:
+                clips.append({"name": marker.name, "action": None, "frame_start": marker.frame, "frame_end": frame_end})
+
+    return clips
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def needs_point_cache(ob):
+    if ob.type != 'MESH':
+        return False
+    if ob.get(POINT_CACHE_PROPERTY):
+        return True
+    return any(modifier.type in POINT_CACHE_MODIFIERS and modifier.show_viewport for modifier in ob.modifiers)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def has_unbaked_simulation(ob):
+    """Simulations only advance one frame at a time; without a baked cache, skipping frames resets them."""
+
+    for modifier in ob.modifiers:
+        if not modifier.show_viewport:
+            continue
+        if modifier.type in {'CLOTH', 'SOFT_BODY'} and not modifier.point_cache.is_baked:
+            return True
+        if modifier.type == 'DYNAMIC_PAINT' and modifier.canvas_settings:
+            if any(not surface.point_cache.is_baked for surface in modifier.canvas_settings.canvas_surfaces):
+                return True
+    return False
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def write_point_cache(cache, frame_ticks, positions, vertex_order, matrix, threshold):
+    """Streams sampled vertex positions to a sidecar point cache in a binary stream, one frame at a time.
+
+    positions yields one (vertices, 3) array per tick, like a memory map or a generator over one. Each frame gets
+    reordered with vertex_order and brought to the exported mesh space with matrix. Vertices that moved less than
+    threshold since the previous frame are left out, the rest get quantized to steps of threshold. Deltas are taken against what a reader reconstructs, so the
+    error never builds up; frames with steps that don't fit in 16 bits are written whole instead.
+    """
+
+    # Same single precision value the header stores, so that readers reconstruct exactly the same positions
+    quantum = float(np.float32(max(threshold, 1e-6)))
+    rotation, translation = np.asarray(matrix, dtype=np.float64)[:3, :3].T, np.asarray(matrix, dtype=np.float64)[:3, 3]
+    reconstructed = None
+
+    cache.write(POINT_CACHE_HEADER.pack(POINT_CACHE_MAGIC, len(vertex_order), len(frame_ticks), quantum))
+
+    for frame_tick, frame_positions in zip(frame_ticks, positions):
+        current = frame_positions[vertex_order] @ rotation + translation
+
+        if reconstructed is not None:
+            steps = np.rint((current - reconstructed) / quantum)
+            moved = np.flatnonzero(np.any(np.abs(current - reconstructed) > threshold, axis=1))
+
+            if np.abs(steps[moved]).max(initial=0) <= np.iinfo(np.int16).max:
+                cache.write(POINT_CACHE_RECORD.pack(int(frame_tick), POINT_CACHE_DELTA, len(moved)))
+                cache.write(moved.astype('<u4').tobytes())
+                cache.write(steps[moved].astype('<i2').tobytes())
+                reconstructed[moved] += steps[moved] * quantum
+                continue
+
+        cache.write(POINT_CACHE_RECORD.pack(int(frame_tick), POINT_CACHE_KEYFRAME, len(current)))
+        cache.write(current.astype('<f4').tobytes())
+        reconstructed = current.astype(np.float32).astype(np.float64)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def read_point_cache(filepath):
+    """Yields the (tick, (vertices, 3) positions) of every frame stored in a sidecar point cache."""
+
+    with open(filepath, 'rb') as cache:
+        magic, vertex_count, frame_count, quantum = POINT_CACHE_HEADER.unpack(cache.read(POINT_CACHE_HEADER.size))
+        if magic != POINT_CACHE_MAGIC:
+            raise ValueError('%s is not a point cache' % filepath)
+
+        positions = np.zeros((vertex_count, 3), dtype=np.float64)
+        for _ in range(frame_count):
+            frame_tick, kind, count = POINT_CACHE_RECORD.unpack(cache.read(POINT_CACHE_RECORD.size))
+            if kind == POINT_CACHE_KEYFRAME:
+                positions = np.frombuffer(cache.read(count * 12), dtype='<f4').reshape(count, 3).astype(np.float64)
+            else:
+                moved = np.frombuffer(cache.read(count * 4), dtype='<u4')
+                steps = np.frombuffer(cache.read(count * 6), dtype='<i2').reshape(count, 3)
+                positions[moved] += steps * quantum
+            yield frame_tick, positions.copy()
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_changed_frames(values, tolerance=CONSTANT_TRACK_TOLERANCE):
+    """Boolean mask of the rows of a (frames, channels) snapshot where any channel differs from the last row kept
+    by more than tolerance; the first row always counts as changed. Comparing with the last kept row rather than the
+    one before catches values that drift a little every frame."""
+
+    values = np.asarray(values, dtype=np.float64)
+    changed = np.zeros(len(values), dtype=bool)
+    if not len(values):
+        return changed
+
+    # A row equal to the one before can't be further from the last kept one, only the others need a look
+    changed[0] = True
+    last_kept = values[0]
+    for row_index in np.flatnonzero(np.any(values[1:] != values[:-1], axis=1)) + 1:
+        if np.any(np.abs(values[row_index] - last_kept) > tolerance):
+            changed[row_index] = True
+            last_kept = values[row_index]
+    return changed
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def reduce_keyframes(times, values, tolerances):
+    """Picks the frames needed to reproduce a sampled track within tolerance when linearly interpolating between them.
+
+    values is (frames, channels) and tolerances has one entry per channel; stack several tracks as extra channels to
+    get a single shared set of frames for all of them. Works like Douglas-Peucker, but splits every segment that is
+    out of tolerance at once on each pass, vectorized over all segments and channels. Returns a boolean mask.
+    """
+
+    times = np.asarray(times, dtype=np.float64)
+    count = len(times)
+
+    keep = np.zeros(count, dtype=bool)
+    if count == 0:
+        return keep
+
+    keep[0] = keep[-1] = True
+    if count < 3:
+        return keep
+
+    values = np.asarray(values, dtype=np.float64).reshape(count, -1)
+    tolerances = np.maximum(np.asarray(tolerances, dtype=np.float64), 1e-12)
+
+    indices = np.arange(count)
+
+    while True:
+        kept = np.flatnonzero(keep)
+
+        # The kept frames on both sides of every frame, and how far along that segment it is
+        segment = np.clip(np.searchsorted(kept, indices, side='right') - 1, 0, len(kept) - 2)
+        left, right = kept[segment], kept[segment + 1]
+        weight = ((times - times[left]) / (times[right] - times[left]))[:, np.newaxis]
+
+        interpolated = values[left] + (values[right] - values[left]) * weight
+        error = np.max(np.abs(interpolated - values) / tolerances, axis=1)
+        error[keep] = 0.0
+
+        if not np.any(error > 1.0):
+            return keep
+
+        # Split each offending segment at its worst frame; sort by segment and then by descending error
+        order = np.lexsort((-error, segment))
+        first_in_segment = order[np.r_[True, segment[order][1:] != segment[order][:-1]]]
+        keep[first_in_segment[error[first_in_segment] > 1.0]] = True
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_transform_channels(matrices, position_tolerance, rotation_tolerance, scale_tolerance):
+    """Splits (frames, 4, 4) matrices into channels for reduce_keyframes(), with their matching tolerances: the
+    position, the length of every axis (scale) and the normalized axes, whose chord distance is about the angle
+    in radians for small rotations."""
+
+    count = len(matrices)
+    axes = matrices[:, :3, :3]
+    scales = np.linalg.norm(axes, axis=1)
+    directions = axes / np.where(scales == 0.0, 1.0, scales)[:, np.newaxis, :]
+
+    values = np.concatenate((matrices[:, :3, 3], scales, directions.reshape(count, 9)), axis=1)
+    tolerances = [position_tolerance] * 3 + [scale_tolerance] * 3 + [rotation_tolerance] * 9
+    return values, tolerances
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def is_id_animated(id_data):
+    """Whether an action, an unmuted NLA strip or a driver can change anything in this datablock over time."""
+
+    anim = getattr(id_data, 'animation_data', None)
+    if anim is None:
+        return False
+
+    if anim.action and anim.action.fcurves:
+        return True
+
+    if anim.drivers:
+        return True
+
+    return any(track.strips and not track.mute for track in anim.nla_tracks)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def is_object_animated(ob, visited=None):
+    """Conservative static analysis of whether the world matrix of an object can change over the timeline;
+    looks at its own animation, its parent chain and the targets of its constraints, recursively."""
+
+    if ob is None:
+        return False
+
+    # A dependency cycle doesn't animate anything by itself
+    visited = set() if visited is None else visited
+    if ob.name in visited:
+        return False
+    visited.add(ob.name)
+
+    if is_id_animated(ob) or ob.rigid_body:
+        return True
+
+    if is_object_animated(ob.parent, visited):
+        return True
+
+    for constraint in ob.constraints:
+        if constraint.mute:
+            continue
+
+        targets = [getattr(constraint, 'target', None)] + [target.target for target in getattr(constraint, 'targets', ())]
+        for target in targets:
+            # Things like Follow Path are animated through the data of the target curve
+            if target and (is_object_animated(target, visited) or is_id_animated(target.data)):
+                return True
+
+    return False
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_id_objects(id_data):
+    """Objects behind an ID pointed at by a modifier, constraint or driver: the object itself, every object of a
+    collection, or the objects using a piece of data (and the shape keys of it)."""
+
+    if id_data is None:
+        return []
+
+    id_type = id_data.bl_rna.identifier
+    if id_type == 'Object':
+        return [id_data]
+    if id_type == 'Collection':
+        return list(id_data.all_objects)
+    if id_type in {'Scene', 'World', 'Text', 'Image', 'Material', 'Action'}:
+        return []
+
+    return [ob for ob in bpy.data.objects if ob.data == id_data or getattr(ob.data, 'shape_keys', None) == id_data]
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_struct_objects(rna_struct):
+    """Every object a modifier or constraint points at through any of its properties; covers things like the caps
+    and offset of Array, the operands of Boolean or the target of Shrinkwrap without listing them one by one."""
+
+    objects = []
+    for prop in rna_struct.bl_rna.properties:
+        if prop.type == 'POINTER' and prop.fixed_type.identifier in {'Object', 'Collection'}:
+            objects += get_id_objects(getattr(rna_struct, prop.identifier))
+
+    # Armature constraints have a list of targets instead
+    for target in getattr(rna_struct, 'targets', ()):
+        objects += get_id_objects(getattr(target, 'target', None))
+
+    # Geometry nodes keep their Object and Collection inputs as custom properties of the modifier
+    if getattr(rna_struct, 'type', None) == 'NODES':
+        for value in rna_struct.values():
+            if hasattr(value, 'bl_rna'):
+                objects += get_id_objects(value)
+
+    return objects
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def is_pose_animated(ob):
+    """Whether the bones of an armature can move over the timeline. Bone constraints like IK can be driven by
+    anything in the scene, so any of them counts; the poses that end up constant get dropped after sampling."""
+
+    if is_object_animated(ob) or is_id_animated(ob.data):
+        return True
+
+    return any(not constraint.mute for pose_bone in ob.pose.bones for constraint in pose_bone.constraints)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def is_constant_track(values):
+    # Nothing at all counts as constant too
+    values = np.asarray(values)
+    return len(values) == 0 or bool(np.all(np.abs(values - values[0]) <= CONSTANT_TRACK_TOLERANCE))
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_dependency_closure(objects):
+    """Every object that can influence the evaluated state of the given ones: parents, whatever their
+    constraints, modifiers and drivers point at, recursively."""
+
+    closure = {}
+    pending = list(objects)
+
+    while pending:
+        ob = pending.pop()
+        if ob is None or ob.name in closure:
+            continue
+        closure[ob.name] = ob
+
+        pending.append(ob.parent)
+
+        for constraint in ob.constraints:
+            pending += get_struct_objects(constraint)
+
+        for modifier in ob.modifiers:
+            pending += get_struct_objects(modifier)
+
+        # Drivers can live in the object itself, in its data or in the shape keys of that data
+        animated_ids = [ob, ob.data, getattr(ob.data, 'shape_keys', None)]
+        for id_data in animated_ids:
+            anim = getattr(id_data, 'animation_data', None)
+            if anim is None:
+                continue
+            for fcurve in anim.drivers:
+                for variable in fcurve.driver.variables:
+                    for target in variable.targets:
+                        pending += get_id_objects(target.id)
+
+    return closure
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def is_sample_cacheable(objects):
+    """Physics and simulations depend on their own caches and on the whole history of the scene, so no hash of
+    their settings can tell whether a stored track is still good."""
+
+    for ob in objects:
+        if ob.rigid_body or len(ob.particle_systems):
+            return False
+        if any(modifier.type in POINT_CACHE_MODIFIERS for modifier in ob.modifiers):
+            return False
+    return True
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def is_physics_object(ob):
+    # Colliders and force fields act on simulations without anything pointing at them
+    if ob.rigid_body or (ob.field and ob.field.type != 'NONE') or (ob.collision and ob.collision.use):
+        return True
+    return any(modifier.type in PHYSICS_MODIFIERS for modifier in ob.modifiers)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+@contextmanager
+def scoped_evaluation(scene, objects):
+    """Temporarily turns off the viewport modifiers of everything in the scene that can't affect the given
+    objects, so that stepping the timeline doesn't rebuild unrelated heavy geometry. Always restored on exit.
+
+    Physics objects are never touched, simulations pick up their colliders and fields by proximity.
+    """
+
+    closure = get_dependency_closure(objects)
+    disabled_modifiers = []
+
+    try:
+        for ob in scene.objects:
+            if ob.name in closure or is_physics_object(ob):
+                continue
+            for modifier in ob.modifiers:
+                if modifier.show_viewport:
+                    modifier.show_viewport = False
+                    disabled_modifiers.append(modifier)
+        yield closure
+    finally:
+        for modifier in disabled_modifiers:
+            modifier.show_viewport = True
+
+#-------------------------------------------------------------------------------------------------------------------------------
+class AnimationSampler:
+    """Steps the timeline once and records every requested animated value into preallocated arrays.
+
+    Writers register what they need (object matrices, shape key weights, light and camera settings)
+    before calling sample(); afterwards they only format from the arrays, without touching frame_set.
+
+    With use_fcurves, anything driven by plain F-curves is evaluated directly over the whole frame range,
+    and only the channels that really depend on the rest of the scene fall back to stepping the timeline.
+
+    frame_step samples every n-th frame (plus the last one); tracks with a coarser step of their own
+    pick their frames out of these with get_frame_mask().
+
+    With a SampleCache, tracks sampled by a previous export are reused when nothing they depend on changed,
+    and the new ones get stored after sampling.
+
+    With prune_evaluation, the modifiers of objects that can't affect the sampled ones are turned off while
+    stepping the timeline; see scoped_evaluation().
+    """
+
+    def __init__(self, scene, frame_start, frame_end, use_fcurves=True, frame_step=1, cache=None, prune_evaluation=False):
+        self.scene = scene
+        self.frame_start = frame_start
+        self.frames = get_step_frames(frame_start, frame_end, frame_step)
+        self.use_fcurves = use_fcurves
+        self.cache = cache
+        self.prune_evaluation = prune_evaluation
+
+        # Every dictionary is keyed by object name, each value has one row per sampled frame
+        self.transforms = {}
+        self.shape_keys = {}
+        self.lights = {}
+        self.cameras = {}
+
+        # Keyframe controller tracks, only for objects moved by their own F-curves; see add_transform_keys()
+        self.transform_keys = {}
+
+        # Armature space matrices of every pose bone, (frames, bones, 4, 4) along with the bone names
+        self.poses = {}
+
+        # Evaluated local vertex positions, (frames, vertices, 3) memory mapped to a temporary file
+        self.vertices = {}
+
+        self._evaluators = []
+        self._readers = []
+        self._dependent_objects = []
+
+        # Transform and pose tracks that get thrown away after sampling if they turn out to be constant
+        self._droppable_transforms = []
+        self._droppable_poses = []
+
+        # Tracks missing from the cache, stored once they have been sampled
+        self._cache_misses = []
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_frame_mask(self, frame_step):
+        """Which of the sampled frames belong to a track with a coarser step; the last frame is always in."""
+
+        mask = (self.frames - self.frame_start) % max(1, frame_step) == 0
+        mask[-1:] = True
+        return mask
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def add_transform(self, ob, skip_static=True):
+        if ob.name in self.transforms:
+            return
+
+        # Static objects aren't sampled at all and never get a transform track; writers check for that
+        if skip_static:
+            if not is_object_animated(ob):
+                return
+            self._droppable_transforms.append(ob.name)
+
+        cached, cache_key = self._load_cached('transform', ob)
+        if cached is not None:
+            self.transforms[ob.name] = cached
+            return
+
+        matrices = np.empty((len(self.frames), 4, 4), dtype=np.float64)
+        self.transforms[ob.name] = matrices
+        self._cache_on_sample(cache_key, matrices)
+
+        channels = get_object_transform_fcurves(ob) if self.use_fcurves else None
+        if channels is not None:
+            def evaluator():
+                matrices[:] = evaluate_transform_fcurves(ob, channels, self.frames)
+
+            self._evaluators.append(evaluator)
+            return
+
+        def reader(frame_index):
+            matrices[frame_index] = ob.matrix_world
+
+        self._add_reader(ob, reader)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def add_transform_keys(self, ob):
+        """Registers the source keyframes of an object instead of sampling every frame. Returns False if its motion
+        doesn't come from plain transform F-curves (parents, constraints, drivers...), so the caller can bake it."""
+
+        if ob.name in self.transform_keys:
+            return True
+
+        channels = get_object_transform_fcurves(ob)
+        if not channels or len(self.frames) == 0:
+            return False
+
+        key_frames = get_fcurve_keyframes(channels, self.frames[0], self.frames[-1])
+        key_data = {"frames": key_frames}
+        self.transform_keys[ob.name] = key_data
+
+        def evaluator():
+            key_data["matrices"] = evaluate_transform_fcurves(ob, channels, key_frames)
+
+            # Position tangents in units per frame, measured on both sides of every key so that they also
+            # capture linear and constant interpolation, or keys that only exist on the rotation or scale
+            location = evaluate_channels(channels, 'location', tuple(ob.location), key_frames)
+            location_before = evaluate_channels(channels, 'location', tuple(ob.location), key_frames - TANGENT_FRAME_DELTA)
+            location_after = evaluate_channels(channels, 'location', tuple(ob.location), key_frames + TANGENT_FRAME_DELTA)
+            key_data["in_tangents"] = (location - location_before) / TANGENT_FRAME_DELTA
+            key_data["out_tangents"] = (location_after - location) / TANGENT_FRAME_DELTA
+
+        self._evaluators.append(evaluator)
+        return True
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def add_shape_keys(self, ob):
+        if ob.name in self.shape_keys or not ob.data.shape_keys:
+            return
+
+        shape_keys = ob.data.shape_keys
+        key_blocks = shape_keys.key_blocks
+        values = np.empty((len(self.frames), len(key_blocks)), dtype=np.float32)
+        self.shape_keys[ob.name] = values
+
+        # Nothing animates the weights, so they are whatever they are right now during the whole range
+        if not is_id_animated(shape_keys):
+            key_blocks.foreach_get('value', values[0])
+            values[1:] = values[0]
+            return
+
+        cached, cache_key = self._load_cached('shape_keys', ob)
+        if cached is not None:
+            self.shape_keys[ob.name] = cached
+            return
+        self._cache_on_sample(cache_key, values)
+
+        channels = None
+        if self.use_fcurves and shape_keys.use_relative:
+            key_paths = [key.path_from_id('value') for key in key_blocks]
+            channels = get_fcurve_channels(shape_keys, set(key_paths))
+
+        if channels is not None:
+            # The animation system clamps the weights to the slider range when writing them, do the same
+            def evaluator():
+                for key_index, key in enumerate(key_blocks):
+                    key_values = evaluate_channels(channels, key_paths[key_index], (key.value,), self.frames)[:, 0]
+                    values[:, key_index] = np.clip(key_values, key.slider_min, key.slider_max)
+
+            self._evaluators.append(evaluator)
+            return
+
+        # Grab the weight of every key block of this mesh in one go
+        def reader(frame_index):
+            key_blocks.foreach_get('value', values[frame_index])
+
+        self._add_reader(ob, reader)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def add_pose(self, ob):
+        if ob.name in self.poses or not ob.pose or not is_pose_animated(ob):
+            return
+        self._droppable_poses.append(ob.name)
+
+        # The armature placement is needed too, to bring the bones to world space
+        self.add_transform(ob, skip_static=False)
+
+        pose_bones = ob.pose.bones
+        bone_count = len(pose_bones)
+        bone_names = [pose_bone.name for pose_bone in pose_bones]
+
+        cached, cache_key = self._load_cached('pose', ob)
+        if cached is not None:
+            self.poses[ob.name] = {"bone_names": bone_names, "matrices": cached}
+            return
+
+        # foreach_get hands out the matrices column by column; read them straight into a buffer with that
+        # layout and expose it with the last two axes swapped, so that nothing needs to be copied around
+        buffer = np.empty((len(self.frames), bone_count, 4, 4), dtype=np.float32)
+        self.poses[ob.name] = {"bone_names": bone_names, "matrices": buffer.swapaxes(2, 3)}
+        self._cache_on_sample(cache_key, self.poses[ob.name]["matrices"])
+
+        # Constraints, IK and drivers are everywhere in rigs, the pose always comes from the evaluated scene
+        def reader(frame_index):
+            pose_bones.foreach_get('matrix', buffer[frame_index].reshape(-1))
+
+        self._add_reader(ob, reader)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def add_vertices(self, ob, depsgraph):
+        if ob.name in self.vertices:
+            return
+
+        vertex_count = len(ob.evaluated_get(depsgraph).data.vertices)
+
+        # Long simulations of dense meshes don't fit in memory; let the OS page them out to disk as they come
+        positions = np.memmap(tempfile.TemporaryFile(), dtype=np.float32, mode='w+', shape=(len(self.frames), vertex_count, 3))
+        self.vertices[ob.name] = positions
+
+        def reader(frame_index):
+            mesh = ob.evaluated_get(depsgraph).data
+
+            # Topology changes can't go in a point cache, keep the previous positions for those frames
+            if len(mesh.vertices) != vertex_count:
+                positions[frame_index] = positions[frame_index - 1] if frame_index else 0.0
+                return
+
+            mesh.vertices.foreach_get('co', positions[frame_index].reshape(-1))
+
+        self._add_reader(ob, reader)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def add_light(self, ob):
+        if ob.name in self.lights:
+            return
+
+        values = np.empty((len(self.frames), len(LIGHT_PROPERTIES)), dtype=np.float64)
+        self.lights[ob.name] = values
+        light_data = ob.data
+
+        if not is_id_animated(light_data):
+            values[:] = get_light_values(light_data)
+            return
+
+        cached, cache_key = self._load_cached('light', ob)
+        if cached is not None:
+            self.lights[ob.name] = cached
+            return
+        self._cache_on_sample(cache_key, values)
+
+        channels = get_fcurve_channels(light_data, {path for path, index in LIGHT_CHANNELS}) if self.use_fcurves else None
+        if channels is not None:
+            def evaluator():
+                static_values = get_light_values(light_data)
+                for column, (path, index) in enumerate(LIGHT_CHANNELS):
+                    fcurve = channels.get((path, index))
+                    values[:, column] = [fcurve.evaluate(frame) for frame in self.frames] if fcurve else static_values[column]
+
+            self._evaluators.append(evaluator)
+            return
+
+        def reader(frame_index):
+            values[frame_index] = get_light_values(light_data)
+
+        self._add_reader(ob, reader)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def add_camera(self, ob):
+        if ob.name in self.cameras:
+            return
+
+        values = np.empty((len(self.frames), len(CAMERA_PROPERTIES)), dtype=np.float64)
+        self.cameras[ob.name] = values
+        camera_data = ob.data
+
+        if not is_id_animated(camera_data):
+            values[:] = get_camera_values(camera_data)
+            return
+
+        cached, cache_key = self._load_cached('camera', ob)
+        if cached is not None:
+            self.cameras[ob.name] = cached
+            return
+        self._cache_on_sample(cache_key, values)
+
+        channels = None
+        if self.use_fcurves:
+            channels = get_fcurve_channels(camera_data, {path for path, index in CAMERA_CHANNELS}, CAMERA_DEPENDENT_PATHS)
+
+        if channels is not None:
+            def evaluator():
+                clip_start = evaluate_channels(channels, 'clip_start', (camera_data.clip_start,), self.frames)[:, 0]
+                clip_end   = evaluate_channels(channels, 'clip_end',   (camera_data.clip_end,),   self.frames)[:, 0]
+                lens       = evaluate_channels(channels, 'lens',       (camera_data.lens,),       self.frames)[:, 0]
+
+                # Same as the RNA angle getter; the field of view comes from the lens and the fitted sensor size
+                sensor_path = 'sensor_height' if camera_data.sensor_fit == 'VERTICAL' else 'sensor_width'
+                sensor = evaluate_channels(channels, sensor_path, (getattr(camera_data, sensor_path),), self.frames)[:, 0]
+                angle = 2.0 * np.arctan((sensor.astype(np.float32) / 2.0) / lens.astype(np.float32))
+
+                values[:] = np.column_stack((clip_start, clip_end, angle, lens))
+
+            self._evaluators.append(evaluator)
+            return
+
+        def reader(frame_index):
+            values[frame_index] = get_camera_values(camera_data)
+
+        self._add_reader(ob, reader)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def _load_cached(self, kind, ob):
+        """Returns the cached track (None on a miss) and its key (None if it can't be cached at all)."""
+
+        if self.cache is None:
+            return None, None
+
+        objects = list(get_dependency_closure([ob]).values())
+        if not is_sample_cacheable(objects):
+            return None, None
+
+        cache_key = self.cache.get_key(kind, objects, self.frames, self.use_fcurves)
+        return self.cache.load(cache_key), cache_key
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def _cache_on_sample(self, cache_key, values):
+        if cache_key is not None:
+            self._cache_misses.append((cache_key, values))
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def _add_reader(self, ob, reader):
+        self._readers.append(reader)
+        self._dependent_objects.append(ob)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def sample(self):
+        for _ in self.sample_steps():
+            pass
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def sample_steps(self):
+        """Same as sample(), a frame at a time; yields the fraction of the timeline done so far.
+
+        Closing it halfway puts the scene back on its original frame, with nothing stored in the cache.
+        """
+
+        yield from self._sample()
+
+        if self.cache is not None and self._cache_misses:
+            for cache_key, values in self._cache_misses:
+                self.cache.store(cache_key, values)
+            self.cache.evict()
+
+        # Catch what the static analysis couldn't rule out, like constraints or drivers that end up not moving anything
+        for name in self._droppable_transforms:
+            if is_constant_track(self.transforms[name]):
+                del self.transforms[name]
+
+        # The bones are output in world space, so a still pose only goes if the armature doesn't move either
+        for name in self._droppable_poses:
+            if is_constant_track(self.poses[name]["matrices"]) and is_constant_track(self.transforms.get(name, ())):
+                del self.poses[name]
+                self.transforms.pop(name, None)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def _sample(self):
+        for evaluator in self._evaluators:
+            evaluator()
+
+        # Only what couldn't be evaluated from the F-curves needs the full scene to be stepped through
+        if not self._readers:
+            return
+
+        previous_frame = self.scene.frame_current
+
+        # A single pass over the timeline; every registered reader copies its values out of the current frame.
+        # The modifiers get restored before going back to the original frame, so that one is fully evaluated
+        try:
+            with scoped_evaluation(self.scene, self._dependent_objects) if self.prune_evaluation else nullcontext():
+                for frame_index, frame in enumerate(self.frames):
+                    self.scene.frame_set(int(frame))
+                    for reader in self._readers:
+                        reader(frame_index)
+                    yield (frame_index + 1) / len(self.frames)
+        finally:
+            self.scene.frame_set(previous_frame)
@@ -0,0 +1,185 @@
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+#-------------------------------------------------------------------------------------------------------------------------------
+# Folder created next to the exported file to keep the sampled tracks between exports
+CACHE_DIRECTORY_NAME = '.eland_cache'
+CACHE_FORMAT_VERSION = 3
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def hash_rna_struct(hasher, struct):
+    """Feeds every plain property of an RNA struct to the hasher; pointers only count by name and collections
+    are left to the caller."""
+
+    if struct is None:
+        hasher.update(b'None;')
+        return
+
+    for prop in struct.bl_rna.properties:
+        identifier = prop.identifier
+        if identifier == 'rna_type' or prop.type == 'COLLECTION':
+            continue
+
+        value = getattr(struct, identifier, None)
+        if prop.type == 'POINTER':
+            value = getattr(value, 'name', None)
+        elif getattr(prop, 'is_array', False) and value is not None:
+            value = value[:]
+
+        hasher.update(('%s=%r;' % (identifier, value)).encode())
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def hash_fcurves(hasher, fcurves):
+    for fcurve in fcurves:
+        hash_rna_struct(hasher, fcurve)
+
+        # Bulk read the keyframes, dense curves have thousands of them
+        keyframe_points = fcurve.keyframe_points
+        for attribute in ('co', 'handle_left', 'handle_right'):
+            values = np.empty(len(keyframe_points) * 2, dtype=np.float32)
+            keyframe_points.foreach_get(attribute, values)
+            hasher.update(values.tobytes())
+        hasher.update(','.join(point.interpolation + point.easing for point in keyframe_points).encode())
+
+        for modifier in fcurve.modifiers:
+            hash_rna_struct(hasher, modifier)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def hash_animation_data(hasher, id_data):
+    """Everything that can animate a datablock: its action, NLA tracks and strips and its drivers."""
+
+    anim = getattr(id_data, 'animation_data', None)
+    hash_rna_struct(hasher, anim)
+    if anim is None:
+        return
+
+    actions = [anim.action]
+    for track in anim.nla_tracks:
+        hash_rna_struct(hasher, track)
+        for strip in track.strips:
+            hash_rna_struct(hasher, strip)
+            actions.append(strip.action)
+
+    for action in actions:
+        if action is not None:
+            hash_fcurves(hasher, action.fcurves)
+
+    hash_fcurves(hasher, anim.drivers)
+    for fcurve in anim.drivers:
+        hash_rna_struct(hasher, fcurve.driver)
+        for variable in fcurve.driver.variables:
+            hash_rna_struct(hasher, variable)
+            for target in variable.targets:
+                hash_rna_struct(hasher, target)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def hash_object(hasher, ob):
+    hash_rna_struct(hasher, ob)
+    hash_animation_data(hasher, ob)
+    for constraint in ob.constraints:
+        hash_rna_struct(hasher, constraint)
+
+    if ob.pose:
+        for pose_bone in ob.pose.bones:
+            hash_rna_struct(hasher, pose_bone)
+            for constraint in pose_bone.constraints:
+                hash_rna_struct(hasher, constraint)
+
+    if ob.data is not None:
+        hash_rna_struct(hasher, ob.data)
+        hash_animation_data(hasher, ob.data)
+
+        # The rest pose lives in the bones of the armature, a collection the generic hash skips
+        for bone in getattr(ob.data, 'bones', ()):
+            hasher.update(np.array(bone.matrix_local, dtype=np.float32).tobytes())
+            hasher.update(('%s;%s;%r;' % (bone.name, getattr(bone.parent, 'name', None), bone.use_connect)).encode())
+
+        shape_keys = getattr(ob.data, 'shape_keys', None)
+        if shape_keys:
+            hash_rna_struct(hasher, shape_keys)
+            hash_animation_data(hasher, shape_keys)
+            for key_block in shape_keys.key_blocks:
+                hash_rna_struct(hasher, key_block)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+class SampleCache:
+    """Sampled tracks stored as .npy files in a folder and loaded back memory mapped.
+
+    Each track is keyed by a hash of everything it depends on: the kind of track, the frames and the settings,
+    animation, drivers and constraints of all the objects involved. Changing anything else in the scene (like a
+    material) keeps the key. Once the folder grows past size_limit bytes, the least recently used tracks go first.
+    """
+
+    def __init__(self, directory, size_limit):
+        self.directory = str(directory)
+        self.size_limit = size_limit
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_key(self, kind, objects, frames, *settings):
+        hasher = hashlib.sha1()
+        hasher.update(('%d;%s;%r;' % (CACHE_FORMAT_VERSION, kind, settings)).encode())
+        hasher.update(np.ascontiguousarray(frames, dtype=np.int64).tobytes())
+
+        for ob in sorted(objects, key=lambda ob: ob.name):
+            hash_object(hasher, ob)
+
+        return hasher.hexdigest()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def load(self, key):
+        path = self.get_path(key)
+        try:
+            array = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+        # Touch it, the modification time is what the eviction goes by; a read-only cache is still good to load from
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return array
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def store(self, key, array):
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Write under a temporary name of its own first, so a half written track never gets loaded and two exports
+        # storing the same key don't write over each other's file
+        path = self.get_path(key)
+        file_descriptor, temporary_path = tempfile.mkstemp(suffix='.tmp', prefix='.' + key + '.', dir=self.directory)
+        try:
+            with os.fdopen(file_descriptor, 'wb') as cache_file:
+                np.save(cache_file, np.ascontiguousarray(array))
+            os.replace(temporary_path, path)
+        except BaseException:
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+            raise
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def evict(self):
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.npy')]
+        except OSError:
+            return
+
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries]
+        total_size = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.size_limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
@@ -0,0 +1,395 @@
+import re
+import time
+import bpy
+import numpy as np
+from mathutils import Matrix
+from .eland_utils import MESH_GLOBAL_MATRIX
+from .eland_anim import get_sampling_step, get_step_frames, is_object_animated, is_pose_animated
+from .eland_format import MIN_DECIMAL_PRECISION, format_table, get_auto_precision
+
+#-------------------------------------------------------------------------------------------------------------------------------
+# Values of each table that get formatted to measure how wide their numbers come out
+ESTIMATE_SAMPLE_VALUES = 8192
+
+# Polygons per mesh that get walked like the face loops of the exporters, to time them
+ESTIMATE_SAMPLE_FACES = 256
+
+# Text of a node that doesn't grow with its data: names, transform blocks, counts and the headers of the lists
+NODE_OVERHEAD_SIZE = {'EIF': 300, 'ESE': 1300, 'RTG': 160}
+
+# Same tick rate the ESE files use for their frames
+TICKS_PER_SECOND = 4800
+
+# Characters per second of the last real export of each format in this session
+EXPORT_THROUGHPUT = {}
+
+# Any printf conversion in the line templates below
+LINE_FORMAT_FIELDS = re.compile(r'%[-\d]*(?:\.\d+)?([dfus])')
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def record_export_throughput(export_format, written_size, elapsed_time):
+    """Called by the exporters once a file is done; the dry run goes by it instead of its own guess."""
+    if written_size and elapsed_time > 0.0:
+        EXPORT_THROUGHPUT[export_format] = written_size / elapsed_time
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_line_size(line_format, index_count=1, number_width=0.0):
+    """Length of a line of the template, with its integers as wide as the largest index below index_count
+    and every decimal number ('%s') number_width characters long."""
+
+    fields = LINE_FORMAT_FIELDS.findall(line_format)
+    index = max(int(index_count) - 1, 0)
+    text = line_format % tuple('' if field == 's' else index for field in fields)
+    return len(text) + fields.count('s') * number_width
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_index_width(index_count):
+    return len(str(max(int(index_count) - 1, 0)))
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_number_width(number_format, values, timing):
+    """Average printed length of the values, measured on a sample of them."""
+
+    values = np.asarray(values, dtype=np.float64).reshape(-1)[:ESTIMATE_SAMPLE_VALUES]
+    if not len(values):
+        return 0.0
+
+    start = time.perf_counter()
+    text_size = len(format_table(number_format + '\n', values.reshape(-1, 1)))
+    timing['format_time'] += time.perf_counter() - start
+    timing['format_size'] += text_size
+
+    return text_size / len(values) - 1.0
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_unique_rows(values, columns):
+    if not len(values):
+        return np.empty((0, columns), dtype=np.float32)
+    return np.unique(values.reshape(-1, columns), axis=0)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_layer_values(layers, attribute, columns, loops_count):
+    # Every layer goes to the same list in the exporters, so they are deduplicated together
+    values = []
+    for layer in layers:
+        layer_values = np.empty(loops_count * columns, dtype=np.float32)
+        layer.data.foreach_get(attribute, layer_values)
+        values.append(layer_values)
+    return get_unique_rows(np.concatenate(values), columns) if values else np.empty((0, columns), dtype=np.float32)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def time_face_loop(me, timing):
+    """Walks a few polygons the way the face loops of the exporters do, which is where most of their time goes."""
+
+    vertices = me.vertices
+    uv_data = me.uv_layers.active.data if me.uv_layers.active else None
+    polygons = me.polygons[:ESTIMATE_SAMPLE_FACES]
+
+    # Same lookups of every corner in the maps of unique values the exporters build
+    vertex_map = {}
+    uv_map = {}
+    start = time.perf_counter()
+    for poly in polygons:
+        for v in poly.vertices:
+            vertex_map.setdefault(tuple(vertices[v].co), len(vertex_map))
+        if uv_data is not None:
+            for loop_index in poly.loop_indices:
+                uv_map.setdefault(tuple(uv_data[loop_index].uv), len(uv_map))
+    timing['face_time'] += time.perf_counter() - start
+    timing['face_count'] += len(polygons)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_mesh_data(me, mesh_matrix, export_uv, export_colors, timing):
+    """Everything the size of a mesh block depends on, read in bulk instead of element by element."""
+
+    positions = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get('co', positions)
+
+    # Single precision like the coordinates me.transform() leaves behind, so the deduplication matches
+    mesh_matrix = np.array(mesh_matrix, dtype=np.float64)
+    positions = positions.reshape(-1, 3) @ mesh_matrix[:3, :3].T + mesh_matrix[:3, 3]
+    positions = get_unique_rows(positions.astype(np.float32), 3)
+
+    loop_totals = np.empty(len(me.polygons), dtype=np.int32)
+    me.polygons.foreach_get('loop_total', loop_totals)
+
+    normals = np.empty(len(me.polygons) * 3, dtype=np.float32)
+    me.polygons.foreach_get('normal', normals)
+
+    time_face_loop(me, timing)
+
+    return {
+        "positions": positions,
+        "normals": normals,
+        "uvs": get_layer_values(me.uv_layers, 'uv', 2, len(me.loops)) if export_uv else np.empty((0, 2), dtype=np.float32),
+        "colors": get_layer_values(me.vertex_colors, 'color', 4, len(me.loops)) if export_colors else np.empty((0, 4), dtype=np.float32),
+        "polygons": len(loop_totals),
+        "loops": int(loop_totals.sum()),
+        "triangles": int(np.maximum(loop_totals - 2, 0).sum()),
+        "uv_layers": len(me.uv_layers) if export_uv else 0,
+        "color_layers": len(me.vertex_colors) if export_colors else 0,
+        "materials": len(me.materials),
+    }
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_export_meshes(scene, depsgraph):
+    """Same objects, instances and conversion as the mesh writers of the exporters, yielding
+    (ob_main, ob, ob_mat, me) with the temporary mesh only alive until the next one."""
+
+    for ob_main in scene.objects:
+        # ignore dupli children
+        if ob_main.parent and ob_main.parent.instance_type in {'VERTS', 'FACES'}:
+            continue
+
+        obs = [(ob_main, ob_main.matrix_world)]
+        if ob_main.is_instancer:
+            obs += [(dup.instance_object.original, dup.matrix_world.copy())
+                    for dup in depsgraph.object_instances
+                    if dup.parent and dup.parent.original == ob_main]
+
+        for ob, ob_mat in obs:
+            ob_for_convert = ob.evaluated_get(depsgraph)
+
+            try:
+                me = ob_for_convert.to_mesh()
+            except RuntimeError:
+                me = None
+
+            if me is None:
+                continue
+
+            try:
+                yield ob_main, ob, ob_mat, me
+            finally:
+                ob_for_convert.to_mesh_clear()
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def time_frame_set(scene):
+    """Seconds it takes the timeline to step one frame, which is what the sampling of the animation pays per frame."""
+
+    frame = scene.frame_current
+    start = time.perf_counter()
+    scene.frame_set(frame + 1)
+    scene.frame_set(frame)
+    return (time.perf_counter() - start) / 2.0
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_frame_range(scene, keywords):
+    frame_start, frame_end = scene.frame_start, scene.frame_end
+    if keywords.get('Enable_Start_From_Frame') and keywords['Start_From_Frame'] >= frame_start:
+        frame_start = keywords['Start_From_Frame']
+    if keywords.get('Enable_End_With_Frame') and keywords['End_With_Frame'] <= frame_end:
+        frame_end = keywords['End_With_Frame']
+    return frame_start, frame_end
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_channel_format(keywords, channel, values, single_format):
+    # Mirrors the precision modes of the ESE exporter, the other formats only have the single one
+    precision_mode = keywords.get('Precision_Mode', 'SINGLE')
+    if precision_mode == 'AUTO':
+        return '%%.%df' % get_auto_precision(np.asarray(values).reshape(-1)[:ESTIMATE_SAMPLE_VALUES], keywords['%s_Error' % channel.title()])
+    if precision_mode == 'CHANNELS':
+        return '%%.%df' % max(keywords['%s_Precision' % channel.title()], MIN_DECIMAL_PRECISION)
+    return single_format
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_ese_mesh_size(mesh, keywords, timing):
+    precision = keywords['Decimal_Precision']
+    dcp = f'%{precision}f'
+    vertices_count, triangles_count = len(mesh["positions"]), mesh["triangles"]
+
+    vw = get_number_width(get_channel_format(keywords, 'POSITION', mesh["positions"], dcp), mesh["positions"], timing)
+    size = vertices_count * get_line_size('\t\t\t*MESH_VERTEX  %5d\t%s\t%s\t%s\n', vertices_count, vw)
+    size += triangles_count * get_line_size('\t\t\t*MESH_FACE    %3d:    A: %6d B: %6d C: %6d    AB: %-6d BC: %-6d CA: %-6d  *MESH_SMOOTHING   *MESH_MTLID %-3d\n', max(vertices_count, triangles_count))
+
+    uvs = mesh["uvs"]
+    if len(uvs):
+        # UVs get a third column of zeroes, and the face lists print their indices with the decimal format
+        uw = get_number_width(get_channel_format(keywords, 'UV', uvs, dcp), np.column_stack((uvs, np.zeros(len(uvs)))), timing)
+        size += len(uvs) * get_line_size('\t\t\t*MESH_TVERT %5d\t%s\t%s\t%s\n', len(uvs), uw)
+        size += triangles_count * get_line_size('\t\t\t*MESH_TFACE %-3d\t%s\t%s\t%s\n', triangles_count, len(dcp % (len(uvs) - 1)))
+
+    colors = mesh["colors"]
+    if len(colors):
+        cw = get_number_width(get_channel_format(keywords, 'COLOR', colors, dcp), colors, timing)
+        size += len(colors) * get_line_size('\t\t\t*MESH_VERTCOL %5d\t%s\t%s\t%s\t%s\n', len(colors), cw)
+        size += triangles_count * get_line_size('\t\t\t*MESH_CFACE %-3d\t%s\t%s\t%s\n', triangles_count, len(dcp % (len(colors) - 1)))
+
+    if keywords['Output_Mesh_Normals']:
+        nw = get_number_width(get_channel_format(keywords, 'NORMAL', mesh["normals"], dcp), mesh["normals"], timing)
+        size += triangles_count * get_line_size('\t\t\t*MESH_FACENORMAL %-3d\t%s\t%s\t%s\n', triangles_count, nw)
+        size += triangles_count * 3 * get_line_size('\t\t\t\t*MESH_VERTEXNORMAL %-3d\t%s\t%s\t%s\n', 3, nw)
+
+    return size
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_eif_mesh_size(mesh, keywords, timing):
+    df = '%%.%df' % keywords['Decimal_Precision']
+    vertices_count, uvs_count, colors_count = len(mesh["positions"]), len(mesh["uvs"]), len(mesh["colors"])
+
+    size = vertices_count * get_line_size('\t\t%s %s %s\n', 1, get_number_width(df, mesh["positions"], timing))
+    size += uvs_count * get_line_size('\t\t%s %s\n', 1, get_number_width(df, mesh["uvs"], timing))
+    size += colors_count * get_line_size('\t\t%s %s %s %s\n', 1, get_number_width(df, mesh["colors"], timing))
+
+    # Faces aren't triangulated here; every corner prints an index per layer, plus the count and flags of the face
+    face_layers = max(mesh["uv_layers"], 1)
+    size += mesh["polygons"] * get_line_size('\t\t%d %d\n')
+    size += mesh["loops"] * (get_index_width(vertices_count) + 1)
+    if uvs_count:
+        size += mesh["loops"] * face_layers * (get_index_width(uvs_count) + 1)
+    if colors_count:
+        size += mesh["loops"] * face_layers * (get_index_width(colors_count) + 1)
+    if keywords['Output_Mesh_UV'] and mesh["materials"]:
+        size += mesh["polygons"] * face_layers * 3
+    return size
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_rtg_mesh_size(mesh, keywords, timing):
+    df = '%%.%df' % keywords['Decimal_Precision']
+    vertices_count, triangles_count = len(mesh["positions"]), mesh["triangles"]
+
+    size = vertices_count * get_line_size('\t\t%s %s %s\n', 1, get_number_width(df, mesh["positions"], timing))
+    size += triangles_count * (get_line_size('\t\t*FACE %d %d %d {\n') + get_line_size('\t\t\t%d %d %d \n', vertices_count) + get_line_size('\t\t}\n'))
+
+    # Textured faces also print their UVs with six decimals and the texture name
+    if mesh["uv_layers"] and mesh["materials"]:
+        size += triangles_count * (get_line_size('\t\t\t %s %s %s %s %s %s\n', 1, 9) + 16)
+    return size
+
+#-------------------------------------------------------------------------------------------------------------------------------
+MESH_SIZE_ESTIMATORS = {
+    'EIF': get_eif_mesh_size,
+    'ESE': get_ese_mesh_size,
+    'RTG': get_rtg_mesh_size,
+}
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_export_estimate(context, export_format, keywords):
+    """Goes through the same objects as the exporter, reading and deduplicating their data but without writing
+    any of it, and works out how big the file gets and how long it takes.
+
+    The numbers of every table are sized by formatting a sample of them; the time comes from the throughput of
+    the last export of the format in this session, or else from timing the sampled formatting and a few polygons
+    of every mesh through the same kind of loop the exporters use.
+    """
+
+    scene = context.scene
+    depsgraph = context.evaluated_depsgraph_get()
+    object_types = keywords.get('Object_Types', {'MESH'})
+    export_mesh_anims = keywords.get('Output_Mesh_Anims', False)
+    export_camera_light_anims = keywords.get('Output_CameraLightAnims', False)
+    global_scale = keywords.get('Output_Scale', 1.0)
+    timing = {'face_time': 0.0, 'face_count': 0, 'format_time': 0.0, 'format_size': 0}
+
+    start = time.perf_counter()
+
+    # Exit edit mode, same as the exporters, so the meshes have their latest edits
+    if bpy.ops.object.mode_set.poll():
+        bpy.ops.object.mode_set(mode='OBJECT')
+
+    # Only ESE and RTG have animation
+    frames = []
+    if export_format != 'EIF':
+        frames = get_step_frames(*get_frame_range(scene, keywords), get_sampling_step(scene.objects, keywords['Frame_Step'], keywords.get('Output_Vertex_Animation', False)))
+
+    objects = []
+    animated_nodes = []
+    if 'MESH' in object_types:
+        for ob_main, ob, ob_mat, me in get_export_meshes(scene, depsgraph):
+            if keywords['Transform_Center']:
+                matrix_transformed = Matrix.Diagonal(ob.scale).to_4x4()
+            else:
+                matrix_transformed = ob_mat
+
+            mesh_matrix = MESH_GLOBAL_MATRIX @ matrix_transformed
+            if export_format == 'EIF':
+                mesh_matrix = Matrix.Scale(global_scale, 4) @ mesh_matrix
+
+            mesh = get_mesh_data(me, mesh_matrix, keywords['Output_Mesh_UV'], keywords['Output_Mesh_Vertex_Colors'], timing)
+            mesh["name"] = ob_main.name
+            mesh["size"] = NODE_OVERHEAD_SIZE[export_format] + MESH_SIZE_ESTIMATORS[export_format](mesh, keywords, timing)
+            objects.append(mesh)
+
+            if export_mesh_anims and ob == ob_main and is_object_animated(ob_main):
+                animated_nodes.append(ob_main)
+
+    for ob in scene.objects:
+        if ob.type in {'CAMERA', 'LIGHT'} and ob.type in object_types:
+            objects.append({"name": ob.name, "size": NODE_OVERHEAD_SIZE[export_format]})
+            # The RTG scene frames always carry every camera, moving or not
+            if export_camera_light_anims and (is_object_animated(ob) or (export_format == 'RTG' and ob.type == 'CAMERA')):
+                animated_nodes.append(ob)
+        elif ob.type == 'ARMATURE' and ob.type in object_types and export_format == 'ESE':
+            objects.append({"name": ob.name, "size": NODE_OVERHEAD_SIZE[export_format] * len(ob.data.bones)})
+            if export_mesh_anims and is_pose_animated(ob):
+                animated_nodes += [ob] * len(ob.data.bones)
+
+    # Transform tracks; keyframe reduction can only make them shorter, so this is the most they take
+    animation_size = 0
+    if len(frames) and animated_nodes:
+        mw = get_number_width('%%.%df' % keywords['Decimal_Precision'], np.array([ob.matrix_world for ob in animated_nodes]), timing)
+        if export_format == 'ESE':
+            ticks = int(frames[-1] - frames[0]) * TICKS_PER_SECOND // max(scene.render.fps, 1)
+            animation_size = len(frames) * len(animated_nodes) * get_line_size('\t\t\t*TM_FRAME  %-5d' + ' %s' * 12 + '\n', ticks + 1, mw)
+        else:
+            node_size = sum(len(ob.name) + 1 for ob in animated_nodes) + len(animated_nodes) * get_line_size(' %s' * 12 + '\n', 1, mw)
+            animation_size = len(frames) * (get_line_size('*SCENE_FRAME %u {\n}\n', frames[-1] + 1) + node_size)
+
+    total_size = sum(ob["size"] for ob in objects) + animation_size
+    sampling_time = len(frames) * time_frame_set(scene) if len(frames) and animated_nodes else 0.0
+
+    if export_format in EXPORT_THROUGHPUT:
+        writing_time = total_size / EXPORT_THROUGHPUT[export_format]
+    else:
+        face_time = timing['face_time'] / max(timing['face_count'], 1)
+        format_rate = timing['format_size'] / max(timing['format_time'], 1e-9)
+        writing_time = face_time * sum(ob.get("polygons", 0) for ob in objects) + total_size / format_rate
+
+    return {
+        "objects": objects,
+        "frames": len(frames),
+        "animated_nodes": len(animated_nodes),
+        "size": int(total_size),
+        "time": sampling_time + writing_time,
+        "measured": export_format in EXPORT_THROUGHPUT,
+        "estimate_time": time.perf_counter() - start,
+    }
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_size_text(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024
+    return '%.1f GB' % size
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def report_export_estimate(operator, context, export_format, keywords):
+    """Dry run of an export operator: prints the estimate of every object to the console and a summary to the
+    status bar, without touching the output file."""
+
+    estimate = get_export_estimate(context, export_format, keywords)
+
+    print('%s dry run: %s' % (export_format, keywords.get('filepath', '')))
+    print('  %-40s %10s %10s %10s %10s %10s' % ('Object', 'Vertices', 'Faces', 'UVs', 'Colors', 'Size'))
+    for ob in estimate["objects"]:
+        if "positions" in ob:
+            print('  %-40s %10d %10d %10d %10d %10s' % (ob["name"][:40], len(ob["positions"]), ob["triangles"] if export_format != 'EIF' else ob["polygons"], len(ob["uvs"]), len(ob["colors"]), get_size_text(ob["size"])))
+        else:
+            print('  %-40s %10s %10s %10s %10s %10s' % (ob["name"][:40], '-', '-', '-', '-', get_size_text(ob["size"])))
+    print('  %d frames sampled for %d animated nodes' % (estimate["frames"], estimate["animated_nodes"]))
+
+    summary = '%s dry run: %d objects, %d frames, about %s%s in %.1f s (%s, estimated in %.2f s)' % (
+        export_format,
+        len(estimate["objects"]),
+        estimate["frames"],
+        get_size_text(estimate["size"]),
+        ' before compression' if keywords.get('Compression', 'NONE') != 'NONE' else '',
+        estimate["time"],
+        'from the last export' if estimate["measured"] else 'rough, export once for a better guess',
+        estimate["estimate_time"],
+    )
+    print('  ' + summary)
+    operator.report({'INFO'}, summary)
+
+    return {'FINISHED'}
@@ -0,0 +1,112 @@
+import re
+import numpy as np
+from multiprocessing import shared_memory
+
+#-------------------------------------------------------------------------------------------------------------------------------
+# Rows formatted per call; keeps the template string and the argument tuple of a single call at a sane size
+TABLE_CHUNK_ROWS = 4096
+
+# Same limits as the Decimals setting of the exporters; without a single decimal, '%.0f' prints integers that the
+# parsers don't read as floats
+MIN_DECIMAL_PRECISION = 1
+MAX_DECIMAL_PRECISION = 10
+
+# Zeroes at the end of a decimal number, always leaving one decimal so the parsers still read it as a float
+TRAILING_ZEROS = re.compile(r'(\.\d+?)0+(?!\d)')
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_auto_precision(values, error_bound, max_precision=MAX_DECIMAL_PRECISION):
+    """Fewest decimals that print every value within error_bound of itself.
+
+    The range of the values sets both ends of the search: no amount of decimals gets below the error bound with
+    fewer than the ones the bound itself needs, and past the spacing of single precision floats at the largest
+    magnitude the extra decimals only print noise. Never goes below MIN_DECIMAL_PRECISION.
+    """
+
+    values = np.asarray(values, dtype=np.float64).ravel()
+    values = values[np.isfinite(values)]
+    if not len(values) or error_bound <= 0.0:
+        return max(max_precision, MIN_DECIMAL_PRECISION)
+
+    largest_value = np.abs(values).max()
+    noise_precision = int(np.ceil(-np.log10(np.spacing(np.float32(largest_value))))) if largest_value > 0.0 else 0
+    max_precision = max(min(max_precision, noise_precision), MIN_DECIMAL_PRECISION)
+
+    min_precision = min(max(int(np.floor(-np.log10(2.0 * error_bound))), MIN_DECIMAL_PRECISION), max_precision)
+    for precision in range(min_precision, max_precision + 1):
+        if np.abs(np.round(values, precision) - values).max() <= error_bound:
+            return precision
+
+    return max_precision
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def trim_trailing_zeros(text):
+    return TRAILING_ZEROS.sub(r'\1', text)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_table_values(values, index_start=None):
+    """Turns the rows into a (N, k) float64 table, with a leading column counting from index_start if given.
+
+    Integers are exact in float64 and '%d' takes floats just fine, so everything can go in a single array.
+    """
+
+    table = np.asarray(values, dtype=np.float64)
+    table = table.reshape(len(table), -1)
+
+    if index_start is not None:
+        index_column = np.arange(index_start, index_start + len(table), dtype=np.float64)
+        table = np.column_stack((index_column, table))
+
+    return table
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def format_table(line_format, values, index_start=None, trim_zeros=False, chunk_rows=TABLE_CHUNK_ROWS):
+    """Formats a whole table with a printf style template of one line, giving the same text as formatting
+    every row on its own.
+
+    Instead of one % per row, the template gets repeated for a chunk of rows and applied once to the flattened
+    values of the chunk, which moves the loop out of Python. With trim_zeros, the decimals end at their last
+    significant digit.
+    """
+
+    if len(values) == 0:
+        return ''
+
+    table = get_table_values(values, index_start)
+
+    text = []
+    for chunk_start in range(0, len(table), chunk_rows):
+        chunk = table[chunk_start:chunk_start + chunk_rows]
+        text.append((line_format * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+    text = ''.join(text)
+    if trim_zeros:
+        text = trim_trailing_zeros(text)
+    return text
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def attach_shared_memory(shared_name):
+    # Only the process that made it gets to remove it. Older versions can't be told so, but spawned workers
+    # share the resource tracker of their parent, where the name is already registered and unregistered once
+    try:
+        return shared_memory.SharedMemory(name=shared_name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=shared_name)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def format_shared_table(shared_name, shape, row_start, row_end, line_format, index_start=None, trim_zeros=False):
+    """Worker side of the format pool: formats rows row_start to row_end of a float64 table of the given shape,
+    kept in shared memory under shared_name. Indices start from where the slice does, as if the whole table
+    went through format_table() at once.
+
+    Runs in processes without Blender, so this module can't import anything from the rest of the add-on.
+    """
+
+    # Copy the slice out right away; the mapping can't be closed while any array still points into it
+    shared = attach_shared_memory(shared_name)
+    try:
+        rows = np.ndarray(shape, dtype=np.float64, buffer=shared.buf)[row_start:row_end].copy()
+    finally:
+        shared.close()
+
+    return format_table(line_format, rows, None if index_start is None else index_start + row_start, trim_zeros)
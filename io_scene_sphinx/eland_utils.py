@@ -1,15 +1,845 @@
+import io
+import os
+import sys
+import gzip
+import lzma
+import queue
+import shutil
+import socket
+import hashlib
+import threading
+import importlib.util
+import multiprocessing
+import numpy as np
+from pathlib import Path
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, BrokenExecutor
 from mathutils import Matrix, Euler
 from . import bl_info
+from .eland_format import format_table, get_table_values
 
 #-------------------------------------------------------------------------------------------------------------------------------
 MESH_GLOBAL_MATRIX = Matrix(((1, 0, 0),(0, 0, 1),(0, 1, 0))).to_4x4()
 ROT_GLOBAL_MATRIX = Matrix(((1, 0, 0),(0, 1, 0),(0, 0, 1))).to_4x4()
 
+# Axis order and parity of every Euler rotation order, same table as Blender's own math_rotation.c
+EULER_ORDER_INFO = {
+    'XYZ': ((0, 1, 2), False),
+    'XZY': ((0, 2, 1), True),
+    'YXZ': ((1, 0, 2), True),
+    'YZX': ((1, 2, 0), False),
+    'ZXY': ((2, 0, 1), False),
+    'ZYX': ((2, 1, 0), True),
+}
+
+# Size of the output buffer in KiB when the add-on preferences aren't around, like when running from a script
+DEFAULT_WRITE_BUFFER_SIZE = 1024
+
+# Extension that goes after the one of the format for every kind of compression, and the magic bytes that give it away
+COMPRESSION_EXTENSIONS = {'GZIP': '.gz', 'XZ': '.xz'}
+COMPRESSION_OPENERS = ((b'\x1f\x8b', gzip.open), (b'\xfd7zXZ\x00', lzma.open))
+
+# Buffers waiting for the compression thread; bounds the memory used when the formatting outruns it
+COMPRESSION_QUEUE_SIZE = 8
+
+# Batches of text and tables waiting for the formatting thread of a pipelined writer, and roughly how many
+# characters each value of a table turns into, to know when a batch is big enough to go
+PIPELINE_QUEUE_SIZE = 8
+PIPELINE_VALUE_SIZE = 10
+
+# Format pool: rows of a table below which it isn't worth shipping to other processes, and pieces per worker it
+# gets split into so that the workers finish at about the same time
+DEFAULT_FORMAT_POOL_ROWS = 100000
+FORMAT_POOL_CHUNKS_PER_WORKER = 4
+
+# Name the workers import eland_format under, on its own instead of through the package
+FORMAT_WORKER_MODULE = 'eland_format'
+
+# Sharded output: folder next to the file for the shards, extension added to the one of the file for the index
+SHARD_DIRECTORY_SUFFIX = '_shards'
+SHARD_INDEX_SUFFIX = 'idx'
+SHARD_WRITE_WORKERS = 4
+
+# Part of the progress bar that goes to stepping through the animation, the rest is for writing the objects
+SAMPLING_PROGRESS = 0.4
+
 #-------------------------------------------------------------------------------------------------------------------------------
 def get_plugin_version():
     version = bl_info.get('version', (0, 0, 0))  # Obtiene la versión o (0, 0, 0) si no está definida
     return version
 
+#-------------------------------------------------------------------------------------------------------------------------------
+def scale_progress(steps, progress_start, progress_end):
+    """Passes on the 0 to 1 progress yielded by the steps of a stage, mapped to its part of the whole export, and
+    returns whatever the stage returns. Closing it closes the stage as well."""
+
+    try:
+        while True:
+            try:
+                fraction = next(steps)
+            except StopIteration as stop:
+                return stop.value
+            yield progress_start + (progress_end - progress_start) * fraction
+    finally:
+        steps.close()
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_addon_preferences(context):
+    preferences = getattr(context, 'preferences', None)
+    addon = preferences.addons.get(__package__) if preferences else None
+    return addon.preferences if addon else None
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_write_buffer_size(context):
+    addon_preferences = get_addon_preferences(context)
+    buffer_size = addon_preferences.Write_Buffer_Size if addon_preferences else DEFAULT_WRITE_BUFFER_SIZE
+    return buffer_size * 1024
+
+#-------------------------------------------------------------------------------------------------------------------------------
+class FormatPool:
+    """Process pool that formats big tables in parallel, which threads can't do with the GIL in the way.
+
+    The table goes to shared memory once and every worker formats a slice of its rows; the pieces come back in
+    order, so the text is the same format_table() gives. Tables with fewer than min_rows rows stay in-process.
+    If the pool breaks, for instance because the workers can't start, it stays in-process from then on.
+
+    The workers are plain Python processes without Blender: they can't import the add-on package, whose
+    __init__ needs bpy, so they get eland_format as a module of its own from the folder of the add-on.
+    """
+
+    def __init__(self, workers, min_rows=DEFAULT_FORMAT_POOL_ROWS):
+        self.workers = workers
+        self.min_rows = min_rows
+        self.broken = False
+
+        package_directory = os.path.dirname(os.path.abspath(__file__))
+        self.format_module = sys.modules.get(FORMAT_WORKER_MODULE)
+        if self.format_module is None:
+            spec = importlib.util.spec_from_file_location(FORMAT_WORKER_MODULE, os.path.join(package_directory, FORMAT_WORKER_MODULE + '.py'))
+            self.format_module = importlib.util.module_from_spec(spec)
+            sys.modules[FORMAT_WORKER_MODULE] = self.format_module
+            spec.loader.exec_module(self.format_module)
+
+        # Spawned rather than forked, a copy of a running Blender is no good; exec is just a way to set their path
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=exec, initargs=('import sys; sys.path.append(%r)' % package_directory,))
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def format(self, line_format, values, index_start=None, trim_zeros=False):
+        table = get_table_values(values)
+        if self.broken or len(table) < self.min_rows:
+            return format_table(line_format, table, index_start, trim_zeros)
+
+        shared = shared_memory.SharedMemory(create=True, size=max(table.nbytes, 1))
+        futures = []
+        try:
+            shared_table = np.ndarray(table.shape, dtype=np.float64, buffer=shared.buf)
+            shared_table[:] = table
+            del shared_table
+
+            chunk_rows = -(-len(table) // (self.workers * FORMAT_POOL_CHUNKS_PER_WORKER))
+            for row_start in range(0, len(table), chunk_rows):
+                futures.append(self.executor.submit(self.format_module.format_shared_table, shared.name, table.shape,
+                                                    row_start, min(row_start + chunk_rows, len(table)), line_format, index_start, trim_zeros))
+            return ''.join([future.result() for future in futures])
+        except BrokenExecutor:
+            self.broken = True
+            print('Euroland: the format pool stopped working, formatting in Blender from now on')
+            return format_table(line_format, table, index_start, trim_zeros)
+        finally:
+            for future in futures:
+                future.cancel()
+            shared.close()
+            shared.unlink()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+# Started on the first export that needs it and kept around, starting the workers takes a while
+FORMAT_POOL = None
+
+def get_format_pool(context):
+    """The shared format pool, set up as the add-on preferences say; None when it's turned off."""
+
+    global FORMAT_POOL
+    addon_preferences = get_addon_preferences(context)
+    workers = addon_preferences.Format_Workers if addon_preferences else 0
+    if workers <= 0:
+        shutdown_format_pool()
+        return None
+
+    if FORMAT_POOL is None or FORMAT_POOL.workers != workers:
+        shutdown_format_pool()
+        FORMAT_POOL = FormatPool(workers)
+    FORMAT_POOL.min_rows = addon_preferences.Format_Pool_Rows
+    return FORMAT_POOL
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def shutdown_format_pool():
+    global FORMAT_POOL
+    if FORMAT_POOL is not None:
+        FORMAT_POOL.shutdown()
+        FORMAT_POOL = None
+
+#-------------------------------------------------------------------------------------------------------------------------------
+class ElandWriter:
+    """Text output of the exporters, gathered in memory and handed to a binary stream a whole buffer at a time.
+
+    Writing millions of small strings to a text mode file is slow; here they are only appended to a list until
+    buffer_size characters pile up. Line endings get translated the same way a text mode file does, so the bytes
+    on disk don't change.
+    """
+
+    def __init__(self, stream, buffer_size=DEFAULT_WRITE_BUFFER_SIZE * 1024, encoding='utf8', newline=os.linesep, format_pool=None):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.encoding = encoding
+        self.newline = newline
+        self.format_pool = format_pool
+        self.chunks = []
+        self.pending_size = 0
+        self.written_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # A failed export doesn't get to leave its half of a file behind
+        if exc_type is not None:
+            self.discard()
+        else:
+            self.close()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write(self, text):
+        self.chunks.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def rows(self, line_format, rows):
+        """Writes a whole table at once, one line_format % row per row."""
+        self.write(''.join([line_format % tuple(row) for row in rows]))
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def table(self, line_format, values, index_start=None, trim_zeros=False):
+        """Same as rows() for numeric tables, but formatted in bulk; see format_table()."""
+        self.write(self.format_values(line_format, values, index_start, trim_zeros))
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def format_values(self, line_format, values, index_start=None, trim_zeros=False):
+        # Big tables go to the format pool when there is one, it gives the same text
+        if self.format_pool is not None:
+            return self.format_pool.format(line_format, values, index_start, trim_zeros)
+        return format_table(line_format, values, index_start, trim_zeros)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    @contextmanager
+    def begin_block(self, header, level=0):
+        """Opens a '{' block with the given header and closes it at the same indentation when leaving."""
+        tabs = get_tabs(level)
+        self.write('%s%s {\n' % (tabs, header))
+        yield self
+        self.write('%s}\n' % tabs)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def flush(self):
+        if not self.chunks:
+            return
+
+        self.write_stream(''.join(self.chunks))
+        self.chunks = []
+        self.pending_size = 0
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write_stream(self, text):
+        self.written_size += len(text)
+        if self.newline != '\n':
+            text = text.replace('\n', self.newline)
+        self.stream.write(text.encode(self.encoding))
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        try:
+            self.flush()
+        except BaseException:
+            self.discard()
+            raise
+        self.stream.close()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def discard(self):
+        self.chunks = []
+        self.pending_size = 0
+        discard_stream(self.stream)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def commit(self):
+        """Moves a file opened with deferred into place, once closed; see AtomicFile."""
+        self.stream.commit()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    @property
+    def changed(self):
+        """False when the file on disk already had the same content and was left alone."""
+        return getattr(self.stream, 'changed', True)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    @property
+    def content_hash(self):
+        """SHA-1 and size of the bytes that went to disk, or None for streams that don't keep track of them."""
+        return getattr(self.stream, 'content_hash', None)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+class PipelinedWriter(ElandWriter):
+    """ElandWriter that leaves the formatting of its tables and the writing to a thread of its own.
+
+    The exporter keeps reading the scene on the main thread, the only one allowed to touch it, and hands over
+    plain text and copies of its arrays; the thread turns them into text and writes it, while the exporter goes on
+    with the next object. Batches go out every buffer_size characters or so, and only PIPELINE_QUEUE_SIZE of them
+    can wait for the thread: past that the exporter waits, which keeps the memory in check. Errors of the thread
+    come back on the next batch, or when closing.
+    """
+
+    def __init__(self, stream, buffer_size=DEFAULT_WRITE_BUFFER_SIZE * 1024, encoding='utf8', newline=os.linesep, format_pool=None):
+        super().__init__(stream, buffer_size, encoding, newline, format_pool)
+        self.batches = queue.Queue(PIPELINE_QUEUE_SIZE)
+        self.error = None
+        self.thread = threading.Thread(target=self.format_batches, name='eland_pipeline', daemon=True)
+        self.thread.start()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def format_batches(self):
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+
+            # Keep taking batches after a failure, so the exporter never blocks on a full queue
+            if self.error is None:
+                try:
+                    self.write_stream(''.join([item if isinstance(item, str) else self.format_values(*item) for item in batch]))
+                except Exception as error:
+                    self.error = error
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def table(self, line_format, values, index_start=None, trim_zeros=False):
+        # A copy, the exporter is free to change or drop its arrays once this returns
+        values = np.array(values, dtype=np.float64)
+        self.chunks.append((line_format, values, index_start, trim_zeros))
+        self.pending_size += values.size * PIPELINE_VALUE_SIZE
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def flush(self):
+        if self.error is not None:
+            raise self.error
+        if not self.chunks:
+            return
+
+        self.batches.put(self.chunks)
+        self.chunks = []
+        self.pending_size = 0
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        if self.thread.is_alive():
+            self.batches.put(None)
+            self.thread.join()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        try:
+            self.flush()
+            self.stop()
+            if self.error is not None:
+                raise self.error
+        except BaseException:
+            self.discard()
+            raise
+        self.stream.close()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def discard(self):
+        self.chunks = []
+        self.pending_size = 0
+        self.stop()
+        discard_stream(self.stream)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def discard_stream(stream):
+    discard = getattr(stream, 'discard', None)
+    if discard is not None:
+        discard()
+    else:
+        stream.close()
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def is_same_file_content(filepath, size, digest):
+    try:
+        if os.path.getsize(filepath) != size:
+            return False
+
+        hasher = hashlib.sha1()
+        with open(filepath, 'rb') as existing_file:
+            for block in iter(lambda: existing_file.read(1024 * 1024), b''):
+                hasher.update(block)
+    except OSError:
+        return False
+
+    return hasher.digest() == digest
+
+#-------------------------------------------------------------------------------------------------------------------------------
+class AtomicFile:
+    """Binary file written under a temporary name in the same folder as the target, and hashed on the way.
+
+    Closing it moves it over the target in a single rename, but only if the content differs from what's already
+    there; identical exports keep the old file and its modification time. Discarding it removes the temporary file
+    and leaves the target as it was.
+
+    With deferred, closing only finishes the temporary file and the rename waits for commit(), so that several
+    files can go in place together; until then it can still be discarded.
+    """
+
+    def __init__(self, filepath, buffer_size=-1, deferred=False):
+        self.filepath = str(filepath)
+        self.deferred = deferred
+        self.hasher = hashlib.sha1()
+        self.size = 0
+        self.changed = True
+        self.committed = False
+
+        # Same as mkstemp(), but with the usual permissions of a new file instead of only the owner ones; the kernel
+        # takes the umask off, which can't be read without changing it for every thread
+        directory = os.path.dirname(os.path.abspath(self.filepath))
+        while True:
+            self.temporary_path = os.path.join(directory, '.%s.%s.tmp' % (os.path.basename(self.filepath), os.urandom(6).hex()))
+            try:
+                file_descriptor = os.open(self.temporary_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+                break
+            except FileExistsError:
+                continue
+        self.file = os.fdopen(file_descriptor, 'wb', buffering=buffer_size)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    @property
+    def content_hash(self):
+        return self.hasher.hexdigest(), self.size
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write(self, data):
+        self.hasher.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def flush(self):
+        self.file.flush()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        if self.file.closed:
+            return
+
+        try:
+            self.file.close()
+            self.changed = not is_same_file_content(self.filepath, self.size, self.hasher.digest())
+        except BaseException:
+            self.discard()
+            raise
+
+        if not self.deferred:
+            self.commit()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def commit(self):
+        if self.committed:
+            return
+
+        try:
+            self.committed = True
+            if not self.changed:
+                os.remove(self.temporary_path)
+                return
+
+            # Keep the permissions of the old file, a new one already has the usual ones
+            if os.path.exists(self.filepath):
+                shutil.copymode(self.filepath, self.temporary_path)
+
+            os.replace(self.temporary_path, self.filepath)
+        except BaseException:
+            self.discard()
+            raise
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.temporary_path)
+        except OSError:
+            pass
+
+#-------------------------------------------------------------------------------------------------------------------------------
+class CompressedStream:
+    """Binary stream that compresses everything written to it on a background thread.
+
+    zlib and lzma let go of the GIL while they work, so compressing a buffer overlaps with the formatting of the
+    next one. Errors of the thread come back on the next write, or when closing.
+    """
+
+    def __init__(self, raw, compression, compression_level):
+        self.raw = raw
+        if compression == 'GZIP':
+            # No timestamp in the header, the same export gives the same bytes
+            self.compressor = gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=compression_level, mtime=0)
+        else:
+            self.compressor = lzma.LZMAFile(raw, 'wb', preset=compression_level)
+
+        self.chunks = queue.Queue(COMPRESSION_QUEUE_SIZE)
+        self.error = None
+        self.thread = threading.Thread(target=self.compress_chunks, name='eland_compression', daemon=True)
+        self.thread.start()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def compress_chunks(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                return
+
+            # Keep taking chunks after a failure, so the writer never blocks on a full queue
+            if self.error is None:
+                try:
+                    self.compressor.write(chunk)
+                except Exception as error:
+                    self.error = error
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.chunks.put(data)
+        return len(data)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        self.chunks.put(None)
+        self.thread.join()
+        try:
+            self.compressor.close()
+            if self.error is not None:
+                raise self.error
+        except BaseException:
+            discard_stream(self.raw)
+            raise
+        self.raw.close()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def discard(self):
+        self.chunks.put(None)
+        self.thread.join()
+        try:
+            self.compressor.close()
+        except Exception:
+            pass
+        discard_stream(self.raw)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def commit(self):
+        self.raw.commit()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    @property
+    def changed(self):
+        return getattr(self.raw, 'changed', True)
+
+    @property
+    def content_hash(self):
+        return getattr(self.raw, 'content_hash', None)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_compressed_filepath(filepath, compression):
+    extension = COMPRESSION_EXTENSIONS.get(compression, '')
+    filepath = str(filepath)
+    if extension and not filepath.lower().endswith(extension):
+        filepath += extension
+    return filepath
+
+#-------------------------------------------------------------------------------------------------------------------------------
+class BorrowedStream:
+    """Stream owned by someone else, like stdout or the end of a pipe: it gets flushed when the export is done,
+    but stays open. Text streams get the text decoded back."""
+
+    def __init__(self, target, encoding='utf8'):
+        self.target = target
+        self.encoding = encoding if isinstance(target, io.TextIOBase) else None
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write(self, data):
+        return self.target.write(data.decode(self.encoding) if self.encoding else data)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        self.target.flush()
+
+#-------------------------------------------------------------------------------------------------------------------------------
+class SocketStream:
+    """Connection to a UNIX socket; closing it tells the other end that the file is over."""
+
+    def __init__(self, socket_path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(socket_path)
+        except OSError:
+            self.socket.close()
+            raise
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write(self, data):
+        self.socket.sendall(data)
+        return len(data)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_WR)
+        finally:
+            self.socket.close()
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_target_stream(stream):
+    """Binary stream for an export target other than a file path: '-' for stdout, 'unix:<path>' for a UNIX socket,
+    a file descriptor number or any object with a write() method."""
+
+    if isinstance(stream, int):
+        return BorrowedStream(os.fdopen(stream, 'wb', closefd=False))
+    if stream == '-':
+        return BorrowedStream(sys.stdout.buffer)
+    if isinstance(stream, str) and stream.startswith('unix:'):
+        return SocketStream(stream[len('unix:'):])
+    if isinstance(stream, io.TextIOBase) and hasattr(stream, 'buffer'):
+        stream.flush()
+        return BorrowedStream(stream.buffer)
+    return BorrowedStream(stream)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def open_eland_file(filepath, buffer_size=DEFAULT_WRITE_BUFFER_SIZE * 1024, compression='NONE', compression_level=6, stream=None, pipelined=False, format_pool=None, deferred=False):
+    """Opens an exported file for writing; with compression, the extension of the compressor gets added to the name.
+    The target only gets replaced once the whole file is written, and only if its content changed; see AtomicFile.
+    With deferred, that waits for a commit() of the writer after closing it.
+
+    Given a stream (see get_target_stream()), the text goes there instead, as it gets formatted. With pipelined,
+    the tables get formatted and written on a thread of their own; see PipelinedWriter. With a format_pool, the
+    big ones get formatted by several processes; see FormatPool.
+    """
+
+    newline = os.linesep
+    if stream is not None:
+        stream = get_target_stream(stream)
+        if getattr(stream, 'encoding', None):
+            if compression in COMPRESSION_EXTENSIONS:
+                raise ValueError('Compressed output needs a binary stream')
+            # Text streams translate the line endings on their own
+            newline = '\n'
+    else:
+        filepath = get_compressed_filepath(filepath, compression)
+        stream = AtomicFile(filepath, buffer_size, deferred)
+
+    if compression in COMPRESSION_EXTENSIONS:
+        stream = CompressedStream(stream, compression, compression_level)
+    if pipelined:
+        return PipelinedWriter(stream, buffer_size, newline=newline, format_pool=format_pool)
+    return ElandWriter(stream, buffer_size, newline=newline, format_pool=format_pool)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+class ShardedWriter:
+    """Writer that spreads an export over a folder of shard files, plus an index that lists them in order with the
+    hash and size of each one.
+
+    Everything goes to the current shard; begin_shard() moves to another one by name. Shards are meant to hold one
+    object each, or one collection each with reopen=True. Without it, a shard left behind is finished right away on
+    a worker thread while the next one gets formatted, and the name gets a new shard if it comes back later. With
+    it, left behind shards only get their buffer flushed and stay open until the end, so they can be picked up
+    again. Every shard is an atomic file, so the ones that didn't change keep their old copy.
+
+    Shard files are named after their object or collection, so that adding or removing one leaves the files of the
+    rest alone; the order is only kept in the index. None of them goes in place until all of them are written, and a
+    failed or cancelled export leaves the folder as it was.
+    """
+
+    def __init__(self, filepath, buffer_size=DEFAULT_WRITE_BUFFER_SIZE * 1024, compression='NONE', compression_level=6, reopen=False, first_shard='SCENE', format_pool=None):
+        filepath = Path(filepath)
+        self.index_path = filepath.with_suffix(filepath.suffix + SHARD_INDEX_SUFFIX)
+        self.directory = filepath.parent / (filepath.stem + SHARD_DIRECTORY_SUFFIX)
+        self.extension = filepath.suffix
+        self.buffer_size = buffer_size
+        self.compression = compression
+        self.compression_level = compression_level
+        self.reopen = reopen
+        self.format_pool = format_pool
+
+        self.shards = []
+        self.open_shards = {}
+        self.shard_names = set()
+        self.closing = []
+        self.current = None
+        self.current_name = None
+        self.executor = ThreadPoolExecutor(SHARD_WRITE_WORKERS, thread_name_prefix='eland_shard')
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.begin_shard(first_shard)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.discard()
+        else:
+            self.close()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def begin_shard(self, name):
+        if name == self.current_name:
+            return
+
+        if self.current is not None:
+            if self.reopen:
+                self.current.flush()
+            else:
+                self.closing.append(self.executor.submit(self.current.close))
+                del self.open_shards[self.current_name]
+
+        if name not in self.open_shards:
+            shard_path = self.directory / (get_unique_name(clean_file_name(name), self.shard_names) + self.extension)
+            shard = open_eland_file(shard_path, self.buffer_size, self.compression, self.compression_level, format_pool=self.format_pool, deferred=True)
+            self.shards.append((get_compressed_filepath(shard_path, self.compression), shard))
+            self.open_shards[name] = shard
+
+        self.current = self.open_shards[name]
+        self.current_name = name
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write(self, text):
+        self.current.write(text)
+
+    def rows(self, line_format, rows):
+        self.current.rows(line_format, rows)
+
+    def table(self, line_format, values, index_start=None, trim_zeros=False):
+        self.current.table(line_format, values, index_start, trim_zeros)
+
+    @contextmanager
+    def begin_block(self, header, level=0):
+        with self.current.begin_block(header, level):
+            yield self
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        try:
+            self.closing += [self.executor.submit(shard.close) for shard in self.open_shards.values()]
+            for future in self.closing:
+                future.result()
+        except BaseException:
+            self.discard()
+            raise
+        finally:
+            self.executor.shutdown()
+
+        # Every shard made it, only now do they replace the old ones
+        try:
+            for _, shard in self.shards:
+                shard.commit()
+        except BaseException:
+            for _, shard in self.shards:
+                shard.discard()
+            raise
+
+        # The old index is the only record of which files in the folder are ours
+        old_shard_paths = self.get_indexed_shards()
+        with open_eland_file(self.index_path, self.buffer_size) as out:
+            out.write('*ESE_SHARD_INDEX 1\n')
+            out.write('*SHARD_COUNT %u\n' % len(self.shards))
+            for shard_path, shard in self.shards:
+                shard_hash, shard_size = shard.content_hash
+                out.write('*SHARD "%s" %s %u\n' % (os.path.relpath(shard_path, self.index_path.parent).replace(os.sep, '/'), shard_hash, shard_size))
+
+        # Shards of the earlier export that this one no longer has; anything else in the folder is left alone
+        shard_paths = {os.path.abspath(shard_path) for shard_path, _ in self.shards}
+        for shard_path in old_shard_paths - shard_paths:
+            try:
+                os.remove(shard_path)
+            except FileNotFoundError:
+                pass
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_indexed_shards(self):
+        """Absolute paths of the shards listed in the index already on disk, if any. Only shard files of this folder
+        count, whatever else the index may say."""
+
+        shard_extensions = tuple(self.extension + compression_extension for compression_extension in ('', *COMPRESSION_EXTENSIONS.values()))
+        shard_paths = set()
+        try:
+            with open_eland_text(self.index_path) as index:
+                for line in index:
+                    if not line.startswith('*SHARD "'):
+                        continue
+                    shard_path = os.path.abspath(self.index_path.parent / line.split('"')[1])
+                    if os.path.dirname(shard_path) == os.path.abspath(self.directory) and shard_path.endswith(shard_extensions):
+                        shard_paths.add(shard_path)
+        except (OSError, UnicodeDecodeError, EOFError, lzma.LZMAError):
+            pass
+        return shard_paths
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    @property
+    def written_size(self):
+        return sum(shard.written_size for _, shard in self.shards)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def discard(self):
+        # Shards already finished on the pool are still temporary files, they go too
+        for future in self.closing:
+            future.cancel()
+        self.executor.shutdown()
+        for _, shard in self.shards:
+            shard.discard()
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def clean_file_name(name):
+    return ''.join(character if character.isalnum() or character in '-_.' else '_' for character in name)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_unique_name(name, used_names):
+    """Name that isn't in used_names yet, numbered when it clashes; case doesn't count, as on Windows file systems.
+    The result gets added to used_names."""
+
+    unique_name = name
+    number = 1
+    while unique_name.lower() in used_names:
+        number += 1
+        unique_name = '%s_%d' % (name, number)
+
+    used_names.add(unique_name.lower())
+    return unique_name
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def open_eland_text(filepath):
+    """Opens an exported file for reading as text, decompressing it on the fly if it turns out to be gzip or xz."""
+
+    with open(filepath, 'rb') as source:
+        magic = source.read(6)
+
+    for signature, opener in COMPRESSION_OPENERS:
+        if magic.startswith(signature):
+            return opener(filepath, 'rt', encoding='utf8')
+    return open(filepath, 'r', encoding='utf8')
+
 #-------------------------------------------------------------------------------------------------------------------------------
 def tri_edge_is_from_ngon(polygon, tri_loop_indices, tri_idx, mesh_loops):
     loop_start = polygon.loop_start
@@ -80,4 +910,105 @@ def create_euroland_matrix(obj_matrix, obj_type):
         "eland_euler": euroland_euler
     }
 
-    return matrix_data
\ No newline at end of file
+    return matrix_data
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def matrices_to_euler(matrices, order):
+    """Batched version of Matrix.to_euler(order) for (N, 3, 3) or (N, 4, 4) arrays, returns (N, 3) angles.
+
+    Follows what mathutils does: normalizes the axes, computes both possible solutions and keeps the one
+    with the smallest sum of absolute angles.
+    """
+
+    (i, j, k), parity = EULER_ORDER_INFO[order]
+
+    # Blender works with column-major matrices; m[:, a, b] is row b of column a from here on
+    m = np.swapaxes(np.asarray(matrices, dtype=np.float64)[:, :3, :3], 1, 2)
+    lengths = np.linalg.norm(m, axis=2, keepdims=True)
+    m = m / np.where(lengths == 0.0, 1.0, lengths)
+
+    cy = np.hypot(m[:, i, i], m[:, i, j])
+    regular = cy > 16.0 * np.finfo(np.float32).eps
+
+    euler1 = np.empty((len(m), 3), dtype=np.float64)
+    euler2 = np.empty((len(m), 3), dtype=np.float64)
+
+    euler1[:, i] = np.where(regular, np.arctan2(m[:, j, k], m[:, k, k]), np.arctan2(-m[:, k, j], m[:, j, j]))
+    euler1[:, j] = np.arctan2(-m[:, i, k], cy)
+    euler1[:, k] = np.where(regular, np.arctan2(m[:, i, j], m[:, i, i]), 0.0)
+
+    euler2[:, i] = np.where(regular, np.arctan2(-m[:, j, k], -m[:, k, k]), euler1[:, i])
+    euler2[:, j] = np.where(regular, np.arctan2(-m[:, i, k], -cy), euler1[:, j])
+    euler2[:, k] = np.where(regular, np.arctan2(-m[:, i, j], -m[:, i, i]), euler1[:, k])
+
+    if parity:
+        euler1, euler2 = -euler1, -euler2
+
+    use_second = np.abs(euler1).sum(axis=1) > np.abs(euler2).sum(axis=1)
+    return np.where(use_second[:, np.newaxis], euler2, euler1)
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def create_euroland_matrices(obj_matrices, obj_type):
+    """Batched version of create_euroland_matrix(); takes (N, 4, 4) world matrices and returns the (N, 4, 4)
+    Euroland matrices and their (N, 3) Euler angles, all in one go."""
+
+    obj_matrices = np.asarray(obj_matrices, dtype=np.float64)
+
+    if obj_type == 'CAMERA':
+        # Swap the Y and Z rows, then cameras seems that needs to invert Z axis
+        euroland_matrices = obj_matrices[:, [0, 2, 1, 3], :]
+        euroland_matrices[:, :, 2] *= -1
+
+        euroland_euler = -matrices_to_euler(euroland_matrices, 'YXZ')
+    else:
+        # Swap both the Y and Z rows and columns of the rotation part, and the Y and Z of the position
+        euroland_matrices = np.zeros_like(obj_matrices)
+        euroland_matrices[:, :3, :3] = obj_matrices[:, [0, 2, 1], :3][:, :, [0, 2, 1]]
+        euroland_matrices[:, :3, 3] = obj_matrices[:, [0, 2, 1], 3]
+        euroland_matrices[:, 3, 3] = 1.0
+
+        euroland_euler = matrices_to_euler(obj_matrices, 'ZXY')
+
+    return euroland_matrices, euroland_euler
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def get_rotation_deltas(matrices):
+    """Rotation part of (N, 3, 3) or (N, 4, 4) arrays, ignoring the scale, with each one relative to the previous
+    and the first one to no rotation at all; chaining them back as R[i] = R[i - 1] @ delta[i] gives the originals."""
+
+    m = np.asarray(matrices, dtype=np.float64)[:, :3, :3]
+    lengths = np.linalg.norm(m, axis=1, keepdims=True)
+    m = m / np.where(lengths == 0.0, 1.0, lengths)
+
+    previous = np.concatenate((np.eye(3)[np.newaxis], m[:-1]))
+    return previous.transpose(0, 2, 1) @ m
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def matrices_to_axis_angle(matrices):
+    """Rotation part of (N, 3, 3) or (N, 4, 4) arrays as (N, 3) axes and (N,) angles, ignoring the scale. Like
+    mathutils, a rotation without any axis (the identity) points to Y."""
+
+    m = np.asarray(matrices, dtype=np.float64)[:, :3, :3]
+    lengths = np.linalg.norm(m, axis=1, keepdims=True)
+    m = m / np.where(lengths == 0.0, 1.0, lengths)
+
+    m00, m11, m22 = m[:, 0, 0], m[:, 1, 1], m[:, 2, 2]
+    diagonals = np.stack((m00 + m11 + m22, m00 - m11 - m22, m11 - m00 - m22, m22 - m00 - m11), axis=1)
+    largest = np.argmax(diagonals, axis=1)
+
+    # Build the quaternion around its largest component, to keep the square root away from zero
+    s = np.sqrt(np.maximum(1.0 + diagonals[np.arange(len(m)), largest], 1e-12)) * 2.0
+    quaternions = np.select(
+        [largest[:, np.newaxis] == case for case in range(4)],
+        [np.stack((s * s / 4.0, m[:, 2, 1] - m[:, 1, 2], m[:, 0, 2] - m[:, 2, 0], m[:, 1, 0] - m[:, 0, 1]), axis=1),
+         np.stack((m[:, 2, 1] - m[:, 1, 2], s * s / 4.0, m[:, 0, 1] + m[:, 1, 0], m[:, 0, 2] + m[:, 2, 0]), axis=1),
+         np.stack((m[:, 0, 2] - m[:, 2, 0], m[:, 0, 1] + m[:, 1, 0], s * s / 4.0, m[:, 1, 2] + m[:, 2, 1]), axis=1),
+         np.stack((m[:, 1, 0] - m[:, 0, 1], m[:, 0, 2] + m[:, 2, 0], m[:, 1, 2] + m[:, 2, 1], s * s / 4.0), axis=1)]) / s[:, np.newaxis]
+
+    quaternions[quaternions[:, 0] < 0.0] *= -1.0
+
+    angles = 2.0 * np.arccos(np.clip(quaternions[:, 0], -1.0, 1.0))
+    half_sines = np.sin(angles / 2.0)
+    axes = quaternions[:, 1:] / np.where(np.abs(half_sines) < np.finfo(np.float32).eps, 1.0, half_sines)[:, np.newaxis]
+    axes[~np.any(axes, axis=1)] = (0.0, 1.0, 0.0)
+    return axes, angles
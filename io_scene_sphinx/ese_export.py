@@ -10,13 +10,19 @@ Authors: Swyter and Jmarti856
 """
 
 import bpy
+import time
 import platform
+import numpy as np
 from pathlib import Path
 from math import degrees
 from mathutils import Matrix
 from datetime import datetime
 from bpy_extras.node_shader_utils import PrincipledBSDFWrapper
 from .eland_utils import *
+from .eland_format import MIN_DECIMAL_PRECISION, get_auto_precision, trim_trailing_zeros
+from .eland_estimate import record_export_throughput
+from .eland_cache import SampleCache, CACHE_DIRECTORY_NAME
+from .eland_anim import AnimationSampler, CAMERA_PROPERTIES, CONSTANT_TRACK_TOLERANCE, get_light_values, get_camera_values, reduce_keyframes, get_transform_channels, get_frame_ticks, get_object_frame_step, get_sampling_step, get_animation_clips, needs_point_cache, write_point_cache, get_changed_frames
 
 #-------------------------------------------------------------------------------------------------------------------------------
 EXPORT_TRI = True
@@ -46,11 +52,66 @@ def _write(context, filepath,
            EXPORT_FROM_FRAME_ENABLED,
            EXPORT_FROM_FRAME,
            EXPORT_END_FRAME_ENABLED,
-           EXPORT_END_FRAME
+           EXPORT_END_FRAME,
+           EXPORT_FCURVES_DIRECT,
+           PRUNE_EVALUATION,
+           EXPORT_REDUCE_KEYS,
+           POSITION_TOLERANCE,
+           ROTATION_TOLERANCE,
+           SCALE_TOLERANCE,
+           WEIGHT_TOLERANCE,
+           LENS_TOLERANCE,
+           EXPORT_KEYFRAME_TRACKS,
+           FRAME_STEP,
+           EXPORT_CLIPS,
+           EXPORT_VERTEX_ANIMS,
+           VERTEX_THRESHOLD,
+           USE_SAMPLE_CACHE,
+           SAMPLE_CACHE_SIZE,
+           PRECISION_MODE,
+           CHANNEL_PRECISIONS,
+           CHANNEL_ERRORS,
+           TRIM_ZEROS,
+           COMPRESSION,
+           COMPRESSION_LEVEL,
+           STABLE_HEADER,
+           SHARD_OUTPUT,
+           STREAM=None
         ):
     
     df = f'%.{DECIMAL_PRECISION}f'
-    dcf = f'{{:>{DECIMAL_PRECISION}f}}'
+    # Right aligned to the decimal precision, for the tables formatted in bulk
+    dcp = f'%{DECIMAL_PRECISION}f'
+
+    # Sidecar point caches written along the way, kept as temporary files until the export succeeds
+    point_cache_files = []
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_channel_format(channel, values, single_format):
+        # A single precision for everything keeps the exact formatting the files always had
+        if PRECISION_MODE == 'SINGLE':
+            return single_format
+
+        if PRECISION_MODE == 'AUTO':
+            precision = get_auto_precision(values, CHANNEL_ERRORS[channel])
+        else:
+            precision = max(CHANNEL_PRECISIONS[channel], MIN_DECIMAL_PRECISION)
+        return '%%.%df' % precision
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def trim_zeros(text):
+        return trim_trailing_zeros(text) if TRIM_ZEROS else text
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def begin_object_shard(out, ob):
+        # Only matters for sharded output, where every object (or collection) goes to a file of its own
+        if not isinstance(out, ShardedWriter):
+            return
+
+        if SHARD_OUTPUT == 'COLLECTION':
+            out.begin_shard(ob.users_collection[0].name if ob.users_collection else 'SCENE')
+        else:
+            out.begin_shard(ob.name)
 
     #-------------------------------------------------------------------------------------------------------------------------------
     def printCustomProperties(out):
@@ -84,7 +145,7 @@ def _write(context, filepath,
             properties_list.append(property_data)
 
             #add info
-            current_time = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+            current_time = datetime.now().strftime("%d/%m/%Y %H:%M:%S ") if not STABLE_HEADER else ''
             computer_name = platform.node() 
             user_name = platform.uname().node
             blender_version = bpy.app.version_string
@@ -93,7 +154,7 @@ def _write(context, filepath,
             extra_property = {
                 "name": "cameraScriptEditor Info",
                 "type": "String",
-                "value": f"{current_time} Computer:{computer_name} UserName:{user_name} BlenderVer:#({blender_version})"
+                "value": f"{current_time}Computer:{computer_name} UserName:{user_name} BlenderVer:#({blender_version})"
             }
             properties_list.append(extra_property)
 
@@ -105,7 +166,7 @@ def _write(context, filepath,
         out.write('\t}\n')
 
     #-------------------------------------------------------------------------------------------------------------------------------
-    def write_scene_data(out, scene):
+    def write_scene_data(out, scene, frame_range=None):
         global FRAMES_COUNT, TICKS_PER_FRAME, START_FRAME, END_FRAME
 
         #Get set default scene data
@@ -117,6 +178,10 @@ def _write(context, filepath,
             START_FRAME = EXPORT_FROM_FRAME
         if EXPORT_END_FRAME_ENABLED and (EXPORT_END_FRAME <= END_FRAME):
             END_FRAME = EXPORT_END_FRAME
+
+        # Animation clips bring their own range
+        if frame_range is not None:
+            START_FRAME, END_FRAME = frame_range
             
         bpy.context.scene.frame_set(EXPORT_STATIC_FRAME)
 
@@ -275,14 +340,15 @@ def _write(context, filepath,
         eland_matrix = eland_data["eland_matrix"]
         eland_euler = eland_data["eland_euler"]
 
-        out.write(f'\t\t*TM_ROW0 {df} {df} {df}\n' % (eland_matrix[0].x, eland_matrix[1].x, eland_matrix[2].x))
-        out.write(f'\t\t*TM_ROW1 {df} {df} {df}\n' % (eland_matrix[0].y, eland_matrix[1].y, eland_matrix[2].y))
-        out.write(f'\t\t*TM_ROW2 {df} {df} {df}\n' % (eland_matrix[0].z, eland_matrix[1].z, eland_matrix[2].z))
+        mf = get_channel_format('MATRIX', eland_matrix, df)
+        out.write(trim_zeros(f'\t\t*TM_ROW0 {mf} {mf} {mf}\n' % (eland_matrix[0].x, eland_matrix[1].x, eland_matrix[2].x)))
+        out.write(trim_zeros(f'\t\t*TM_ROW1 {mf} {mf} {mf}\n' % (eland_matrix[0].y, eland_matrix[1].y, eland_matrix[2].y)))
+        out.write(trim_zeros(f'\t\t*TM_ROW2 {mf} {mf} {mf}\n' % (eland_matrix[0].z, eland_matrix[1].z, eland_matrix[2].z)))
         
         #Transform position
         obj_position = eland_matrix.translation
-        out.write(f'\t\t*TM_ROW3 {df} {df} {df}\n' % (obj_position.x,obj_position.y,obj_position.z))
-        out.write(f'\t\t*TM_POS {df} {df} {df}\n' % (obj_position.x,obj_position.y,obj_position.z))
+        out.write(trim_zeros(f'\t\t*TM_ROW3 {mf} {mf} {mf}\n' % (obj_position.x,obj_position.y,obj_position.z)))
+        out.write(trim_zeros(f'\t\t*TM_POS {mf} {mf} {mf}\n' % (obj_position.x,obj_position.y,obj_position.z)))
         
         #Transform rotation
         out.write(f'\t\t*TM_ROTANGLE {df} {df} {df}\n' % (eland_euler.x, eland_euler.y, eland_euler.z))
@@ -294,48 +360,156 @@ def _write(context, filepath,
         out.write('\t}\n')
 
     #-------------------------------------------------------------------------------------------------------------------------------
-    def write_animation_node(out, object_data, object_matrix_data):
-        global TICKS_PER_FRAME, START_FRAME, END_FRAME
-        
+    def get_sample_cache():
+        if not USE_SAMPLE_CACHE:
+            return None
+        return SampleCache(Path(filepath).parent / CACHE_DIRECTORY_NAME, SAMPLE_CACHE_SIZE * 1024 * 1024)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_keyframes_to_keep(times, values, tolerances, frame_mask):
+        # Only the frames on the step of the object are candidates, the reduction works on top of those
+        keep_frames = frame_mask.copy()
+        if EXPORT_REDUCE_KEYS:
+            keep_frames[keep_frames] = reduce_keyframes(times[keep_frames], values[keep_frames], tolerances)
+        return keep_frames
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_frame_mask(sampler, ob):
+        return sampler.get_frame_mask(get_object_frame_step(ob, FRAME_STEP))
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_euroland_track(object_data, object_matrix_data, matrices):
+        # Convert the whole track at once instead of frame by frame
+        if TRANSFORM_TO_CENTER:
+            eland_matrices, _ = create_euroland_matrices(matrices, object_data.type)
+        else:
+            # Same single precision product as mathutils, so the printed values don't change
+            original_matrix = np.array(object_matrix_data["matrix_original"], dtype=np.float32)
+            relative_matrices = np.matmul(matrices.astype(np.float32), original_matrix)
+            eland_matrices, _ = create_euroland_matrices(relative_matrices, object_data.type)
+            eland_matrices[:, :3, 3] = matrices[:, :3, 3]
+        return eland_matrices
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write_animation_node(out, object_data, object_matrix_data, sampler):
+        if object_data.name in sampler.transform_keys:
+            write_controller_tracks(out, object_data, object_matrix_data, sampler.transform_keys[object_data.name])
+            return
+
+        # Objects that never move don't get a sampled track, nor an animation block
+        if object_data.name not in sampler.transforms:
+            return
+
+        sampled_matrices = sampler.transforms[object_data.name]
+        transform_channels = get_transform_channels(sampled_matrices, POSITION_TOLERANCE, ROTATION_TOLERANCE, SCALE_TOLERANCE)
+        keep_frames = get_keyframes_to_keep(sampler.frames, *transform_channels, get_frame_mask(sampler, object_data))
+        eland_matrices = get_euroland_track(object_data, object_matrix_data, sampled_matrices)
+
+        write_anim_frames(out, object_data.name, sampler.frames, eland_matrices, keep_frames)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write_anim_frames(out, node_name, frames, eland_matrices, keep_frames):
+        global TICKS_PER_FRAME
+
+        out.write('\t*TM_ANIMATION {\n')
+        out.write('\t\t*TM_ANIMATION "%s"\n' % node_name)
+
+        # Each row holds the three axes (the matrix columns) followed by the position
+        frame_rows = eland_matrices[:, :3, :].transpose(0, 2, 1).reshape(-1, 12)
+        frame_line = '\t\t\t*TM_FRAME  %-5d' + (' ' + get_channel_format('MATRIX', frame_rows[keep_frames], df)) * 12 + '\n'
+        frame_ticks = get_frame_ticks(frames, START_FRAME, TICKS_PER_FRAME)
+
+        # Frames that can be interpolated from their neighbours within tolerance are left out
+        with out.begin_block('*TM_ANIM_FRAMES', 2):
+            out.table(frame_line, np.column_stack((frame_ticks[keep_frames], frame_rows[keep_frames])), trim_zeros=TRIM_ZEROS)
+        out.write('\t}\n')
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write_controller_tracks(out, object_data, object_matrix_data, key_data):
+        global TICKS_PER_FRAME
+
         out.write('\t*TM_ANIMATION {\n')
         out.write('\t\t*TM_ANIMATION "%s"\n' % object_data.name)
 
-        frameIndex = 0 
-        out.write('\t\t*TM_ANIM_FRAMES {\n')
-        for f in range(START_FRAME, END_FRAME + 1):
-            bpy.context.scene.frame_set(f)
-                
-            # Calculate frame index
-            if f > 0:
-                frameIndex += TICKS_PER_FRAME
+        eland_matrices = get_euroland_track(object_data, object_matrix_data, key_data["matrices"])
+        key_ticks = get_frame_ticks(key_data["frames"], START_FRAME, TICKS_PER_FRAME).tolist()
 
-            #Print rotation
-            out.write('\t\t\t*TM_FRAME  {:<5d}'.format(frameIndex))
+        # Tangents follow the same axes as the positions they belong to, and go per tick like the keys
+        tangent_axes = [0, 2, 1] if TRANSFORM_TO_CENTER else [0, 1, 2]
+        in_tangents = key_data["in_tangents"][:, tangent_axes] / TICKS_PER_FRAME
+        out_tangents = key_data["out_tangents"][:, tangent_axes] / TICKS_PER_FRAME
 
-            eland_data = create_euroland_matrix(object_data.matrix_world.copy(), object_data.type)
-            eland_matrix = eland_data["eland_matrix"]
+        #Position keys, with the slope on both sides of the key
+        out.write('\t\t*CONTROL_POS_BEZIER {\n')
+        position_rows = np.concatenate((eland_matrices[:, :3, 3], in_tangents, out_tangents), axis=1)
+        for key_tick, position_row in zip(key_ticks, position_rows.tolist()):
+            out.write(('\t\t\t*CONTROL_BEZIER_POS_KEY %d' + f' {df}' * 9 + '\n') % (key_tick, *position_row))
+        out.write('\t\t}\n')
 
-            if not TRANSFORM_TO_CENTER:
-                current_matrix = object_data.matrix_world.copy()        
-                relative_matrix = current_matrix @ object_matrix_data["matrix_original"]
-                eland_data = create_euroland_matrix(relative_matrix, object_data.type)
-                eland_matrix = eland_data["eland_matrix"]
-                eland_matrix.translation = (Matrix.Identity(4) @ current_matrix).translation
-
-            out.write(f' {df} {df} {df}' % (eland_matrix[0].x, eland_matrix[1].x, eland_matrix[2].x))
-            out.write(f' {df} {df} {df}' % (eland_matrix[0].y, eland_matrix[1].y, eland_matrix[2].y))
-            out.write(f' {df} {df} {df}' % (eland_matrix[0].z, eland_matrix[1].z, eland_matrix[2].z))
-            
-            #Transform position
-            obj_position = eland_matrix.translation
-            out.write(f' {df} {df} {df}\n' % (obj_position.x, obj_position.y, obj_position.z))
+        #Rotation keys, as axis and angle of the rotation since the previous key, which is what ASE samples hold
+        rotation_axes, rotation_angles = matrices_to_axis_angle(get_rotation_deltas(eland_matrices))
+        rotation_rows = np.column_stack((rotation_axes, rotation_angles))
+        out.write('\t\t*CONTROL_ROT_TRACK {\n')
+        for key_tick, rotation_row in zip(key_ticks, rotation_rows.tolist()):
+            out.write(('\t\t\t*CONTROL_ROT_SAMPLE %d' + f' {df}' * 4 + '\n') % (key_tick, *rotation_row))
+        out.write('\t\t}\n')
 
+        #Scale keys, same axis order as *TM_SCALE
+        scale_rows = np.linalg.norm(eland_matrices[:, :3, :3], axis=1)[:, [0, 2, 1]]
+        out.write('\t\t*CONTROL_SCALE_TRACK {\n')
+        for key_tick, scale_row in zip(key_ticks, scale_rows.tolist()):
+            out.write(('\t\t\t*CONTROL_SCALE_SAMPLE %d' + f' {df}' * 3 + '\n') % (key_tick, *scale_row))
         out.write('\t\t}\n')
         out.write('\t}\n')
 
     #-------------------------------------------------------------------------------------------------------------------------------
-    def write_mesh_data(out, scene, depsgraph, scene_materials):
-        for ob_main in scene.objects:
+    def write_morph_data(out, ob, sampler):
+        # swy: here go our blend shape weights with the mixed-in amount for each frame in the timeline
+        if not ob.data.shape_keys or ob.name not in sampler.shape_keys:
+            return
+
+        key_values = sampler.shape_keys[ob.name]
+        frame_mask = get_frame_mask(sampler, ob)
+        out.write('\t*MORPH_DATA {')
+        for key_index, key in enumerate(ob.data.shape_keys.key_blocks):
+            if key.relative_key != key:
+                weights = key_values[:, key_index]
+                keep_frames = get_keyframes_to_keep(sampler.frames, weights, [WEIGHT_TOLERANCE], frame_mask)
+                out.write(f'\n\t*MORPH_FRAMES "%s" %u {{\n' % (key.name.replace(' ', '_'), np.count_nonzero(keep_frames)))
+
+                for f, value in zip(sampler.frames[keep_frames], weights[keep_frames]):
+                    out.write(f'\t\t\t%u {df}\n' % (f, value))
+
+                out.write('\t\t}\n') # MORPH_FRAMES
+        out.write('\t}') # MORPH_DATA
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write_point_cache_node(out, ob, me, unique_vertices, vertex_index_map, mesh_matrix, sampler):
+        global TICKS_PER_FRAME
+
+        # Follow the order of the exported vertex list; merged vertices take the positions of one of them
+        vertex_order = np.zeros(len(unique_vertices), dtype=np.int64)
+        vertex_order[[vertex_index_map[tuple(v.co)] for v in me.vertices]] = np.arange(len(me.vertices))
+
+        frame_mask = get_frame_mask(sampler, ob)
+        frame_ticks = get_frame_ticks(sampler.frames[frame_mask], START_FRAME, TICKS_PER_FRAME)
+        positions = sampler.vertices.pop(ob.name)
+
+        # Only moved into place along with the main file, see write_ese_file()
+        cache_filepath = Path(filepath).with_name('%s_%s.epc' % (Path(filepath).stem, bpy.path.clean_name(ob.name)))
+        cache_file = AtomicFile(cache_filepath)
+        point_cache_files.append(cache_file)
+
+        frame_positions = (positions[frame_index] for frame_index in np.flatnonzero(frame_mask))
+        write_point_cache(cache_file, frame_ticks, frame_positions, vertex_order, mesh_matrix, VERTEX_THRESHOLD)
+
+        out.write('\t*MESH_POINT_CACHE "%s" %u\n' % (cache_filepath.name, len(frame_ticks)))
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write_mesh_data(out, scene, depsgraph, scene_materials, sampler):
+        for ob_index, ob_main in enumerate(scene.objects):
+            yield ob_index / len(scene.objects)
+
             # ignore dupli children
             if ob_main.parent and ob_main.parent.instance_type in {'VERTS', 'FACES'}:
                 continue
@@ -415,6 +589,7 @@ def _write(context, filepath,
                 mesh_materials_names = [m.name if m else None for m in mesh_materials]
                 
                 # Start printing
+                begin_object_shard(out, ob_main)
                 out.write("*GEOMOBJECT {\n")
                 out.write('\t*NODE_NAME "%s"\n' % ob_main.name)
                 write_tm_node(out, obj_matrix_data)
@@ -428,13 +603,12 @@ def _write(context, filepath,
 
                 #-------------------------------------------------------------------------------------------------------------------------------
                 #Vertex lists
-                out.write('\t\t*MESH_VERTEX_LIST {\n')
-                for vindex, vertex in enumerate(unique_vertices):
-                    out.write(f'\t\t\t*MESH_VERTEX  {{:>5d}}\t{dcf}\t{dcf}\t{dcf}\n'.format(vindex, vertex[0], vertex[1], vertex[2]))
-                out.write('\t\t}\n')    
+                with out.begin_block('*MESH_VERTEX_LIST', 2):
+                    vf = get_channel_format('POSITION', unique_vertices, dcp)
+                    out.table(f'\t\t\t*MESH_VERTEX  %5d\t{vf}\t{vf}\t{vf}\n', unique_vertices, index_start=0, trim_zeros=TRIM_ZEROS)
                 
                 #Vertex mapping
-                out.write('\t\t*MESH_FACE_LIST {\n')
+                face_rows = []
                 for p_index, poly in enumerate(me.polygons):
                     
                     vertex_indices = [vertex_index_map[tuple(me.vertices[v].co)] for v in (poly.vertices)]
@@ -457,63 +631,80 @@ def _write(context, filepath,
                         edges_from_ngon.append(1 if is_from_ngon else 0)
 
                     #Face Vertex Index
-                    out.write('\t\t\t*MESH_FACE    {:>3d}:    A: {:>6d} B: {:>6d} C: {:>6d}'.format(p_index, vertex_indices[0], vertex_indices[1], vertex_indices[2]))
-                    out.write('    AB: {:<6d} BC: {:<6d} CA: {:<6d}  *MESH_SMOOTHING   *MESH_MTLID {:<3d}\n'.format(edges_from_ngon[0], edges_from_ngon[1], edges_from_ngon[2], material_index))
-                out.write('\t\t}\n')
+                    face_rows.append((p_index, *vertex_indices[:3], *edges_from_ngon[:3], material_index))
+
+                with out.begin_block('*MESH_FACE_LIST', 2):
+                    out.table('\t\t\t*MESH_FACE    %3d:    A: %6d B: %6d C: %6d    AB: %-6d BC: %-6d CA: %-6d  *MESH_SMOOTHING   *MESH_MTLID %-3d\n', face_rows)
 
                 #-------------------------------------------------------------------------------------------------------------------------------
                 if EXPORT_MESH_UV:
                     #Print list
                     out.write('\t\t*MESH_NUMTVERTEX %u\n' % len(unique_uvs))
                     if unique_uvs:
-                        out.write('\t\t*MESH_TVERTLIST {\n')
-                        for uv_index, uv in enumerate(unique_uvs):
-                            out.write(f'\t\t\t*MESH_TVERT {{:>5d}}\t{dcf}\t{dcf}\t{dcf}\n'.format(uv_index, uv[0], uv[1], 0))
-                        out.write('\t\t}\n')
+                        with out.begin_block('*MESH_TVERTLIST', 2):
+                            # UVs have no W, it goes as a column of zeroes
+                            uf = get_channel_format('UV', unique_uvs, dcp)
+                            out.table(f'\t\t\t*MESH_TVERT %5d\t{uf}\t{uf}\t{uf}\n', np.column_stack((unique_uvs, np.zeros(len(unique_uvs)))), index_start=0, trim_zeros=TRIM_ZEROS)
 
                         #Map UVs
                         out.write('\t\t*MESH_NUMTVFACES %d\n' % len(me.polygons))
-                        out.write('\t\t*MESH_TFACELIST {\n')
+                        tface_rows = []
                         for p_index, poly in enumerate(me.polygons):
                             uv_indices = []
                             for loop_index in (poly.loop_indices):
                                 vertex = tuple(me.uv_layers.active.data[loop_index].uv)
                                 uv_indices.append(uv_index_map.get(vertex, -1))
-                            out.write(f'\t\t\t*MESH_TFACE {{:<3d}}\t{dcf}\t{dcf}\t{dcf}\n'.format(p_index, uv_indices[0], uv_indices[1], uv_indices[2]))
-                        out.write('\t\t}\n')
+                            tface_rows.append(uv_indices[:3])
+                        with out.begin_block('*MESH_TFACELIST', 2):
+                            out.table(f'\t\t\t*MESH_TFACE %-3d\t{dcp}\t{dcp}\t{dcp}\n', tface_rows, index_start=0, trim_zeros=TRIM_ZEROS)
 
                 #-------------------------------------------------------------------------------------------------------------------------------
                 if EXPORT_MESH_VCOLORS:
                     #Print list
                     out.write('\t\t*MESH_NUMCVERTEX %u\n' % len(unique_colors))
                     if unique_colors:
-                        out.write('\t\t*MESH_CVERTLIST {\n')
-                        for col_index, col  in enumerate(unique_colors):
-                            out.write(f'\t\t\t*MESH_VERTCOL {{:>5d}}\t{dcf}\t{dcf}\t{dcf}\t{dcf}\n'.format(col_index, col[0], col[1], col[2], col[3]))
-                        out.write('\t\t}\n')
+                        with out.begin_block('*MESH_CVERTLIST', 2):
+                            cf = get_channel_format('COLOR', unique_colors, dcp)
+                            out.table(f'\t\t\t*MESH_VERTCOL %5d\t{cf}\t{cf}\t{cf}\t{cf}\n', unique_colors, index_start=0, trim_zeros=TRIM_ZEROS)
 
                         #Map colors
                         out.write('\t\t*MESH_NUMCVFACES %d\n' % len(me.polygons))
-                        out.write('\t\t*MESH_CFACELIST {\n')
+                        cface_rows = []
                         for p_index, poly in enumerate(me.polygons):
                             color_indices = []
                             for loop_index in (poly.loop_indices):
                                 color = tuple(me.vertex_colors.active.data[loop_index].color)
                                 color_indices.append(color_index_map.get(color, -1))
-                            out.write(f'\t\t\t*MESH_CFACE {{:<3d}}\t{dcf}\t{dcf}\t{dcf}\n'.format(p_index, color_indices[0], color_indices[1], color_indices[2]))
-                        out.write('\t\t}\n')           
+                            cface_rows.append(color_indices[:3])
+                        with out.begin_block('*MESH_CFACELIST', 2):
+                            out.table(f'\t\t\t*MESH_CFACE %-3d\t{dcp}\t{dcp}\t{dcp}\n', cface_rows, index_start=0, trim_zeros=TRIM_ZEROS)
 
                 #-------------------------------------------------------------------------------------------------------------------------------
                 if EXPORT_MESH_NORMALS:
-                    out.write('\t\t*MESH_NORMALS {\n')
-                    for p_index, poly in enumerate(me.polygons):
-                        poly_normals = poly.normal
-                        vertex_indices = [vertex_index_map[tuple(me.vertices[v].co)] for v in (poly.vertices)]    
-                    
-                        out.write(f'\t\t\t*MESH_FACENORMAL {{:<3d}}\t{dcf}\t{dcf}\t{dcf}\n'.format(p_index, poly_normals[0], poly_normals[1], poly_normals[2]))
-                        for tri_idx in range(len(vertex_indices)):
-                            out.write(f'\t\t\t\t*MESH_VERTEXNORMAL {{:<3d}}\t{dcf}\t{dcf}\t{dcf}\n'.format(tri_idx, poly_normals[0], poly_normals[1], poly_normals[2]))
-                    out.write('\t\t}\n')
+                    poly_normals = np.empty(len(me.polygons) * 3, dtype=np.float32)
+                    me.polygons.foreach_get('normal', poly_normals)
+                    poly_loop_totals = np.empty(len(me.polygons), dtype=np.int32)
+                    me.polygons.foreach_get('loop_total', poly_loop_totals)
+                    nf = get_channel_format('NORMAL', poly_normals, dcp)
+                    face_normal_line = f'\t\t\t*MESH_FACENORMAL %-3d\t{nf}\t{nf}\t{nf}\n'
+                    vertex_normal_line = f'\t\t\t\t*MESH_VERTEXNORMAL %-3d\t{nf}\t{nf}\t{nf}\n'
+
+                    with out.begin_block('*MESH_NORMALS', 2):
+                        if np.all(poly_loop_totals == 3):
+                            # All triangles, so every face and its three corners fit in a single table row
+                            poly_normals = poly_normals.reshape(-1, 3)
+                            normal_rows = [np.arange(len(poly_normals)), poly_normals]
+                            for tri_idx in range(3):
+                                normal_rows += [np.full(len(poly_normals), tri_idx), poly_normals]
+                            out.table(face_normal_line + vertex_normal_line * 3, np.column_stack(normal_rows), trim_zeros=TRIM_ZEROS)
+                        else:
+                            normal_lines = []
+                            for p_index, poly in enumerate(me.polygons):
+                                poly_normal = tuple(poly_normals[p_index * 3:p_index * 3 + 3].tolist())
+                                normal_lines.append(face_normal_line % (p_index, *poly_normal))
+                                for tri_idx in range(len(poly.vertices)):
+                                    normal_lines.append(vertex_normal_line % (tri_idx, *poly_normal))
+                            out.write(trim_zeros(''.join(normal_lines)))
 
                 #-------------------------------------------------------------------------------------------------------------------------------
                 if EXPORT_MESH_FLAGS:
@@ -549,28 +740,20 @@ def _write(context, filepath,
 
                 #Print animations
                 if EXPORT_MESH_ANIMS:
-                    write_animation_node(out, ob_main, obj_matrix_data)
+                    write_animation_node(out, ob_main, obj_matrix_data, sampler)
 
                 out.write(f'\t*WIREFRAME_COLOR {df} {df} {df}\n' % (ob.color[0], ob.color[1], ob.color[2]))
                 out.write('\t*MATERIAL_REF %d\n' % list(scene_materials.keys()).index(ob.name))
 
+                #Point cache, for simulations that nothing else can represent
+                if EXPORT_VERTEX_ANIMS and ob.name in sampler.vertices:
+                    write_point_cache_node(out, ob, me, unique_vertices, vertex_index_map, MESH_GLOBAL_MATRIX @ matrix_transformed, sampler)
+
                 #-------------------------------------------------------------------------------------------------------------------------------
                 #  SHAPE KEYS
                 #-------------------------------------------------------------------------------------------------------------------------------
-                # swy: here go our blend shape weights with the mixed-in amount for each frame in the timeline
                 if EXPORT_MESH_MORPH:
-                    if ob.data.shape_keys:
-                        out.write('\t*MORPH_DATA {')
-                        for key in ob.data.shape_keys.key_blocks:
-                            if key.relative_key != key:
-                                out.write(f'\n\t*MORPH_FRAMES "%s" %u {{\n' % (key.name.replace(' ', '_'), FRAMES_COUNT))
-
-                                for f in range(START_FRAME, END_FRAME + 1):
-                                    bpy.context.scene.frame_set(f)
-                                    out.write(f'\t\t\t%u {df}\n' % (f, key.value))
-
-                                out.write('\t\t}\n') # MORPH_FRAMES
-                        out.write('\t}') # MORPH_DATA
+                    write_morph_data(out, ob, sampler)
 
                     #-------------------------------------------------------------------------------------------------------------------------------
                     #  SKELETAL RIGGING / BONE HIERARCHY DEFINITION / ARMATURE
@@ -592,6 +775,7 @@ def _write(context, filepath,
                             # create a vertex group lookup list for names
                             # https://blender.stackexchange.com/a/28273/42781
                             vgroup_names = [vgroup.name for vgroup in ob.vertex_groups]
+                            wf = get_channel_format('WEIGHT', [group.weight for vert in me.vertices for group in vert.groups], df)
 
                             out.write('\t\t*SKIN_VERTEX_DATA {\n')
                             for vidx, vert in enumerate(me.vertices):
@@ -611,7 +795,7 @@ def _write(context, filepath,
 
                                     # swy: because the bone names are in the same order as in the BONE_LIST above everything works out
                                     global_bone_index = bone_names.index(cur_vgroup_name)
-                                    out.write(f'  %2u {df}' % (global_bone_index, group.weight))
+                                    out.write(trim_zeros(f'  %2u {wf}' % (global_bone_index, group.weight)))
                                 out.write("\n")
 
                             out.write('\t\t}') # SKIN_VERTEX_DATA
@@ -643,7 +827,24 @@ def _write(context, filepath,
                 ob_for_convert.to_mesh_clear()
 
     #-------------------------------------------------------------------------------------------------------------------------------
-    def write_biped_bones(out, scene, depsgraph):
+    def get_bone_tracks(ob, sampler):
+        # Bring every bone of every sampled frame to world space and convert them all in a single batch
+        pose_data = sampler.poses[ob.name]
+        pose_matrices = pose_data["matrices"]
+        frames_count, bones_count = pose_matrices.shape[:2]
+
+        world_matrices = sampler.transforms.get(ob.name)
+        if world_matrices is None:
+            world_matrices = np.array(ob.matrix_world)[np.newaxis]
+
+        bone_matrices = np.matmul(world_matrices[:, np.newaxis], pose_matrices)
+        eland_matrices, _ = create_euroland_matrices(bone_matrices.reshape(-1, 4, 4), 'ARMATURE')
+        eland_matrices = eland_matrices.reshape(frames_count, bones_count, 4, 4)
+
+        return {bone_name: eland_matrices[:, bone_index] for bone_index, bone_name in enumerate(pose_data["bone_names"])}
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write_biped_bones(out, scene, depsgraph, sampler):
         for ob_main in scene.objects:
             # Check if the object is a bone source
             if ob_main.type != 'ARMATURE':
@@ -677,30 +878,63 @@ def _write(context, filepath,
                     "matrix_transformed": ob_mat.copy()
                 }
                 
+                # Only the armature itself gets sampled, not its instances
+                bone_tracks = {}
+                if ob == ob_main and ob_main.name in sampler.poses:
+                    bone_tracks = get_bone_tracks(ob_main, sampler)
+                    frame_mask = get_frame_mask(sampler, ob_main)
+
+                begin_object_shard(out, ob_main)
                 for bidx, bone in enumerate(bone_data.bones):
                     out.write('*BONEOBJECT {\n')
                     out.write('*NODE_NAME "%s"\n' % bone.name)
                     out.write('*NODE_BIPED_BODY\n')
                     if (bone.parent):
                         out.write('*NODE_PARENT "%s"\n' % bone.parent.name)
+
+                    if bone.name in bone_tracks:
+                        eland_matrices = bone_tracks[bone.name]
+                        transform_channels = get_transform_channels(eland_matrices, POSITION_TOLERANCE, ROTATION_TOLERANCE, SCALE_TOLERANCE)
+                        keep_frames = get_keyframes_to_keep(sampler.frames, *transform_channels, frame_mask)
+                        write_anim_frames(out, bone.name, sampler.frames, eland_matrices, keep_frames)
                     out.write('}') # BONEOBJECT
 
     #-------------------------------------------------------------------------------------------------------------------------------
-    def write_light_settings(out, light_object, current_frame, tab_level = 1):
+    def write_light_settings(out, light_type, light_values, current_frame, tab_level = 1):
         tab = get_tabs(tab_level)
+        # The energy is only sampled to tell when the light changes, the block has no place for it
+        color_r, color_g, color_b, energy, shadow_soft_size, cutoff_distance, angle = light_values
 
         out.write(f'{tab}*LIGHT_SETTINGS {{\n')
         out.write(f'{tab}\t*TIMEVALUE %u\n' % current_frame)
-        out.write(f'{tab}\t*COLOR {df} {df} {df}\n' % (light_object.color.r, light_object.color.g, light_object.color.b))
-        out.write(f'{tab}\t*FAR_ATTEN {df} {df}\n' % (light_object.shadow_soft_size, light_object.cutoff_distance))
-        if (light_object.type == 'SUN'):
-            out.write(f'{tab}\t*HOTSPOT %u\n' % degrees(light_object.angle))
+        out.write(f'{tab}\t*COLOR {df} {df} {df}\n' % (color_r, color_g, color_b))
+        out.write(f'{tab}\t*FAR_ATTEN {df} {df}\n' % (shadow_soft_size, cutoff_distance))
+        if (light_type == 'SUN'):
+            out.write(f'{tab}\t*HOTSPOT %u\n' % degrees(angle))
         else:
             out.write(f'{tab}\t*HOTSPOT %u\n' % 0)
         out.write(f'{tab}}}\n')
 
     #-------------------------------------------------------------------------------------------------------------------------------
-    def write_light_data(out, scene, depsgraph):
+    def write_light_animation(out, ob_main, light_type, sampler):
+        global TICKS_PER_FRAME
+
+        if ob_main.name not in sampler.lights:
+            return
+
+        # Only the frames where some setting really changes get a block, each one at its own tick
+        frame_mask = get_frame_mask(sampler, ob_main)
+        light_values = sampler.lights[ob_main.name][frame_mask]
+        changed_frames = get_changed_frames(light_values)
+        frame_ticks = get_frame_ticks(sampler.frames[frame_mask], START_FRAME, TICKS_PER_FRAME)
+
+        out.write('\t*LIGHT_ANIMATION {\n')
+        for frame_tick, frame_values in zip(frame_ticks[changed_frames].tolist(), light_values[changed_frames].tolist()):
+            write_light_settings(out, light_type, frame_values, frame_tick, 2)
+        out.write('\t}\n')
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write_light_data(out, scene, depsgraph, sampler):
         global FRAMES_COUNT
 
         for ob_main in scene.objects:
@@ -742,6 +976,7 @@ def _write(context, filepath,
                     obj_matrix_data["direction"] = (-ob_for_convert.matrix_world.to_3x3() @ light_data.direction).normalized()
 
                 # Print ligth data                
+                begin_object_shard(out, ob_main)
                 out.write("*LIGHTOBJECT {\n")
                 out.write('\t*NODE_NAME "%s"\n' % ob.name)
                 out.write('\t*NODE_PARENT "%s"\n' % ob.name)
@@ -768,41 +1003,12 @@ def _write(context, filepath,
                     out.write('\t*LIGHT_AFFECT_SPECULAR %s\n' % "Off") #for now
                 out.write('\t*LIGHT_AMBIENT_ONLY %s\n' % "Off") #for now
 
-                write_light_settings(out, light_data, EXPORT_STATIC_FRAME)
+                write_light_settings(out, light_data.type, get_light_values(light_data), EXPORT_STATIC_FRAME)
 
                 #---------------------------------------------[Light Animation]---------------------------------------------
                 if EXPORT_CAMERA_LIGHT_ANIMS:
-                    out.write('\t*LIGHT_ANIMATION {\n')
-                    previous_light_data = None
-                    frameIndex = 0
-
-                    for frame in range(START_FRAME, END_FRAME + 1):
-                        scene.frame_set(frame)
-
-                        # current frame data
-                        try:
-                            # Extract the light data
-                            light_data = ob_for_convert.data
-                        except AttributeError:
-                            light_data = None
-
-                        if light_data is None:
-                            continue
-
-                        if previous_light_data is None or \
-                        (light_data.color != previous_light_data.color or
-                            light_data.shadow_soft_size != previous_light_data.shadow_soft_size or
-                            light_data.cutoff_distance != previous_light_data.cutoff_distance or
-                            (light_data.type == 'SUN' and light_data.angle != previous_light_data.angle)):
-
-                            # Si hay alguna propiedad diferente, escribimos la configuración de la luz
-                            write_light_settings(out, light_data, frameIndex, 2)
-
-                            # Actualizamos los datos anteriores con los datos actuales
-                            previous_light_data = light_data
-                            frameIndex += TICKS_PER_FRAME
-                    out.write('\t}\n')
-                    write_animation_node(out, ob_main, obj_matrix_data)
+                    write_light_animation(out, ob_main, light_data.type, sampler)
+                    write_animation_node(out, ob_main, obj_matrix_data, sampler)
                 out.write("}\n")
 
     #-------------------------------------------------------------------------------------------------------------------------------
@@ -852,19 +1058,42 @@ def _write(context, filepath,
         out.write('\t}\n')
 
     #-------------------------------------------------------------------------------------------------------------------------------
-    def write_camera_settings(out, camera_object, camera_data, current_frame, tab_level = 1):
+    def write_camera_settings(out, camera_values, current_frame, tab_level = 1):
         tab = get_tabs(tab_level)
+        clip_start, clip_end, angle, lens = camera_values
 
         out.write(f'{tab}*CAMERA_SETTINGS {{\n')
         out.write(f'{tab}\t*TIMEVALUE %u\n' % current_frame)
-        out.write(f'{tab}\t*CAMERA_NEAR %d\n' % (camera_object.clip_start))
-        out.write(f'{tab}\t*CAMERA_FAR %d\n' % (camera_object.clip_end))
-        out.write(f'{tab}\t*CAMERA_FOV {df}\n' % (camera_object.angle))
+        out.write(f'{tab}\t*CAMERA_NEAR %d\n' % (clip_start))
+        out.write(f'{tab}\t*CAMERA_FAR %d\n' % (clip_end))
+        out.write(f'{tab}\t*CAMERA_FOV {df}\n' % (angle))
         #out.write(f'{tab}\t*CAMERA_TDIST {df}\n' % (camera_data.location.length))
         out.write(f'{tab}}}\n')
 
     #-------------------------------------------------------------------------------------------------------------------------------
-    def write_camera_data(out, scene, depsgraph):
+    def write_camera_animation(out, ob_main, sampler):
+        global TICKS_PER_FRAME
+
+        if ob_main.name not in sampler.cameras:
+            return
+
+        # Only the frames where some setting really changes get a block, each one at its own tick
+        frame_mask = get_frame_mask(sampler, ob_main)
+        camera_values = sampler.cameras[ob_main.name][frame_mask]
+        tolerances = np.full(len(CAMERA_PROPERTIES), CONSTANT_TRACK_TOLERANCE)
+        if EXPORT_REDUCE_KEYS:
+            # A focal length within tolerance of the last block written doesn't need a new one
+            tolerances[CAMERA_PROPERTIES.index('lens')] = max(LENS_TOLERANCE, CONSTANT_TRACK_TOLERANCE)
+        changed_frames = get_changed_frames(camera_values, tolerances)
+        frame_ticks = get_frame_ticks(sampler.frames[frame_mask], START_FRAME, TICKS_PER_FRAME)
+
+        out.write('\t*CAMERA_ANIMATION {\n')
+        for frame_tick, frame_values in zip(frame_ticks[changed_frames].tolist(), camera_values[changed_frames].tolist()):
+            write_camera_settings(out, frame_values, frame_tick, 2)
+        out.write('\t}\n')
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write_camera_data(out, scene, depsgraph, sampler):
         global FRAMES_COUNT
 
         CamerasList = sorted([obj for obj in bpy.context.scene.objects if obj.type == 'CAMERA'], key=lambda obj: obj.name)
@@ -901,44 +1130,17 @@ def _write(context, filepath,
                 }
         
             # Imprime el bloque con las propiedades de la cámara
+            begin_object_shard(out, ob_main)
             out.write("*CAMERAOBJECT {\n")
             out.write('\t*NODE_NAME "%s"\n' % ob.name)
             out.write('\t*CAMERA_TYPE %s\n' % "target")
             write_tm_node(out, obj_matrix_data)
-            write_camera_settings(out, camera_data, ob, EXPORT_STATIC_FRAME)
+            write_camera_settings(out, get_camera_values(camera_data), EXPORT_STATIC_FRAME)
 
             #---------------------------------------------[Camera Animation]---------------------------------------------
             if EXPORT_CAMERA_LIGHT_ANIMS:
-                out.write('\t*CAMERA_ANIMATION {\n')
-                previous_camera_data = None
-                frameIndex = 0
-                
-                for frame in range(START_FRAME, END_FRAME + 1):
-                    scene.frame_set(frame)
-
-                    # current frame data
-                    try:
-                        # Extract the light data
-                        camera_data = ob_for_convert.data
-                    except AttributeError:
-                        camera_data = None
-
-                    if camera_data is None:
-                        continue
-
-                    if previous_camera_data is None or \
-                    (camera_data.clip_start != previous_camera_data.clip_start or
-                        camera_data.clip_end != previous_camera_data.clip_end or
-                        camera_data.angle != previous_camera_data.angle):
-
-                        # Si hay alguna propiedad diferente, escribimos la configuración de la cámara
-                        write_camera_settings(out, camera_data, ob, frameIndex, 2)
-
-                        # Actualizamos los datos anteriores con los datos actuales
-                        previous_camera_data = camera_data
-                        frameIndex += TICKS_PER_FRAME
-                out.write('\t}\n')
-                write_animation_node(out, ob_main, obj_matrix_data)
+                write_camera_animation(out, ob_main, sampler)
+                write_animation_node(out, ob_main, obj_matrix_data, sampler)
                 
                 
             #-------------------------------------------------------------------------------------------------------------------------------
@@ -950,6 +1152,136 @@ def _write(context, filepath,
                         write_script_camera(out)            
             out.write("}\n")
 
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def add_transform_track(sampler, ob):
+        # Keyframe tracks only work for objects moved by their own F-curves, everything else gets baked
+        if EXPORT_KEYFRAME_TRACKS and sampler.add_transform_keys(ob):
+            return
+        sampler.add_transform(ob)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def sample_scene_animation(scene, animated=True):
+        sampler = AnimationSampler(scene, START_FRAME, END_FRAME, EXPORT_FCURVES_DIRECT, get_sampling_step(scene.objects, FRAME_STEP, EXPORT_VERTEX_ANIMS), get_sample_cache(), PRUNE_EVALUATION)
+
+        # With clips, the main file only holds the static data and the animation goes to the clip files
+        if not animated:
+            return sampler
+
+        # Register everything the writers below are going to need, so that the timeline only gets stepped once
+        for ob_main in scene.objects:
+            if (ob_main.type in {'MESH', 'CURVE', 'SURFACE', 'FONT', 'META'} or ob_main.is_instancer) and 'MESH' in EXPORT_OBJECTS:
+                if EXPORT_VERTEX_ANIMS and needs_point_cache(ob_main):
+                    sampler.add_vertices(ob_main, bpy.context.evaluated_depsgraph_get())
+                if EXPORT_MESH_ANIMS:
+                    add_transform_track(sampler, ob_main)
+                if EXPORT_MESH_MORPH and ob_main.type == 'MESH':
+                    sampler.add_shape_keys(ob_main)
+            elif ob_main.type == 'CAMERA' and 'CAMERA' in EXPORT_OBJECTS and EXPORT_CAMERA_LIGHT_ANIMS:
+                add_transform_track(sampler, ob_main)
+                sampler.add_camera(ob_main)
+            elif ob_main.type == 'LIGHT' and 'LIGHT' in EXPORT_OBJECTS and EXPORT_CAMERA_LIGHT_ANIMS:
+                add_transform_track(sampler, ob_main)
+                sampler.add_light(ob_main)
+            elif ob_main.type == 'ARMATURE' and 'ARMATURE' in EXPORT_OBJECTS and EXPORT_MESH_ANIMS:
+                sampler.add_pose(ob_main)
+
+        yield from sampler.sample_steps()
+        return sampler
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write_header(out):
+        # Get current plugin version
+        plugin_version = get_plugin_version()
+
+        out.write("*3DSMAX_EUROEXPORT	300\n")
+        if STABLE_HEADER:
+            out.write('*COMMENT "Eurocom Export Version  3.00\n')
+        else:
+            out.write('*COMMENT "Eurocom Export Version  3.00 - %s\n' % datetime.now().strftime("%A %B %d %Y %H:%M"))
+        out.write('*COMMENT "Version of Blender that output this file: %s"\n' % bpy.app.version_string)
+        out.write('*COMMENT "Version of ESE Plug-in: %d.%d.%d"\n\n' % (plugin_version[0], plugin_version[1], plugin_version[2]))
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write_clip_animation(out, scene, sampler):
+        # Only the animated nodes, by name, with the same blocks they have in the main file
+        for ob_main in scene.objects:
+            has_transform = ob_main.name in sampler.transforms or ob_main.name in sampler.transform_keys
+            obj_matrix_data = {
+                "name" : ob_main.name,
+                "type" : ob_main.type,
+                "matrix_original" : ob_main.matrix_world.copy(),
+                "matrix_transformed": ob_main.matrix_world.copy()
+            }
+
+            if ob_main.type == 'CAMERA' and ob_main.name in sampler.cameras:
+                out.write("*CAMERAOBJECT {\n")
+                out.write('\t*NODE_NAME "%s"\n' % ob_main.name)
+                write_camera_animation(out, ob_main, sampler)
+                write_animation_node(out, ob_main, obj_matrix_data, sampler)
+                out.write("}\n")
+            elif ob_main.type == 'LIGHT' and ob_main.name in sampler.lights:
+                out.write("*LIGHTOBJECT {\n")
+                out.write('\t*NODE_NAME "%s"\n' % ob_main.name)
+                write_light_animation(out, ob_main, ob_main.data.type, sampler)
+                write_animation_node(out, ob_main, obj_matrix_data, sampler)
+                out.write("}\n")
+            elif ob_main.type == 'ARMATURE' and ob_main.name in sampler.poses:
+                frame_mask = get_frame_mask(sampler, ob_main)
+                for bone_name, eland_matrices in get_bone_tracks(ob_main, sampler).items():
+                    transform_channels = get_transform_channels(eland_matrices, POSITION_TOLERANCE, ROTATION_TOLERANCE, SCALE_TOLERANCE)
+                    keep_frames = get_keyframes_to_keep(sampler.frames, *transform_channels, frame_mask)
+                    out.write('*BONEOBJECT {\n')
+                    out.write('*NODE_NAME "%s"\n' % bone_name)
+                    write_anim_frames(out, bone_name, sampler.frames, eland_matrices, keep_frames)
+                    out.write('}') # BONEOBJECT
+            elif has_transform or ob_main.name in sampler.shape_keys:
+                out.write("*GEOMOBJECT {\n")
+                out.write('\t*NODE_NAME "%s"\n' % ob_main.name)
+                write_animation_node(out, ob_main, obj_matrix_data, sampler)
+                if EXPORT_MESH_MORPH and ob_main.type == 'MESH':
+                    write_morph_data(out, ob_main, sampler)
+                out.write("}\n")
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write_clip_files(scene):
+        clip_object = bpy.context.view_layer.objects.active
+        clips = get_animation_clips(scene, clip_object, EXPORT_CLIPS, bpy.data.actions)
+        if not clips:
+            return
+
+        # Remember how the animation was set up, assigning the clip actions changes it
+        had_animation_data = clip_object is not None and clip_object.animation_data is not None
+        previous_action = clip_object.animation_data.action if had_animation_data else None
+        previous_mutes = [track.mute for track in clip_object.animation_data.nla_tracks] if had_animation_data else []
+
+        # Different clip names can clean up to the same file name, number them instead of overwriting
+        used_names = set()
+        clip_names = [get_unique_name(bpy.path.clean_name(clip["name"]), used_names) for clip in clips]
+
+        try:
+            for clip_index, clip in enumerate(clips):
+                if clip["action"] is not None:
+                    anim = clip_object.animation_data_create()
+                    for track in anim.nla_tracks:
+                        track.mute = True
+                    anim.action = clip["action"]
+
+                # One file per clip next to the main one; the static data is only in the main file
+                clip_filepath = Path(filepath).with_name('%s_%s%s' % (Path(filepath).stem, clip_names[clip_index], Path(filepath).suffix))
+                with open_eland_file(clip_filepath, get_write_buffer_size(context), COMPRESSION, COMPRESSION_LEVEL, pipelined=True, format_pool=get_format_pool(context)) as out:
+                    write_header(out)
+                    write_scene_data(out, scene, (clip["frame_start"], clip["frame_end"]))
+                    sampler = yield from scale_progress(sample_scene_animation(scene), clip_index / len(clips), (clip_index + 1) / len(clips))
+                    write_clip_animation(out, scene, sampler)
+        finally:
+            if had_animation_data:
+                clip_object.animation_data.action = previous_action
+                for track, mute in zip(clip_object.animation_data.nla_tracks, previous_mutes):
+                    track.mute = mute
+            elif clip_object is not None and clip_object.animation_data is not None:
+                clip_object.animation_data_clear()
+            scene.frame_set(EXPORT_STATIC_FRAME)
+
     #-------------------------------------------------------------------------------------------------------------------------------
     def write_ese_file():
         depsgraph = bpy.context.evaluated_depsgraph_get()
@@ -959,74 +1291,159 @@ def _write(context, filepath,
         if bpy.ops.object.mode_set.poll():
             bpy.ops.object.mode_set(mode='OBJECT')
 
-        # Get current plugin version
-        plugin_version = get_plugin_version()
+        # With clips, the main file only takes the first half of the progress and the clip files the rest
+        main_progress = 1.0 if EXPORT_CLIPS == 'NONE' else 0.5
 
-        # Create text file
-        with open(filepath, 'w', encoding="utf8",) as out:
-            # Header data
-            out.write("*3DSMAX_EUROEXPORT	300\n")
-            out.write('*COMMENT "Eurocom Export Version  3.00 - %s\n' % datetime.now().strftime("%A %B %d %Y %H:%M"))
-            out.write('*COMMENT "Version of Blender that output this file: %s"\n' % bpy.app.version_string)
-            out.write('*COMMENT "Version of ESE Plug-in: %d.%d.%d"\n\n' % (plugin_version[0], plugin_version[1], plugin_version[2]))
+        # Create text file, or a folder of them
+        start = time.perf_counter()
+        if SHARD_OUTPUT != 'NONE' and STREAM is None:
+            output = ShardedWriter(filepath, get_write_buffer_size(context), COMPRESSION, COMPRESSION_LEVEL, reopen=(SHARD_OUTPUT == 'COLLECTION'), format_pool=get_format_pool(context))
+        else:
+            output = open_eland_file(filepath, get_write_buffer_size(context), COMPRESSION, COMPRESSION_LEVEL, STREAM, pipelined=True, format_pool=get_format_pool(context))
 
-            write_scene_data(out, scene)
+        try:
+            with output as out:
+                # Header data
+                write_header(out)
+
+                write_scene_data(out, scene)
+                sampler = yield from scale_progress(sample_scene_animation(scene, EXPORT_CLIPS == 'NONE'), 0.0, SAMPLING_PROGRESS * main_progress)
             
-            scene_materials={}
-            if EXPORT_MATERIALS:
-                scene_materials = write_scene_materials(out)
-
-            if 'MESH' in EXPORT_OBJECTS:
-                write_mesh_data(out, scene, depsgraph, scene_materials)
-            if 'CAMERA' in EXPORT_OBJECTS:
-                write_camera_data(out, scene, depsgraph)
-            if 'LIGHT' in EXPORT_OBJECTS:
-                write_light_data(out, scene, depsgraph)
-            if 'ARMATURE' in EXPORT_OBJECTS:
-                write_biped_bones(out, scene, depsgraph)
-    write_ese_file()
+                scene_materials={}
+                if EXPORT_MATERIALS:
+                    scene_materials = write_scene_materials(out)
+
+                if 'MESH' in EXPORT_OBJECTS:
+                    yield from scale_progress(write_mesh_data(out, scene, depsgraph, scene_materials, sampler), SAMPLING_PROGRESS * main_progress, main_progress)
+                if 'CAMERA' in EXPORT_OBJECTS:
+                    write_camera_data(out, scene, depsgraph, sampler)
+                if 'LIGHT' in EXPORT_OBJECTS:
+                    write_light_data(out, scene, depsgraph, sampler)
+                if 'ARMATURE' in EXPORT_OBJECTS:
+                    write_biped_bones(out, scene, depsgraph, sampler)
+        except BaseException:
+            for cache_file in point_cache_files:
+                cache_file.discard()
+            raise
+
+        for cache_file in point_cache_files:
+            cache_file.close()
+
+        # What the dry run goes by next time
+        record_export_throughput('ESE', out.written_size, time.perf_counter() - start)
+
+        if EXPORT_CLIPS != 'NONE':
+            yield from scale_progress(write_clip_files(scene), main_progress, 1.0)
+    yield from write_ese_file()
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def save_steps(context, 
+               filepath, 
+               *, 
+               Output_Mesh_Definition,
+               Output_Materials, 
+               Output_Mesh_Anims, 
+               Output_CameraLightAnims,
+               Transform_Center,
+               Object_Types,
+               Output_Mesh_Normals,
+               Output_Mesh_UV,
+               Output_Mesh_Vertex_Colors,
+               Output_Mesh_Morph,
+               Static_Frame,
+               Decimal_Precision,
+               Output_Scale,
+               Enable_Start_From_Frame,
+               Start_From_Frame,
+               Enable_End_With_Frame,
+               End_With_Frame,
+               Output_First_Only,
+               Fast_Animation_Sampling,
+               Prune_Evaluation,
+               Reduce_Keyframes,
+               Position_Tolerance,
+               Rotation_Tolerance,
+               Scale_Tolerance,
+               Weight_Tolerance,
+               Focal_Length_Tolerance,
+               Controller_Type,
+               Frame_Step,
+               Clip_Source,
+               Output_Vertex_Animation,
+               Vertex_Motion_Threshold,
+               Use_Sample_Cache,
+               Sample_Cache_Size,
+               Precision_Mode,
+               Position_Precision,
+               UV_Precision,
+               Normal_Precision,
+               Color_Precision,
+               Weight_Precision,
+               Matrix_Precision,
+               Position_Error,
+               UV_Error,
+               Normal_Error,
+               Color_Error,
+               Weight_Error,
+               Matrix_Error,
+               Trim_Trailing_Zeros,
+               Compression,
+               Compression_Level,
+               Stable_Header,
+               Shard_Output,
+               stream=None):
+    """Same as save(), as a generator that exports a bit at a time and yields the progress from 0 to 1 in between.
+    Closing it cancels the export, leaving any file it was going to replace as it was."""
+
+    return _write(context, filepath,
+                  EXPORT_MESH_FLAGS=Output_Mesh_Definition,
+                  EXPORT_MATERIALS=Output_Materials,
+                  EXPORT_MESH_ANIMS=Output_Mesh_Anims, 
+                  EXPORT_CAMERA_LIGHT_ANIMS=Output_CameraLightAnims, 
+                  TRANSFORM_TO_CENTER = Transform_Center,
+                  EXPORT_OBJECTS=Object_Types,
+                  EXPORT_MESH_NORMALS=Output_Mesh_Normals,
+                  EXPORT_MESH_UV=Output_Mesh_UV,
+                  EXPORT_MESH_VCOLORS=Output_Mesh_Vertex_Colors,
+                  EXPORT_MESH_MORPH=Output_Mesh_Morph,
+                  EXPORT_STATIC_FRAME=Static_Frame,
+                  DECIMAL_PRECISION=Decimal_Precision,
+                  GLOBAL_SCALE=Output_Scale,
+                  EXPORT_FROM_FRAME_ENABLED=Enable_Start_From_Frame,
+                  EXPORT_FROM_FRAME=Start_From_Frame,
+                  EXPORT_END_FRAME_ENABLED=Enable_End_With_Frame,
+                  EXPORT_END_FRAME=End_With_Frame,
+                  EXPORT_FCURVES_DIRECT=Fast_Animation_Sampling,
+                  PRUNE_EVALUATION=Prune_Evaluation,
+                  EXPORT_REDUCE_KEYS=Reduce_Keyframes,
+                  POSITION_TOLERANCE=Position_Tolerance,
+                  ROTATION_TOLERANCE=Rotation_Tolerance,
+                  SCALE_TOLERANCE=Scale_Tolerance,
+                  WEIGHT_TOLERANCE=Weight_Tolerance,
+                  LENS_TOLERANCE=Focal_Length_Tolerance,
+                  EXPORT_KEYFRAME_TRACKS=(Controller_Type == 'KEYFRAMES'),
+                  FRAME_STEP=Frame_Step,
+                  EXPORT_CLIPS=Clip_Source,
+                  EXPORT_VERTEX_ANIMS=Output_Vertex_Animation,
+                  VERTEX_THRESHOLD=Vertex_Motion_Threshold,
+                  USE_SAMPLE_CACHE=Use_Sample_Cache,
+                  SAMPLE_CACHE_SIZE=Sample_Cache_Size,
+                  PRECISION_MODE=Precision_Mode,
+                  CHANNEL_PRECISIONS={'POSITION': Position_Precision, 'UV': UV_Precision, 'NORMAL': Normal_Precision,
+                                      'COLOR': Color_Precision, 'WEIGHT': Weight_Precision, 'MATRIX': Matrix_Precision},
+                  CHANNEL_ERRORS={'POSITION': Position_Error, 'UV': UV_Error, 'NORMAL': Normal_Error,
+                                  'COLOR': Color_Error, 'WEIGHT': Weight_Error, 'MATRIX': Matrix_Error},
+                  TRIM_ZEROS=Trim_Trailing_Zeros,
+                  COMPRESSION=Compression,
+                  COMPRESSION_LEVEL=Compression_Level,
+                  STABLE_HEADER=Stable_Header,
+                  SHARD_OUTPUT=Shard_Output,
+                  STREAM=stream)
 
 #-------------------------------------------------------------------------------------------------------------------------------
-def save(context, 
-         filepath, 
-         *, 
-         Output_Mesh_Definition,
-         Output_Materials, 
-         Output_Mesh_Anims, 
-         Output_CameraLightAnims,
-         Transform_Center,
-         Object_Types,
-         Output_Mesh_Normals,
-         Output_Mesh_UV,
-         Output_Mesh_Vertex_Colors,
-         Output_Mesh_Morph,
-         Static_Frame,
-         Decimal_Precision,
-         Output_Scale,
-         Enable_Start_From_Frame,
-         Start_From_Frame,
-         Enable_End_With_Frame,
-         End_With_Frame,
-         Output_First_Only):
-
-    _write(context, filepath,
-           EXPORT_MESH_FLAGS=Output_Mesh_Definition,
-           EXPORT_MATERIALS=Output_Materials,
-           EXPORT_MESH_ANIMS=Output_Mesh_Anims, 
-           EXPORT_CAMERA_LIGHT_ANIMS=Output_CameraLightAnims, 
-           TRANSFORM_TO_CENTER = Transform_Center,
-           EXPORT_OBJECTS=Object_Types,
-           EXPORT_MESH_NORMALS=Output_Mesh_Normals,
-           EXPORT_MESH_UV=Output_Mesh_UV,
-           EXPORT_MESH_VCOLORS=Output_Mesh_Vertex_Colors,
-           EXPORT_MESH_MORPH=Output_Mesh_Morph,
-           EXPORT_STATIC_FRAME=Static_Frame,
-           DECIMAL_PRECISION=Decimal_Precision,
-           GLOBAL_SCALE=Output_Scale,
-           EXPORT_FROM_FRAME_ENABLED=Enable_Start_From_Frame,
-           EXPORT_FROM_FRAME=Start_From_Frame,
-           EXPORT_END_FRAME_ENABLED=Enable_End_With_Frame,
-           EXPORT_END_FRAME=End_With_Frame)
+def save(context, filepath, **keywords):
+    for _ in save_steps(context, filepath, **keywords):
+        pass
 
     return {'FINISHED'}
 if __name__ == '__main__':
@@ -11,6 +11,8 @@ Authors: Swyter and Jmarti856
 
 import bpy
 import os
+import time
+import numpy as np
 import platform
 from pathlib import Path
 from math import degrees
@@ -18,6 +20,9 @@ from mathutils import Matrix
 from datetime import datetime
 from bpy_extras.node_shader_utils import PrincipledBSDFWrapper
 from .eland_utils import *
+from .eland_estimate import record_export_throughput
+from .eland_cache import SampleCache, CACHE_DIRECTORY_NAME
+from .eland_anim import AnimationSampler, CAMERA_PROPERTIES, reduce_keyframes, get_transform_channels, get_object_frame_step, get_sampling_step
 
 #-------------------------------------------------------------------------------------------------------------------------------
 EXPORT_TRI = True
@@ -47,11 +52,23 @@ def _write(context, filepath,
            EXPORT_FROM_FRAME_ENABLED,
            EXPORT_FROM_FRAME,
            EXPORT_END_FRAME_ENABLED,
-           EXPORT_END_FRAME
+           EXPORT_END_FRAME,
+           EXPORT_FCURVES_DIRECT,
+           PRUNE_EVALUATION,
+           EXPORT_REDUCE_KEYS,
+           POSITION_TOLERANCE,
+           ROTATION_TOLERANCE,
+           SCALE_TOLERANCE,
+           LENS_TOLERANCE,
+           FRAME_STEP,
+           USE_SAMPLE_CACHE,
+           SAMPLE_CACHE_SIZE,
+           COMPRESSION,
+           COMPRESSION_LEVEL,
+           STREAM=None
         ):
     
     df = f'%.{DECIMAL_PRECISION}f'
-    dcf = f'{{:>{DECIMAL_PRECISION}f}}'
 
     #-------------------------------------------------------------------------------------------------------------------------------
     def get_camera_objects(scene, depsgraph):
@@ -89,6 +106,26 @@ def _write(context, filepath,
                 })
 
         return cameras
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_light_objects(scene):
+        lights = []
+
+        for ob_main in sorted([obj for obj in scene.objects if obj.type == 'LIGHT'], key=lambda obj: obj.name):
+            obj_matrix_data = {
+                "name": ob_main.name,
+                "type": ob_main.type,
+                "matrix_original": ob_main.matrix_world.copy(),
+                "matrix_transformed": ob_main.matrix_world.copy()
+            }
+
+            lights.append({
+                "ob": ob_main,
+                "ob_main": ob_main,
+                "obj_matrix_data": obj_matrix_data
+            })
+
+        return lights
     
     #-------------------------------------------------------------------------------------------------------------------------------
     def get_mesh_objects(scene, depsgraph):
@@ -155,7 +192,7 @@ def _write(context, filepath,
         return meshes
     
     #-------------------------------------------------------------------------------------------------------------------------------
-    def write_scene_hierarchy(out, scene, cameras, meshes):
+    def write_scene_hierarchy(out, scene, cameras, meshes, lights):
         global FRAMES_COUNT, TICKS_PER_FRAME, START_FRAME, END_FRAME
 
         #Get set default scene data
@@ -176,28 +213,89 @@ def _write(context, filepath,
         for idx, camera in enumerate(cameras):
             out.write("\tCamera%d 1 CAMERA %s\n" % (idx, camera['ob'].name))
         for idx, mesh in enumerate(meshes):
-            out.write("\%s 1 MESH %sShape\n" % (mesh['ob'].name, mesh['ob'].name))
+            out.write("\t%s 1 MESH %sShape\n" % (mesh['ob'].name, mesh['ob'].name))
+        for idx, light in enumerate(lights):
+            out.write("\tLight%d 1 LIGHT %s\n" % (idx, light['ob'].name))
         out.write("}\n\n")
         out.write("\n")
 
         out.write("*SCENE_FRAMES_PER_SECOND %u" % bpy.context.scene.render.fps + "\n")
 
     #-------------------------------------------------------------------------------------------------------------------------------
-    def write_camera_scene_frames(out, cameras):
-        for camera_index, camera in enumerate(cameras):
-            ob_main = camera['ob_main']
+    def get_sample_cache():
+        if not USE_SAMPLE_CACHE:
+            return None
+        return SampleCache(Path(filepath).parent / CACHE_DIRECTORY_NAME, SAMPLE_CACHE_SIZE * 1024 * 1024)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_keyframes_to_keep(times, values, tolerances, frame_mask):
+        # Only the frames on the step of the object are candidates, the reduction works on top of those
+        keep_frames = frame_mask.copy()
+        if EXPORT_REDUCE_KEYS:
+            keep_frames[keep_frames] = reduce_keyframes(times[keep_frames], values[keep_frames], tolerances)
+        return keep_frames
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_frame_mask(sampler, ob):
+        return sampler.get_frame_mask(get_object_frame_step(ob, FRAME_STEP))
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_scene_frames_to_keep(sampler, objects):
+        # Every scene frame holds all the nodes, so a frame can only go away if none of them need it
+        channels, tolerances = [np.empty((len(sampler.frames), 0))], []
+        frame_mask = np.zeros(len(sampler.frames), dtype=bool) if objects else sampler.get_frame_mask(FRAME_STEP)
+        for ob in objects:
+            frame_mask |= get_frame_mask(sampler, ob)
+            object_channels, object_tolerances = get_transform_channels(sampler.transforms[ob.name], POSITION_TOLERANCE, ROTATION_TOLERANCE, SCALE_TOLERANCE)
+            channels.append(object_channels)
+            tolerances += object_tolerances
+
+        return get_keyframes_to_keep(sampler.frames, np.concatenate(channels, axis=1), tolerances, frame_mask)
 
-            eland_data = create_euroland_matrix(ob_main.matrix_world.copy(), ob_main.type)
-            eland_matrix = eland_data["eland_matrix"]
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_scene_nodes(cameras, meshes, lights, sampler):
+        # Cameras always go in, the rest of the nodes only when they actually move
+        scene_nodes = []
+        if EXPORT_CAMERA_LIGHT_ANIMS:
+            scene_nodes += [("Camera%d" % camera_index, camera) for camera_index, camera in enumerate(cameras)]
+        if EXPORT_MESH_ANIMS:
+            # Dupli children have no track of their own, they share the one of their instancer
+            scene_nodes += [(mesh['ob'].name, mesh) for mesh in meshes if mesh['ob'] == mesh['ob_main'] and mesh['ob_main'].name in sampler.transforms]
+        if EXPORT_CAMERA_LIGHT_ANIMS:
+            scene_nodes += [("Light%d" % light_index, light) for light_index, light in enumerate(lights) if light['ob_main'].name in sampler.transforms]
+        return scene_nodes
 
-            out.write(f'\tCamera%d' % (camera_index))
-            out.write(f' {df} {df} {df}' % (eland_matrix[0].x, eland_matrix[0].y, eland_matrix[0].z))
-            out.write(f' {df} {df} {df}' % (eland_matrix[1].x, eland_matrix[1].y, eland_matrix[1].z))
-            out.write(f' {df} {df} {df}' % (eland_matrix[2].x, eland_matrix[2].y, eland_matrix[2].z))
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def write_scene_frame_nodes(out, scene_nodes, eland_rows, frame_index):
+        for (node_name, _), rows in zip(scene_nodes, eland_rows):
+            out.write(f'\t%s' % (node_name))
+            out.write((f' {df}' * 12 + '\n') % tuple(rows[frame_index]))
 
-            #Transform position
-            obj_position = eland_matrix.translation
-            out.write(f' {df} {df} {df}\n' % (obj_position.x, obj_position.y, obj_position.z*-1))
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_scene_rows(scene_nodes, sampler):
+        # Convert every sampled track in one go; rows hold the rotation rows and the position, Z inverted
+        eland_rows = []
+        for _, node in scene_nodes:
+            ob_main = node['ob_main']
+            matrices = sampler.transforms[ob_main.name]
+            if ob_main.type == 'CAMERA':
+                eland_matrices, _ = create_euroland_matrices(matrices, ob_main.type)
+            else:
+                if ob_main.type != 'LIGHT':
+                    # The vertices already carry the transform of the static frame, the track only has to move them from there
+                    static_matrix = np.array(node['obj_matrix_data']["matrix_transformed"], dtype=np.float64)
+                    matrices = np.matmul(matrices, np.linalg.inv(static_matrix))
+                # Lights have nothing else carrying their placement, like cameras their track stays in world space
+                eland_matrices, _ = create_euroland_matrices(matrices, ob_main.type)
+
+                # Same Z flip as the written vertices, the position one is done below together with the cameras
+                eland_matrices[:, 2, :3] *= -1
+                eland_matrices[:, :3, 2] *= -1
+
+            rows = np.concatenate((eland_matrices[:, :3, :3].reshape(-1, 9), eland_matrices[:, :3, 3]), axis=1)
+            rows[:, 11] *= -1
+            eland_rows.append(rows.tolist())
+        return eland_rows
 
     #-------------------------------------------------------------------------------------------------------------------------------
     def write_camera_list(out, cameras):
@@ -208,14 +306,17 @@ def _write(context, filepath,
         out.write("}" + "\n")
 
     #-------------------------------------------------------------------------------------------------------------------------------
-    def write_camera_animation(out, scene, cameras):
+    def write_camera_animation(out, cameras, sampler):
+        lens_column = CAMERA_PROPERTIES.index('lens')
+
         out.write("*CAMERA_ANIMATION {"+"\n")
         for camera_index, camera in enumerate(cameras):
             out.write("\tCamera%d focalLength " % (camera_index))
+            lens_values = sampler.cameras[camera['ob'].name][:, lens_column]
+            keep_frames = get_keyframes_to_keep(sampler.frames, lens_values, [LENS_TOLERANCE], get_frame_mask(sampler, camera['ob_main']))
+
             #for f in keyframes:
-            for frame in range(START_FRAME, END_FRAME + 1):
-                scene.frame_set(frame)
-                len_val = camera['ob'].data.lens
+            for frame, len_val in zip(sampler.frames[keep_frames], lens_values[keep_frames]):
                 # The curve's points has a 'co' vector giving the frame and the value
                 out.write("%u %u " % (frame, len_val))
             out.write("\n")
@@ -225,7 +326,9 @@ def _write(context, filepath,
     #-------------------------------------------------------------------------------------------------------------------------------
     def write_scene_mesh(out, scene, meshes):
         out.write("*MESH {"+"\n")
-        for mesh in meshes:
+        for mesh_index, mesh in enumerate(meshes):
+            yield mesh_index / len(meshes)
+
             me = mesh['me']
             ob = mesh['ob'] 
 
@@ -236,8 +339,7 @@ def _write(context, filepath,
 
             #Vertex list
             out.write('\t*VERT_XYXRGBA %d{\n' % (len(unique_vertices)))
-            for vertex in unique_vertices:
-                out.write(f'\t\t{df} {df} {df}\n' % (vertex[0], vertex[1], vertex[2]*-1))
+            out.table(f'\t\t{df} {df} {df}\n', np.multiply(np.reshape(unique_vertices, (-1, 3)), (1, 1, -1)))
             out.write('\t}\n')
 
             # Create mapping lists
@@ -345,7 +447,8 @@ def _write(context, filepath,
         # Get current plugin version
         plugin_version = get_plugin_version()
 
-        with open(filepath, 'w', encoding="utf8",) as out:
+        start = time.perf_counter()
+        with open_eland_file(filepath, get_write_buffer_size(context), COMPRESSION, COMPRESSION_LEVEL, STREAM, pipelined=True, format_pool=get_format_pool(context)) as out:
             out.write("EUROCOM_RTG 5.01"+"\n")
             out.write('*COMMENT "Version of Blender that output this file: %s"\n' % bpy.app.version_string)
             out.write('*COMMENT "Version of RTG Plug-in: %d.%d.%d"\n\n' % (plugin_version[0], plugin_version[1], plugin_version[2]))
@@ -359,72 +462,135 @@ def _write(context, filepath,
             scene_meshes = []
             if 'MESH' in EXPORT_OBJECTS:
                 scene_meshes = get_mesh_objects(scene, depsgraph)
+
+            scene_lights = []
+            if 'LIGHT' in EXPORT_OBJECTS:
+                scene_lights = get_light_objects(scene)
             
             #Write scene hirearchy
-            write_scene_hierarchy(out, scene, scene_cameras, scene_meshes)
-
-            #Write scene animated frames
+            write_scene_hierarchy(out, scene, scene_cameras, scene_meshes, scene_lights)
+
+            # Step the timeline once for everything animated; the scene frames of every node and the focal lengths come from here
+            sampler = AnimationSampler(scene, START_FRAME, END_FRAME, EXPORT_FCURVES_DIRECT, get_sampling_step(scene.objects, FRAME_STEP), get_sample_cache(), PRUNE_EVALUATION)
+            for camera in scene_cameras:
+                if EXPORT_CAMERA_LIGHT_ANIMS:
+                    # Cameras have no other place for their placement, so even static ones go in every scene frame
+                    sampler.add_transform(camera['ob_main'], skip_static=False)
+                sampler.add_camera(camera['ob'])
+            if EXPORT_MESH_ANIMS:
+                for mesh in scene_meshes:
+                    if mesh['ob'] == mesh['ob_main']:
+                        sampler.add_transform(mesh['ob_main'])
             if EXPORT_CAMERA_LIGHT_ANIMS:
-                for frame in range(START_FRAME, END_FRAME + 1):
-                    scene.frame_set(frame)
+                # Same as cameras, a static light still needs its placement in every scene frame
+                for light in scene_lights:
+                    sampler.add_transform(light['ob_main'], skip_static=False)
+            yield from scale_progress(sampler.sample_steps(), 0.0, SAMPLING_PROGRESS)
 
-                    out.write("*SCENE_FRAME %u {\n" % frame)
-                    if scene_cameras:
-                        write_camera_scene_frames(out, scene_cameras)
-                    out.write("}\n")
+            # The scene frames and the meshes split the rest of the progress
+            frames_progress = SAMPLING_PROGRESS + (1.0 - SAMPLING_PROGRESS) / 2
+
+            #Write scene animated frames
+            scene_nodes = get_scene_nodes(scene_cameras, scene_meshes, scene_lights, sampler)
+            if EXPORT_CAMERA_LIGHT_ANIMS or scene_nodes:
+                keep_frames = get_scene_frames_to_keep(sampler, [node['ob_main'] for _, node in scene_nodes])
+                eland_rows = get_scene_rows(scene_nodes, sampler)
+                for frame_index, frame in enumerate(sampler.frames):
+                    yield SAMPLING_PROGRESS + (frames_progress - SAMPLING_PROGRESS) * frame_index / len(sampler.frames)
+                    if not keep_frames[frame_index]:
+                        continue
+
+                    with out.begin_block("*SCENE_FRAME %u" % frame):
+                        write_scene_frame_nodes(out, scene_nodes, eland_rows, frame_index)
 
             #Output Meshes if required
             if 'MESH' in EXPORT_OBJECTS:
-                write_scene_mesh(out, scene, scene_meshes)
+                yield from scale_progress(write_scene_mesh(out, scene, scene_meshes), frames_progress, 1.0)
 
             #Output Cameras if required
             if 'CAMERA' in EXPORT_OBJECTS:
                 write_camera_list(out, scene_cameras)
-                write_camera_animation(out, scene, scene_cameras)
+                write_camera_animation(out, scene_cameras, sampler)
+
+        # What the dry run goes by next time
+        record_export_throughput('RTG', out.written_size, time.perf_counter() - start)
 
-    write_rtg_file()
+    yield from write_rtg_file()
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def save_steps(context, 
+               filepath, 
+               *, 
+               Output_Mesh_Definition,
+               Output_Materials, 
+               Output_Mesh_Anims, 
+               Output_CameraLightAnims,
+               Transform_Center,
+               Object_Types,
+               Output_Mesh_Normals,
+               Output_Mesh_UV,
+               Output_Mesh_Vertex_Colors,
+               Output_Mesh_Morph,
+               Static_Frame,
+               Decimal_Precision,
+               Output_Scale,
+               Enable_Start_From_Frame,
+               Start_From_Frame,
+               Enable_End_With_Frame,
+               End_With_Frame,
+               Output_First_Only,
+               Fast_Animation_Sampling,
+               Prune_Evaluation,
+               Reduce_Keyframes,
+               Position_Tolerance,
+               Rotation_Tolerance,
+               Scale_Tolerance,
+               Focal_Length_Tolerance,
+               Frame_Step,
+               Use_Sample_Cache,
+               Sample_Cache_Size,
+               Compression,
+               Compression_Level,
+               stream=None):
+    """Same as save(), as a generator that exports a bit at a time and yields the progress from 0 to 1 in between.
+    Closing it cancels the export, leaving any file it was going to replace as it was."""
+
+    return _write(context, filepath,
+                  EXPORT_MESH_FLAGS=Output_Mesh_Definition,
+                  EXPORT_MATERIALS=Output_Materials,
+                  EXPORT_MESH_ANIMS=Output_Mesh_Anims, 
+                  EXPORT_CAMERA_LIGHT_ANIMS=Output_CameraLightAnims, 
+                  TRANSFORM_TO_CENTER = Transform_Center,
+                  EXPORT_OBJECTS=Object_Types,
+                  EXPORT_MESH_NORMALS=Output_Mesh_Normals,
+                  EXPORT_MESH_UV=Output_Mesh_UV,
+                  EXPORT_MESH_VCOLORS=Output_Mesh_Vertex_Colors,
+                  EXPORT_MESH_MORPH=Output_Mesh_Morph,
+                  EXPORT_STATIC_FRAME=Static_Frame,
+                  DECIMAL_PRECISION=Decimal_Precision,
+                  GLOBAL_SCALE=Output_Scale,
+                  EXPORT_FROM_FRAME_ENABLED=Enable_Start_From_Frame,
+                  EXPORT_FROM_FRAME=Start_From_Frame,
+                  EXPORT_END_FRAME_ENABLED=Enable_End_With_Frame,
+                  EXPORT_END_FRAME=End_With_Frame,
+                  EXPORT_FCURVES_DIRECT=Fast_Animation_Sampling,
+                  PRUNE_EVALUATION=Prune_Evaluation,
+                  EXPORT_REDUCE_KEYS=Reduce_Keyframes,
+                  POSITION_TOLERANCE=Position_Tolerance,
+                  ROTATION_TOLERANCE=Rotation_Tolerance,
+                  SCALE_TOLERANCE=Scale_Tolerance,
+                  LENS_TOLERANCE=Focal_Length_Tolerance,
+                  FRAME_STEP=Frame_Step,
+                  USE_SAMPLE_CACHE=Use_Sample_Cache,
+                  SAMPLE_CACHE_SIZE=Sample_Cache_Size,
+                  COMPRESSION=Compression,
+                  COMPRESSION_LEVEL=Compression_Level,
+                  STREAM=stream)
 
 #-------------------------------------------------------------------------------------------------------------------------------
-def save(context, 
-         filepath, 
-         *, 
-         Output_Mesh_Definition,
-         Output_Materials, 
-         Output_Mesh_Anims, 
-         Output_CameraLightAnims,
-         Transform_Center,
-         Object_Types,
-         Output_Mesh_Normals,
-         Output_Mesh_UV,
-         Output_Mesh_Vertex_Colors,
-         Output_Mesh_Morph,
-         Static_Frame,
-         Decimal_Precision,
-         Output_Scale,
-         Enable_Start_From_Frame,
-         Start_From_Frame,
-         Enable_End_With_Frame,
-         End_With_Frame,
-         Output_First_Only):
-
-    _write(context, filepath,
-           EXPORT_MESH_FLAGS=Output_Mesh_Definition,
-           EXPORT_MATERIALS=Output_Materials,
-           EXPORT_MESH_ANIMS=Output_Mesh_Anims, 
-           EXPORT_CAMERA_LIGHT_ANIMS=Output_CameraLightAnims, 
-           TRANSFORM_TO_CENTER = Transform_Center,
-           EXPORT_OBJECTS=Object_Types,
-           EXPORT_MESH_NORMALS=Output_Mesh_Normals,
-           EXPORT_MESH_UV=Output_Mesh_UV,
-           EXPORT_MESH_VCOLORS=Output_Mesh_Vertex_Colors,
-           EXPORT_MESH_MORPH=Output_Mesh_Morph,
-           EXPORT_STATIC_FRAME=Static_Frame,
-           DECIMAL_PRECISION=Decimal_Precision,
-           GLOBAL_SCALE=Output_Scale,
-           EXPORT_FROM_FRAME_ENABLED=Enable_Start_From_Frame,
-           EXPORT_FROM_FRAME=Start_From_Frame,
-           EXPORT_END_FRAME_ENABLED=Enable_End_With_Frame,
-           EXPORT_END_FRAME=End_With_Frame)
+def save(context, filepath, **keywords):
+    for _ in save_steps(context, filepath, **keywords):
+        pass
 
     return {'FINISHED'}
 if __name__ == '__main__':
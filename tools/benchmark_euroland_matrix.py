@@ -0,0 +1,53 @@
+"""
+Compares create_euroland_matrix() frame by frame against the batched create_euroland_matrices().
+
+Needs Blender's Python, run it from the repository root with:
+    blender --background --python tools/benchmark_euroland_matrix.py -- [frames]
+"""
+
+import os
+import sys
+import time
+import numpy as np
+from mathutils import Matrix
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io_scene_sphinx.eland_utils import create_euroland_matrix, create_euroland_matrices
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def random_world_matrices(count, seed=0):
+    rng = np.random.default_rng(seed)
+    angles = rng.uniform(-np.pi, np.pi, (count, 3))
+    matrices = np.empty((count, 4, 4), dtype=np.float32)
+    for i, (x, y, z) in enumerate(angles):
+        rotation = Matrix.Rotation(z, 4, 'Z') @ Matrix.Rotation(y, 4, 'Y') @ Matrix.Rotation(x, 4, 'X')
+        scale = Matrix.Diagonal((*rng.uniform(0.1, 4.0, 3), 1.0))
+        world = rotation @ scale
+        world.translation = rng.uniform(-100.0, 100.0, 3)
+        matrices[i] = world
+    return matrices
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def benchmark(matrices, obj_type):
+    start = time.perf_counter()
+    reference = [create_euroland_matrix(Matrix(matrix), obj_type) for matrix in matrices]
+    per_frame_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    eland_matrices, eland_eulers = create_euroland_matrices(matrices, obj_type)
+    batched_time = time.perf_counter() - start
+
+    matrix_error = max(np.abs(np.array(data["eland_matrix"]) - eland_matrix).max() for data, eland_matrix in zip(reference, eland_matrices))
+    euler_error = max(np.abs(np.array(data["eland_euler"]) - eland_euler).max() for data, eland_euler in zip(reference, eland_eulers))
+
+    print('%-7s per frame %8.3f ms | batched %8.3f ms | x%-7.1f | max error matrix %.2e euler %.2e' % (obj_type, per_frame_time * 1000, batched_time * 1000, per_frame_time / batched_time, matrix_error, euler_error))
+
+#-------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    frames_count = int(argv[0]) if argv else 10000
+
+    print('%d random matrices' % frames_count)
+    world_matrices = random_world_matrices(frames_count)
+    for object_type in ('MESH', 'CAMERA'):
+        benchmark(world_matrices, object_type)
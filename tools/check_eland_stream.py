@@ -0,0 +1,144 @@
+"""
+Checks that an export streamed to a UNIX socket or a file descriptor gets there byte for byte the same as when it
+goes to a file, with tools/eland_stream_consumer.py on the other end.
+
+Needs Blender's Python, run it from the repository root with:
+    blender --background --python-exit-code 1 --python tools/check_eland_stream.py
+"""
+
+import os
+import sys
+import socket
+import tempfile
+import threading
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from io_scene_sphinx.eland_utils import open_eland_file, get_target_stream, SocketStream
+from eland_stream_consumer import consume
+
+#-------------------------------------------------------------------------------------------------------------------------------
+# Small enough for the text to go out in a lot of separate writes
+CHECK_BUFFER_SIZE = 256
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def write_sample_export(out):
+    """Something shaped like an export, going through every way the exporters have of writing text."""
+
+    rng = np.random.default_rng(0)
+    out.write('*3DSMAX_EUROEXPORT\t300\n')
+    out.write('*COMMENT "Stream check"\n')
+    with out.begin_block('*GEOMOBJECT'):
+        out.write('\t*NODE_NAME "Mesh"\n')
+        with out.begin_block('*MESH_VERTEX_LIST', 1):
+            out.table('\t\t\t*MESH_VERTEX %5d\t%.6f\t%.6f\t%.6f\n', rng.uniform(-100.0, 100.0, (5000, 3)), index_start=0)
+        with out.begin_block('*MESH_TVERTLIST', 1):
+            out.table('\t\t\t*MESH_TVERT %5d\t%.5f\t%.5f\t%.5f\n', rng.uniform(0.0, 1.0, (3000, 3)).round(2), index_start=0, trim_zeros=True)
+        with out.begin_block('*MESH_FACE_LIST', 1):
+            out.rows('\t\t\t*MESH_FACE %d: A: %d B: %d C: %d\n', [(face, face, face + 1, face + 2) for face in range(2000)])
+    out.write('}\n')
+
+#-------------------------------------------------------------------------------------------------------------------------------
+class StreamExportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def get_file_export(self, pipelined):
+        filepath = os.path.join(self.directory.name, 'file.ese')
+        with open_eland_file(filepath, CHECK_BUFFER_SIZE, pipelined=pipelined) as out:
+            write_sample_export(out)
+        with open(filepath, 'rb') as exported:
+            return exported.read()
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def start_consumer(self, connect):
+        """Runs the stand-in consumer on whatever connect() returns, on a thread; gives back the path of its copy."""
+
+        copy_path = os.path.join(self.directory.name, 'copy.ese')
+        errors = []
+
+        def run():
+            try:
+                with connect() as connection:
+                    consume(connection, copy_path)
+            except BaseException as error:
+                errors.append(error)
+
+        consumer = threading.Thread(target=run, daemon=True)
+        consumer.start()
+        return consumer, copy_path, errors
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def check_consumer(self, consumer, copy_path, errors, expected):
+        consumer.join(10.0)
+        self.assertFalse(consumer.is_alive(), 'the consumer never saw the end of the stream')
+        self.assertEqual(errors, [])
+        with open(copy_path, 'rb') as received:
+            self.assertEqual(received.read(), expected)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def test_unix_socket(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            self.skipTest('no UNIX sockets here')
+
+        socket_path = os.path.join(self.directory.name, 'eland.sock')
+        for pipelined in (False, True):
+            with self.subTest(pipelined=pipelined), socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+                server.bind(socket_path)
+                server.listen(1)
+                consumer, copy_path, errors = self.start_consumer(lambda: server.accept()[0])
+
+                with open_eland_file(None, CHECK_BUFFER_SIZE, stream='unix:' + socket_path, pipelined=pipelined) as out:
+                    write_sample_export(out)
+
+                self.check_consumer(consumer, copy_path, errors, self.get_file_export(pipelined))
+                os.remove(socket_path)
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def test_file_descriptor(self):
+        for pipelined in (False, True):
+            with self.subTest(pipelined=pipelined):
+                export_end, consumer_end = socket.socketpair()
+                consumer, copy_path, errors = self.start_consumer(lambda: consumer_end)
+
+                # The descriptor stays open after the export, the end of the stream is up to its owner
+                with export_end:
+                    with open_eland_file(None, CHECK_BUFFER_SIZE, stream=export_end.fileno(), pipelined=pipelined) as out:
+                        write_sample_export(out)
+                    export_end.shutdown(socket.SHUT_WR)
+
+                self.check_consumer(consumer, copy_path, errors, self.get_file_export(pipelined))
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def test_refused_socket(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            self.skipTest('no UNIX sockets here')
+
+        with self.assertRaises(OSError):
+            get_target_stream('unix:' + os.path.join(self.directory.name, 'nobody.sock'))
+
+    #-------------------------------------------------------------------------------------------------------------------------------
+    def test_socket_stream_closes_its_end(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            self.skipTest('no UNIX sockets here')
+
+        socket_path = os.path.join(self.directory.name, 'eland.sock')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(socket_path)
+            server.listen(1)
+            stream = SocketStream(socket_path)
+            connection, _ = server.accept()
+            with connection:
+                stream.write(b'*ESE\n')
+                stream.close()
+                self.assertEqual(connection.recv(64), b'*ESE\n')
+                self.assertEqual(connection.recv(64), b'')
+
+#-------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    result = unittest.main(argv=[sys.argv[0]], exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
@@ -0,0 +1,81 @@
+"""
+Stand-in for the Euroland conversion step, reading an export from a UNIX socket while it is being written.
+
+Start it first, then export with the stream argument pointing at the same socket, e.g. from Blender's Python:
+    python tools/eland_stream_consumer.py /tmp/eland.sock [copy.ese]
+    io_scene_sphinx.ese_export.save(bpy.context, 'scene.ese', stream='unix:/tmp/eland.sock', ...)
+
+Every connection is one exported file. The tool prints when the first bytes arrive and what it got once the
+exporter closes its end, so the overlap with the export can be seen. Stop it with Ctrl+C.
+
+tools/check_eland_stream.py runs it against exports on its own and compares what it gets with a file export.
+"""
+
+import os
+import sys
+import time
+import socket
+
+#-------------------------------------------------------------------------------------------------------------------------------
+def consume(connection, copy_path=None):
+    start = time.perf_counter()
+    first_data_time = None
+    total_size = 0
+    lines_count = 0
+    blocks_count = 0
+    pending = b''
+
+    copy_file = open(copy_path, 'wb') if copy_path else None
+    try:
+        while True:
+            data = connection.recv(1024 * 1024)
+            if not data:
+                break
+
+            if first_data_time is None:
+                first_data_time = time.perf_counter() - start
+                print('first data after %.3f s' % first_data_time)
+
+            if copy_file:
+                copy_file.write(data)
+
+            # Only look at complete lines, the last one may continue in the next chunk
+            total_size += len(data)
+            lines = (pending + data).split(b'\n')
+            pending = lines.pop()
+            lines_count += len(lines)
+            blocks_count += sum(1 for line in lines if line.rstrip().endswith(b'{'))
+    finally:
+        if copy_file:
+            copy_file.close()
+
+    elapsed_time = time.perf_counter() - start
+    print('%d bytes | %d lines | %d blocks | %.3f s | %.1f MB/s' % (total_size, lines_count, blocks_count, elapsed_time, total_size / max(elapsed_time, 1e-9) / (1024 * 1024)))
+
+#-------------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    socket_path = sys.argv[1]
+    copy_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    print('waiting on %s' % socket_path)
+
+    try:
+        while True:
+            connection, _ = server.accept()
+            with connection:
+                consume(connection, copy_path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(socket_path)